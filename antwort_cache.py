@@ -0,0 +1,209 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from time import time
+
+from kontext import estimate_tokens
+
+
+def normalize_text(text):
+    """Klein, Leerzeichen zusammengefasst, Satzzeichen am Ende weg"""
+    t = " ".join((text or "").lower().split())
+    return re.sub(r"[\s?!.,;:…]+$", "", t)
+
+
+def cache_key(model, system_prompt, history, input_content):
+    """Hash aus Modell, System-Prompt und normalisiertem Nachrichtenfenster"""
+    window = [[m["role"], normalize_text(m["content"])] for m in (history or [])]
+    window.append(["user", normalize_text(input_content)])
+    raw = json.dumps([model, system_prompt.strip(), window], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class CachePolicy:
+    """Legt fest, welche Anfragen überhaupt gecacht werden dürfen"""
+
+    def __init__(self, models=("llama3.1:8b",), allow_deep_think=False, max_kontext_tokens=256,
+                 max_history_messages=None):
+        self.models = set(models) if models else None   # None = alle Modelle
+        self.allow_deep_think = allow_deep_think
+        self.max_kontext_tokens = max_kontext_tokens
+        self.max_history_messages = max_history_messages
+
+    def eligible(self, model, deep_think, history, input_content):
+        if self.models is not None and model not in self.models:
+            return False
+        if deep_think and not self.allow_deep_think:
+            return False
+        if self.max_history_messages is not None and len(history or []) > self.max_history_messages:
+            return False
+        tokens = estimate_tokens(input_content) + sum(estimate_tokens(m["content"]) for m in history or [])
+        return tokens <= self.max_kontext_tokens
+
+    def key(self, model, deep_think, system_prompt, history, input_content):
+        """Cache-Key, oder None wenn die Anfrage nicht gecacht werden soll"""
+        if not self.eligible(model, deep_think, history, input_content):
+            return None
+        return cache_key(model, system_prompt, history, input_content)
+
+
+class SqliteStore:
+    """Optionale zweite Stufe: Antworten in einer eigenen SQLite-Datei"""
+
+    def __init__(self, path, ttl=3600):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS antwort_cache ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT value, expires FROM antwort_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if not row:
+            return None
+        if row[1] < time():
+            with self._conn() as conn:
+                conn.execute("DELETE FROM antwort_cache WHERE key = ?", (key,))
+            return None
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO antwort_cache (key, value, expires) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), time() + self.ttl),
+            )
+
+    def purge(self):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM antwort_cache WHERE expires < ?", (time(),))
+
+
+class AntwortCache:
+    """LRU-Cache im Prozess mit TTL und Größenlimit, optional mit zweiter Stufe"""
+
+    def __init__(self, max_entries=1000, max_bytes=5 * 1024 * 1024, ttl=3600, store=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.store = store
+
+        self._items = OrderedDict()      # key -> (value, expires, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _size(value):
+        return len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+    def _drop(self, key):
+        _value, _expires, size = self._items.pop(key)
+        self._bytes -= size
+
+    def get(self, key):
+        now = time()
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                value, expires, _size = item
+                if expires >= now:
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._drop(key)
+
+        value = self.store.get(key) if self.store else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.store_hits += 1
+        self._put_local(key, value)
+        return value
+
+    def put(self, key, value):
+        self._put_local(key, value)
+        if self.store:
+            self.store.put(key, value)
+
+    def _put_local(self, key, value):
+        size = self._size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self._drop(key)
+            self._items[key] = (value, time() + self.ttl, size)
+            self._bytes += size
+            while len(self._items) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._items)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.store_hits + self.misses
+            return {
+                "entries": len(self._items),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "store_hits": self.store_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round((self.hits + self.store_hits) / lookups, 3) if lookups else 0.0,
+            }
+
+
+def lookup_cached(cache, policy, input_content, system_prompt, model, deep_think, history):
+    """(key, hit) für eine Anfrage; key ist None, wenn sie nicht gecacht werden darf"""
+    key = policy.key(model, deep_think, system_prompt, history, input_content) if cache else None
+    return key, (cache.get(key) if key else None)
+
+
+def store_cached(cache, key, reply, think):
+    """Antwort unter key ablegen (leere Antworten nicht)"""
+    if key and reply:
+        cache.put(key, {"reply": reply, "think": think})
+
+
+def ask_cached(cache, policy, ask_fn, input_content, system_prompt="", model="llama3.1:8b",
+               deep_think=False, history=None, **kwargs):
+    """ask_fn (Signatur wie ask_deepseek) mit Antwort-Cache davor"""
+    key, hit = lookup_cached(cache, policy, input_content, system_prompt, model, deep_think, history)
+    if hit is not None:
+        return hit["reply"], hit["think"]
+
+    reply, think = ask_fn(
+        input_content=input_content,
+        system_prompt=system_prompt,
+        model=model,
+        deep_think=deep_think,
+        history=history,
+        **kwargs,
+    )
+    store_cached(cache, key, reply, think)
+    return reply, think
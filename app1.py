@@ -1,24 +1,350 @@
 ﻿from templates import *
-from ki import ask_deepseek
+from ki import ask_deepseek, ask_deepseek_stream, configure_client, get_client, warmup
+from ki_dispatch import KiDispatcher, KiUeberlastet
+from kontext import KontextCache, LlmSummary, extractive_summary
+from antwort_cache import AntwortCache, CachePolicy, SqliteStore, ask_cached, lookup_cached, store_cached
+from semantik_cache import (SemantikCache, VectorIndex, HashingEmbedder, OllamaEmbedder, ask_semantic,
+                            lookup_semantic, store_semantic)
+from router import ModelRouter, load_routing
+from singleflight import SingleFlight, FlightTimeout, ask_coalesced, flight_key
+from ki_jobs import JobWorkerPool, MemoryJobStore, SqliteJobStore, DONE, FAILED
+from schema import ensure_indexes, rebuild_with_autoincrement, run_migrations, assert_no_table_scan
+from db_profil import SQLITE_PRAGMAS, database_uri, engine_options, install_sqlite_pragmas
+from schreibpuffer import SchreibPuffer
+from nutzer_cache import NutzerCache, snapshot
+from etag_cache import ResponseCache, Versionen, make_etag
+from json_provider import SchnellJSONProvider
+from passwort import PasswortDienst, PasswortUeberlastet
+from avatar_bilder import UngueltigesBild, HASHED_NAME, store_avatar, variant_for, variant_files
+from upload import UploadFehler, stream_upload
+from werkzeug.exceptions import RequestEntityTooLarge
+from sqlalchemy.exc import DBAPIError
+from suche import (SEARCH_MESSAGES, archiv_text, install_fts, rebuild_fts, search_archived, search_chats,
+                   search_messages, search_params, text_snippet, unindex_archiv)
+from chat_export import ImportFehler, content_disposition, export_lines, export_query, gzip_chunks, import_lines, open_ndjson
+from metriken import CONTENT_TYPE, TOKEN_RATE_BUCKETS, Registry, json_logger
+from wartung import (Wartung, archive_chat, chats_to_archive, drop_archives, prune_login_history, rehydrate_chat,
+                     reindex_archives, sqlite_housekeeping, unpack_messages)
 
 
 
 app = Flask(__name__)
+app.json = SchnellJSONProvider(app)   # orjson, falls installiert
 app.config["SECRET_KEY"] = "dev-secret-change-me"
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///site.db"
+app.config["SQLALCHEMY_DATABASE_URI"] = database_uri("sqlite:///site.db")  # DATABASE_URL überschreibt
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+app.config["SQLITE_PRAGMAS"] = dict(SQLITE_PRAGMAS)
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(
+    app.config["SQLALCHEMY_DATABASE_URI"],
+    pool_size=10,
+    max_overflow=20,
+    busy_timeout_ms=app.config["SQLITE_PRAGMAS"]["busy_timeout"],
+)
 
 BASE_DIR = Path(__file__).resolve().parent
 UPLOAD_FOLDER = BASE_DIR / "static" / "avatars"
 app.config["UPLOAD_FOLDER"] = str(UPLOAD_FOLDER)
 app.config["MAX_CONTENT_LENGTH"] = 2 * 1024 * 1024  # 2 MB Limit
-ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "gif", "webp"}
 os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
 
-def allowed_file(filename: str) -> bool:
-    return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
+# Avatare: werden verkleinert, ohne Metadaten neu kodiert und unter ihrem Inhalts-Hash gespeichert
+app.config["AVATAR_GROESSEN"] = (64, 300)      # Pixel (quadratisch): Sidebar-Button, Profilseite
+app.config["AVATAR_FORMAT"] = "WEBP"           # "WEBP" oder "JPEG"
+app.config["AVATAR_QUALITAET"] = 82
+app.config["AVATAR_MAX_AGE"] = 365 * 24 * 3600 # Hash-Dateien ändern sich nie -> immutable
+app.config["AVATAR_MAX_BYTES"] = app.config["MAX_CONTENT_LENGTH"]
+app.config["AVATAR_WORKER"] = 1                # Hintergrund-Threads für Verarbeitung + Aufräumen
+
+# Passwörter: Verfahren/Kosten (ausgeschrieben wie im Hash) und Prozess-Pool fürs Hashen
+app.config["PASSWORT_METHODE"] = "scrypt:32768:8:1"   # z.B. "pbkdf2:sha256:1000000"; alte Hashes werden beim Login erneuert
+app.config["PASSWORT_WORKER"] = 2                      # Prozesse, 0 = im Request-Thread rechnen
+app.config["PASSWORT_MAX_WARTEND"] = 64                # darüber: "zu viele Anmeldungen"
+app.config["PASSWORT_TIMEOUT"] = 10                    # Sekunden
+
+passwort_dienst = PasswortDienst(
+    method=app.config["PASSWORT_METHODE"],
+    workers=app.config["PASSWORT_WORKER"],
+    max_pending=app.config["PASSWORT_MAX_WARTEND"],
+    timeout=app.config["PASSWORT_TIMEOUT"],
+)
+passwort_dienst.start()   # forken, bevor weiter unten die ersten Threads starten
+
+# Metriken (/metrics im Prometheus-Format) und strukturierte Logs (JSON-Zeilen auf stderr)
+app.config["METRIKEN_AKTIV"] = True
+app.config["METRIKEN_TOKEN"] = os.environ.get("METRIKEN_TOKEN")   # gesetzt: /metrics nur mit "Authorization: Bearer <token>"
+app.config["LOG_JSON"] = True                                      # Logs der KI-Aufrufe und Chat-Requests als JSON
+
+metriken = Registry()
+HTTP_DAUER = metriken.histogram("http_request_duration_seconds", "Dauer der Requests",
+                                ("route", "method", "status"))
+DB_ZEIT = metriken.histogram("chat_db_seconds", "DB-Zeit pro Request (Summe aller SQL-Statements)",
+                             ("route", "model"))
+DB_ABFRAGEN = metriken.counter("chat_db_queries_total", "Anzahl SQL-Statements", ("route",))
+STUFE_ZEIT = metriken.histogram("chat_stage_seconds", "Zeit pro Stufe: kontext, routing, ki, think, speichern",
+                                ("route", "model", "stage"))
+KI_WARTEZEIT = metriken.histogram("ki_queue_wait_seconds", "Wartezeit auf einen Modell-Slot", ("route", "model"))
+KI_ABGELEHNT = metriken.counter("ki_queue_timeouts_total", "Wartezeit auf einen Slot abgelaufen", ("route", "model"))
+KI_TTFT = metriken.histogram("ki_time_to_first_token_seconds", "Zeit bis zum ersten Token", ("route", "model"))
+KI_DAUER = metriken.histogram("ki_generation_seconds", "Gesamtdauer der Generierung", ("route", "model"))
+KI_TOKEN_RATE = metriken.histogram("ki_tokens_per_second", "Tokens/s laut ollama (eval_count / eval_duration)",
+                                   ("route", "model"), buckets=TOKEN_RATE_BUCKETS)
+KI_TOKENS = metriken.counter("ki_tokens_total", "Erzeugte Tokens", ("route", "model"))
+
+# ki, wartung, jobs, schreibpuffer, semantik, kontext: Logger der Module; app: Ereignisse aus app1
+if app.config["LOG_JSON"]:
+    for name in ("ki", "wartung", "jobs", "schreibpuffer", "semantik", "kontext"):
+        json_logger(name)
+chat_log = json_logger("chat") if app.config["LOG_JSON"] else logging.getLogger("chat")
+app_log = json_logger("app") if app.config["LOG_JSON"] else logging.getLogger("app")
+
+_metrik_thread = threading.local()
+
+def aktuelle_route():
+    """Label "route": Flask-Endpoint im Request, sonst Hintergrund (Jobs, Wartung)"""
+    route = getattr(_metrik_thread, "route", None)
+    if route:
+        return route   # Thread, der für einen Request arbeitet (z.B. zusammengelegter Stream)
+    if has_request_context():
+        return request.endpoint or "unbekannt"
+    return "hintergrund"
+
+def stufe_messen(name, seconds, route=None, model=None):
+    """Im Request bis zum Ende sammeln (dann ist das Modell bekannt), sonst sofort messen.
+
+    Außerhalb eines Requests (Producer-Thread eines Streams, Jobs) gibt der Aufrufer
+    route/model mit; ohne route gilt aktuelle_route().
+    """
+    if route is None and model is None and has_request_context():
+        stufen = g.setdefault("stufen", {})
+        stufen[name] = stufen.get(name, 0.0) + seconds
+    else:
+        STUFE_ZEIT.observe(seconds, route=route or aktuelle_route(), model=model or "", stage=name)
+
+@contextmanager
+def stufe(name, route=None, model=None):
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        stufe_messen(name, perf_counter() - start, route, model)
+
+def ki_beobachten(stats):
+    """Observer für ki.py: eine Generierung (Kennzahlen aus ollama) in die Histogramme"""
+    route = aktuelle_route()
+    stats["route"] = route   # landet so auch in der Log-Zeile
+    labels = {"route": route, "model": stats["model"]}
+    if stats["ttft"] is not None:
+        KI_TTFT.observe(stats["ttft"], **labels)
+    KI_DAUER.observe(stats["total"], **labels)
+    if stats["tokens_per_s"]:
+        KI_TOKEN_RATE.observe(stats["tokens_per_s"], **labels)
+    if stats["eval_count"]:
+        KI_TOKENS.inc(stats["eval_count"], **labels)
+    if has_request_context():
+        stufe_messen("think", stats["think"])
+        g.ki_model = stats["model"]
+    else:
+        # z.B. Producer-Thread von ki_flight: kein g, die Labels sind aber hier schon bekannt
+        stufe_messen("think", stats["think"], **labels)
+
+def ki_wartezeit(model, seconds, acquired):
+    KI_WARTEZEIT.observe(seconds, route=aktuelle_route(), model=model)
+    if not acquired:
+        KI_ABGELEHNT.inc(route=aktuelle_route(), model=model)
+
+# ollama: Verbindung, Timeouts und wie lange Modelle im Speicher bleiben
+app.config["OLLAMA_HOST"] = os.environ.get("OLLAMA_HOST", "http://127.0.0.1:11434")
+app.config["OLLAMA_CONNECT_TIMEOUT"] = 5      # Sekunden
+app.config["OLLAMA_READ_TIMEOUT"] = 120       # Sekunden zwischen zwei Antwort-Stücken
+app.config["OLLAMA_MAX_VERBINDUNGEN"] = 32
+app.config["OLLAMA_KEEP_ALIVE"] = {"llama3.1:8b": "2h", "deepseek-r1:8b": "2h"}
+app.config["OLLAMA_WARMUP"] = True            # geroutete Modelle beim Start vorladen
+
+configure_client(
+    host=app.config["OLLAMA_HOST"],
+    connect_timeout=app.config["OLLAMA_CONNECT_TIMEOUT"],
+    read_timeout=app.config["OLLAMA_READ_TIMEOUT"],
+    max_connections=app.config["OLLAMA_MAX_VERBINDUNGEN"],
+    keep_alive=app.config["OLLAMA_KEEP_ALIVE"],
+    observer=ki_beobachten if app.config["METRIKEN_AKTIV"] else None,
+)
+
+# Webserver: ein Gunicorn-Worker mit WEB_THREADS Threads (siehe Procfile, dort --workers 1).
+# Mehr Worker gehen nicht: Versionen/ETags, Nutzer- und Kontext-Cache, SingleFlight und
+# die Job-Queue im Speicher gelten nur für den eigenen Prozess.
+app.config["WEB_THREADS"] = int(os.environ.get("WEB_THREADS", 16))
+
+# KI: wie viele Generierungen pro Modell gleichzeitig laufen dürfen
+app.config["KI_MAX_PARALLEL"] = {"deepseek-r1:8b": 1, "llama3.1:8b": 2}
+app.config["KI_MAX_WARTESCHLANGE"] = 4      # wartende Anfragen pro Modell
+app.config["KI_MAX_GESAMT"] = app.config["WEB_THREADS"] - 6   # laufend + wartend über alle Modelle;
+                                            # der Rest der Threads bleibt für Seiten, Farben, Statics
+app.config["KI_WARTE_TIMEOUT"] = 30         # Sekunden, danach 503
+
+ki_dispatcher = KiDispatcher(
+    limits=app.config["KI_MAX_PARALLEL"],
+    max_queue=app.config["KI_MAX_WARTESCHLANGE"],
+    max_total=app.config["KI_MAX_GESAMT"],
+    wait_timeout=app.config["KI_WARTE_TIMEOUT"],
+    on_wait=ki_wartezeit if app.config["METRIKEN_AKTIV"] else None,
+)
+metriken.gauge("ki_queue_depth", "Wartende Anfragen pro Modell", ("model",),
+               lambda: {m: s["waiting"] for m, s in ki_dispatcher.stats().items()})
+metriken.gauge("ki_running", "Laufende Generierungen pro Modell", ("model",),
+               lambda: {m: s["running"] for m, s in ki_dispatcher.stats().items()})
+
+# Gleiche Anfragen, die gleichzeitig ankommen, teilen sich eine Generierung
+app.config["KI_ZUSAMMENLEGEN"] = True
+app.config["KI_ZUSAMMENLEGEN_TIMEOUT"] = 300   # Sekunden, die Mitleser höchstens auf Ergebnis / nächstes Stück warten
+
+ki_flight = (SingleFlight(wait_timeout=app.config["KI_ZUSAMMENLEGEN_TIMEOUT"])
+             if app.config["KI_ZUSAMMENLEGEN"] else None)
+
+# Job-Modus: POST /messages antwortet sofort mit 202, die KI läuft im Hintergrund
+app.config["KI_JOB_MODUS"] = False          # True = immer; sonst nur mit {"async": true}
+app.config["KI_JOB_SPEICHER"] = None        # z.B. "ki_jobs.db" (SQLite), None = im Speicher
+app.config["KI_JOB_WORKER"] = 2
+app.config["KI_JOB_RETRIES"] = 2
+app.config["KI_JOB_LEASE"] = 120            # Sekunden ohne Heartbeat, danach gilt ein laufender Job als verwaist
+
+# Modell-Routing: welche Prompts an welches Modell gehen (siehe routing.json)
+app.config["KI_ROUTING_DATEI"] = str(BASE_DIR / "routing.json")
+
+ki_router = ModelRouter(load_routing(app.config["KI_ROUTING_DATEI"]), dispatcher=ki_dispatcher)
+
+if app.config["OLLAMA_WARMUP"]:
+    threading.Thread(
+        target=warmup,
+        args=(sorted({r.model for r in ki_router.routes}),),
+        name="ollama-warmup",
+        daemon=True,
+    ).start()
+
+# Kontext-Fenster: wie viel Verlauf die KI pro Turn mitbekommt
+app.config["KONTEXT_MAX_TOKENS"] = 2048     # Budget für die letzten Turns
+app.config["KONTEXT_SUMMARY_TOKENS"] = 512  # Budget für die Zusammenfassung älterer Turns
+app.config["KONTEXT_LADEN_MAX"] = 40        # max. Nachrichten beim Neuaufbau aus der DB
+app.config["KONTEXT_MAX_CHATS"] = 500       # so viele Chat-Fenster bleiben im Speicher
+app.config["KONTEXT_SUMMARY_MODELL"] = None # z.B. "llama3.1:8b"; None = ohne KI kürzen
+
+kontext_cache = KontextCache(
+    max_chats=app.config["KONTEXT_MAX_CHATS"],
+    max_tokens=app.config["KONTEXT_MAX_TOKENS"],
+    summary_tokens=app.config["KONTEXT_SUMMARY_TOKENS"],
+    summarize=(LlmSummary(ask_deepseek, app.config["KONTEXT_SUMMARY_MODELL"], dispatcher=ki_dispatcher)
+               if app.config["KONTEXT_SUMMARY_MODELL"] else extractive_summary),
+)
+
+# Antwort-Cache für wiederkehrende Fragen (Smalltalk, "wer bist du?" ...)
+app.config["ANTWORT_CACHE_AKTIV"] = True
+app.config["ANTWORT_CACHE_MAX_EINTRAEGE"] = 1000
+app.config["ANTWORT_CACHE_MAX_BYTES"] = 5 * 1024 * 1024
+app.config["ANTWORT_CACHE_TTL"] = 6 * 3600                 # Sekunden
+app.config["ANTWORT_CACHE_SQLITE"] = None                   # z.B. "antwort_cache.db" für die zweite Stufe
+app.config["ANTWORT_CACHE_MODELLE"] = ["llama3.1:8b"]        # nur diese Modelle cachen
+app.config["ANTWORT_CACHE_DEEP_THINK"] = False              # Deep-Think-Routen nicht cachen
+app.config["ANTWORT_CACHE_MAX_KONTEXT_TOKENS"] = 256        # nur kurze Verläufe cachen
+
+antwort_cache = None
+if app.config["ANTWORT_CACHE_AKTIV"]:
+    antwort_cache = AntwortCache(
+        max_entries=app.config["ANTWORT_CACHE_MAX_EINTRAEGE"],
+        max_bytes=app.config["ANTWORT_CACHE_MAX_BYTES"],
+        ttl=app.config["ANTWORT_CACHE_TTL"],
+        store=(SqliteStore(app.config["ANTWORT_CACHE_SQLITE"], ttl=app.config["ANTWORT_CACHE_TTL"])
+               if app.config["ANTWORT_CACHE_SQLITE"] else None),
+    )
+antwort_policy = CachePolicy(
+    models=app.config["ANTWORT_CACHE_MODELLE"],
+    allow_deep_think=app.config["ANTWORT_CACHE_DEEP_THINK"],
+    max_kontext_tokens=app.config["ANTWORT_CACHE_MAX_KONTEXT_TOKENS"],
+)
+
+# Semantischer Cache: findet auch umformulierte Fragen wieder (optional, braucht numpy)
+app.config["SEMANTIK_CACHE_AKTIV"] = False
+app.config["SEMANTIK_CACHE_EMBEDDER"] = "ollama"           # "ollama" oder "hashing"
+app.config["SEMANTIK_CACHE_EMBED_MODELL"] = "nomic-embed-text"
+app.config["SEMANTIK_CACHE_DIM"] = 768                     # Dimension des Embedding-Modells
+app.config["SEMANTIK_CACHE_SCHWELLE"] = 0.92               # ab dieser Kosinus-Ähnlichkeit ein Treffer
+app.config["SEMANTIK_CACHE_MAX_EINTRAEGE"] = 10000
+app.config["SEMANTIK_CACHE_MMAP"] = None                    # Datei für die Vektoren (PID wird angehängt), None = im RAM
+
+semantik_cache = None
+if app.config["SEMANTIK_CACHE_AKTIV"]:
+    if app.config["SEMANTIK_CACHE_EMBEDDER"] == "hashing":
+        embedder = HashingEmbedder(dim=app.config["SEMANTIK_CACHE_DIM"])
+    else:
+        embedder = OllamaEmbedder(model=app.config["SEMANTIK_CACHE_EMBED_MODELL"], dim=app.config["SEMANTIK_CACHE_DIM"],
+                                  client=get_client())
+    semantik_cache = SemantikCache(
+        embedder,
+        VectorIndex(embedder.dim, capacity=app.config["SEMANTIK_CACHE_MAX_EINTRAEGE"], path=app.config["SEMANTIK_CACHE_MMAP"]),
+        threshold=app.config["SEMANTIK_CACHE_SCHWELLE"],
+    )
+# Umformulierungen nur bei der ersten Frage eines Chats, sonst passt der Kontext nicht
+semantik_policy = CachePolicy(
+    models=app.config["ANTWORT_CACHE_MODELLE"],
+    allow_deep_think=app.config["ANTWORT_CACHE_DEEP_THINK"],
+    max_kontext_tokens=app.config["ANTWORT_CACHE_MAX_KONTEXT_TOKENS"],
+    max_history_messages=0,
+)
+
+ki_jobs = JobWorkerPool(
+    (SqliteJobStore(app.config["KI_JOB_SPEICHER"], lease=app.config["KI_JOB_LEASE"])
+     if app.config["KI_JOB_SPEICHER"] else MemoryJobStore()),
+    handler=lambda job: ki_job_handler(job),
+    workers=app.config["KI_JOB_WORKER"],
+    max_retries=app.config["KI_JOB_RETRIES"],
+    retry_on=(KiUeberlastet, FlightTimeout, ConnectionError),
+)
+ki_jobs.start()
+
+# Login-Protokoll: LoginHistory wird gesammelt und gebündelt geschrieben (nicht im Request)
+app.config["LOGIN_PROTOKOLL_BATCH"] = 100       # Zeilen pro INSERT
+app.config["LOGIN_PROTOKOLL_INTERVALL"] = 2.0   # Sekunden, spätestens dann wird geschrieben
+app.config["LOGIN_PROTOKOLL_MAX_PUFFER"] = 5000 # darüber wartet der Login kurz (Backpressure)
+
+# Eingeloggter User: pro Request einmal, zwischen Requests kurz im Speicher
+app.config["NUTZER_CACHE_TTL"] = 60             # Sekunden
+app.config["NUTZER_CACHE_MAX"] = 10000
+
+nutzer_cache = NutzerCache(ttl=app.config["NUTZER_CACHE_TTL"], max_entries=app.config["NUTZER_CACHE_MAX"])
+
+# Bedingte GETs: ETag/304 für Chat-Liste, Nachrichten und Farben, fertige Antworten im Speicher.
+# Die Versionszähler leben im Prozess: Änderungen über die Session (auch Flask-Admin)
+# zählen automatisch hoch, Bulk-/Core-Statements rufen versionen.bump() selbst auf.
+# Schreibt ein anderer Prozess (zweiter Worker, CLI, SQL von Hand) in dieselbe DB,
+# sieht dieser Prozess das erst nach einem Neustart -> nur mit einem Worker betreiben.
+app.config["ANTWORT_ETAG_MAX_EINTRAEGE"] = 2000
+app.config["ANTWORT_ETAG_MAX_BYTES"] = 16 * 1024 * 1024
+
+versionen = Versionen()
+response_cache = ResponseCache(
+    max_entries=app.config["ANTWORT_ETAG_MAX_EINTRAEGE"],
+    max_bytes=app.config["ANTWORT_ETAG_MAX_BYTES"],
+)
+
+@app.template_global()
+def avatar_url(avatar, size):
+    """URL der passenden Avatar-Größe (User.avatar ist "avatars/<datei>")"""
+    sizes = sorted(app.config["AVATAR_GROESSEN"])
+    size = next((s for s in sizes if s >= size), sizes[-1])
+    return url_for("avatar_datei", name=variant_for(os.path.basename(avatar), size))
 
 db = SQLAlchemy(app)
+with app.app_context():
+    install_sqlite_pragmas(db.engine, app.config["SQLITE_PRAGMAS"])
+
+    # DB-Zeit pro Request: Dauer jedes Statements aufsummieren (inkl. Warten auf Locks)
+    @event.listens_for(db.engine, "before_cursor_execute")
+    def _db_start(conn, cursor, statement, parameters, context, executemany):
+        conn.info["statement_start"] = perf_counter()
+
+    @event.listens_for(db.engine, "after_cursor_execute")
+    def _db_ende(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and "db_zeit" in g:
+            g.db_zeit += perf_counter() - conn.info.pop("statement_start", perf_counter())
+            g.db_abfragen += 1
 # === Flask-Admin Setup ===
 
 # =========================
@@ -35,7 +361,13 @@ class Chat(db.Model):
         "ChatMessage",
         backref="chat",
         lazy=True,
-        cascade="all, delete-orphan"
+        cascade="all, delete-orphan",   # SQLite läuft ohne foreign_keys: die Session löscht mit
+    )
+    archiv = db.relationship("ChatArchiv", lazy=True, uselist=False, cascade="all, delete-orphan")
+
+    __table_args__ = (
+        db.Index("ix_chat_user_created", "user_id", "created_at"),
+        {"sqlite_autoincrement": True},   # ids gelöschter Chats nie an andere User vergeben
     )
 
 class User(db.Model):
@@ -48,10 +380,14 @@ class User(db.Model):
     is_admin = db.Column(db.Boolean, nullable=False, default=False)
 
     def set_password(self, pw: str) -> None:
-        self.password_hash = generate_password_hash(pw)
+        self.password_hash = passwort_dienst.hash(pw)
 
     def check_password(self, pw: str) -> bool:
-        return check_password_hash(self.password_hash, pw)
+        """Prüfen und bei veralteten Hash-Parametern neu hashen (Commit macht der Aufrufer)"""
+        ok, new_hash = passwort_dienst.verify(self.password_hash, pw)
+        if new_hash:
+            self.password_hash = new_hash
+        return ok
 
 class LoginHistory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -59,22 +395,135 @@ class LoginHistory(db.Model):
     username = db.Column(db.String(150), nullable=False)
     login_time = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index("ix_login_history_user_time", "user_id", "login_time"),
+    )
+
 class ChatMessage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    chat_id = db.Column(db.Integer, db.ForeignKey("chat.id"), nullable=False)
+    chat_id = db.Column(db.Integer, db.ForeignKey("chat.id", ondelete="CASCADE"), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
     content = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
+    __table_args__ = (
+        db.Index("ix_chat_message_chat_created", "chat_id", "created_at", "id"),
+        db.Index("ix_chat_message_chat_id", "chat_id", "id"),   # ?after= (Sync nach Einfügereihenfolge)
+    )
+
+class ChatArchiv(db.Model):
+    """Nachrichten alter Chats als komprimierter Blob (siehe wartung.py), beim Öffnen wieder ausgepackt"""
+    chat_id = db.Column(db.Integer, db.ForeignKey("chat.id", ondelete="CASCADE"), primary_key=True)
+    summary = db.Column(db.Text, nullable=False)
+    message_count = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+# Geänderte/gelöschte User aus dem Cache werfen (Profil, Theme, Flask-Admin ...)
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _user_changed(mapper, connection, target):
+    nutzer_cache.invalidate(target.id)
+    object_session(target).info.setdefault("nutzer_geaendert", set()).add(target.id)
+
+# Chats/Nachrichten, die über die Session geändert werden: ETags nach dem Commit ungültig machen
+def _versionen_merken(target, *scopes):
+    object_session(target).info.setdefault("versionen", set()).update(scopes)
+
+@event.listens_for(Chat, "after_insert")
+@event.listens_for(Chat, "after_update")
+@event.listens_for(Chat, "after_delete")
+def _chat_changed(mapper, connection, target):
+    _versionen_merken(target, ("chats", target.user_id), ("chat", target.id))
+
+@event.listens_for(ChatMessage, "after_insert")
+@event.listens_for(ChatMessage, "after_update")
+@event.listens_for(ChatMessage, "after_delete")
+@event.listens_for(ChatArchiv, "after_insert")
+@event.listens_for(ChatArchiv, "after_update")
+@event.listens_for(ChatArchiv, "after_delete")
+def _message_changed(mapper, connection, target):
+    _versionen_merken(target, ("chat", target.chat_id))
+
+# Archiv über die Session gelöscht (z.B. Cascade beim Löschen des Chats): Suchindex mitnehmen
+@event.listens_for(ChatArchiv, "before_delete")
+def _archiv_deleted(mapper, connection, target):
+    unindex_archiv(connection, target.chat_id, archiv_text(m.content for m in unpack_messages(target.data)))
+
+@event.listens_for(db.session, "after_commit")
+def _user_committed(sess):
+    # nochmal nach dem Commit, falls dazwischen jemand den alten Stand geladen hat
+    for user_id in sess.info.pop("nutzer_geaendert", ()):
+        nutzer_cache.invalidate(user_id)
+        versionen.bump(("nutzer", user_id))
+    scopes = sess.info.pop("versionen", ())
+    if scopes:
+        versionen.bump(*scopes)
+
+@event.listens_for(db.session, "after_soft_rollback")
+def _versionen_verwerfen(sess, previous_transaction):
+    sess.info.pop("versionen", None)
+
+def load_user(user_id):
+    user = db.session.get(User, user_id)
+    return snapshot(user) if user else None
+
+def current_user():
+    """Eingeloggter User als Snapshot (oder None); ohne DB, solange er im Cache liegt"""
+    user_id = session.get("user_id")
+    if not user_id:
+        return None
+    if "current_user" not in g:
+        g.current_user = nutzer_cache.get(user_id, load_user)
+    return g.current_user
+
+# =========================
+# Schema-Migrationen (laufen beim Start genau einmal pro Datenbank)
+MIGRATIONS = [
+    (1, "Indizes für Chat-Liste, Nachrichten und LoginHistory",
+     lambda conn: ensure_indexes(conn, db.metadata)),
+    (2, "FTS5-Suchindex für Nachrichten und Chat-Titel",
+     lambda conn: install_fts(conn)),
+    (3, "chat mit AUTOINCREMENT, verwaiste Nachrichten entfernen",
+     lambda conn: fix_chat_ids(conn)),
+    (4, "Suchindex für archivierte Chats",
+     lambda conn: install_fts(conn, rebuild=False) and reindex_archives(conn)),
+    (5, "Index für den Nachrichten-Sync nach id",
+     lambda conn: ensure_indexes(conn, db.metadata)),
+]
+
+def fix_chat_ids(conn):
+    rebuild_with_autoincrement(conn, Chat.__table__)
+    orphans = 0
+    for table in (ChatMessage.__table__, ChatArchiv.__table__):
+        orphans += conn.execute(table.delete().where(table.c.chat_id.not_in(select(Chat.id)))).rowcount
+    install_fts(conn, rebuild=orphans > 0)   # Trigger auf chat sind mit der alten Tabelle weg
+    if orphans:
+        app_log.info("verwaiste_zeilen_geloescht", extra={"felder": {"anzahl": orphans}})
+
 with app.app_context():
      db.create_all()
+     for m in run_migrations(db, MIGRATIONS):
+         app_log.info("migration", extra={"felder": {"migration": m}})
+
+def write_login_history(rows):
+    """Ein Batch LoginHistory-Zeilen per executemany in einer Transaktion"""
+    with app.app_context():
+        db.session.execute(LoginHistory.__table__.insert(), rows)
+        db.session.commit()
+
+login_protokoll = SchreibPuffer(
+    write_login_history,
+    max_batch=app.config["LOGIN_PROTOKOLL_BATCH"],
+    flush_interval=app.config["LOGIN_PROTOKOLL_INTERVALL"],
+    max_pending=app.config["LOGIN_PROTOKOLL_MAX_PUFFER"],
+    name="login-protokoll",
+)
+login_protokoll.start()
 
 class SecureAdminIndex(AdminIndexView):
     def is_accessible(self):
-        user_id = session.get("user_id")
-        if not user_id:
-            return False
-        user = User.query.get(user_id)
+        user = current_user()
         return user and user.username == "moddin123"
 
     def inaccessible_callback(self, name, **kwargs):
@@ -82,10 +531,7 @@ class SecureAdminIndex(AdminIndexView):
 
 class SecureModelView(ModelView):
     def is_accessible(self):
-        user_id = session.get("user_id")
-        if not user_id:
-            return False
-        user = User.query.get(user_id)
+        user = current_user()
         return user and user.username == "moddin123"
 
     def inaccessible_callback(self, name, **kwargs):
@@ -103,6 +549,67 @@ admin.add_view(SecureModelView(Chat, db.session))
 admin.add_view(SecureModelView(ChatMessage, db.session))
 admin.add_view(SecureModelView(LoginHistory, db.session))
 
+class ArchivView(SecureModelView):
+    can_create = False
+    can_edit = False
+    column_exclude_list = ["data"]
+
+admin.add_view(ArchivView(ChatArchiv, db.session))
+
+
+#========================
+# Messung pro Request (DB-Zeit, Stufen, Dauer) und /metrics
+@app.before_request
+def _messung_start():
+    g.request_start = perf_counter()
+    g.db_zeit = 0.0
+    g.db_abfragen = 0
+
+@app.after_request
+def _messung_status(resp):
+    g.status = resp.status_code
+    return resp
+
+@app.teardown_request
+def _messung_ende(exc):
+    if not app.config["METRIKEN_AKTIV"] or "request_start" not in g:
+        return
+    if g.pop("stream_offen", False):
+        return   # gestreamte Antwort: gemessen wird erst, wenn der Stream fertig ist
+    route = request.endpoint
+    if route in (None, "static", "metrics"):
+        return
+    model = g.get("ki_model", "")
+    status = 500 if exc else g.get("status", 500)
+    dauer = perf_counter() - g.request_start
+    stufen = g.get("stufen") or {}
+
+    HTTP_DAUER.observe(dauer, route=route, method=request.method, status=status)
+    DB_ZEIT.observe(g.db_zeit, route=route, model=model)
+    DB_ABFRAGEN.inc(g.db_abfragen, route=route)
+    for name, seconds in stufen.items():
+        STUFE_ZEIT.observe(seconds, route=route, model=model, stage=name)
+    if stufen:
+        chat_log.info("chat_request", extra={"felder": {
+            "route": route, "model": model, "status": status, "dauer": round(dauer, 4),
+            "db": round(g.db_zeit, 4), "db_abfragen": g.db_abfragen,
+            "stufen": {name: round(seconds, 4) for name, seconds in stufen.items()},
+        }})
+
+def gestreamt(generator):
+    """stream_with_context + Messung erst am Ende des Streams"""
+    g.stream_offen = True
+    return stream_with_context(generator)
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus-Format; mit METRIKEN_TOKEN nur mit passendem Bearer-Token"""
+    if not app.config["METRIKEN_AKTIV"]:
+        return "Metriken sind ausgeschaltet.", 404
+    token = app.config["METRIKEN_TOKEN"]
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return "unauthorized", 401
+    return Response(metriken.render(), content_type=CONTENT_TYPE, headers={"Cache-Control": "no-store"})
 
 #========================
 # Routen
@@ -130,7 +637,11 @@ def register():
             error = "Dieser Benutzername ist bereits vergeben."
         else:
             u = User(username=username)
-            u.set_password(password)
+            try:
+                u.set_password(password)
+            except PasswortUeberlastet:
+                error = "Gerade ist viel los. Bitte gleich nochmal versuchen."
+                return render_template("register.html", error=error), 503
             db.session.add(u)
             db.session.commit()
             return redirect(url_for("register_ok"))
@@ -168,11 +679,17 @@ def anmelden():
 
         user = User.query.filter_by(username=username).first()
         remember = bool(request.form.get("remember"))
-        if user and user.check_password(password):
+        try:
+            ok = bool(user) and user.check_password(password)
+        except PasswortUeberlastet:
+            error = "Gerade melden sich sehr viele an. Bitte gleich nochmal versuchen."
+            return render_template("anmelden.html", error=error, next=next_url), 503
+        if ok:
+            if db.session.is_modified(user):
+                db.session.commit()   # Hash mit neuen Parametern gespeichert
             session["user_id"] = user.id
             session.permanent = bool(remember)
-            db.session.add(LoginHistory(user_id=user.id, username=user.username))
-            db.session.commit()
+            login_protokoll.put({"user_id": user.id, "username": user.username, "login_time": datetime.utcnow()})
             session["login_versuche"] = 3
             session.pop("login_blocked_until", None)
             return redirect(next_url or url_for("chatbot"))
@@ -200,12 +717,78 @@ def logout():
 def chatbot():
     if not session.get("user_id"):
         return redirect(url_for("anmelden"))
-    user = User.query.get(session["user_id"])
+    user = current_user()
     chats = (Chat.query
              .filter_by(user_id=user.id)
              .order_by(Chat.created_at.desc())
              .all())
-    return render_template("Chatbot.html", user=user, chats=chats)
+    return render_template("Chatbot.html", user=user, chats=chats, ki_job_modus=app.config["KI_JOB_MODUS"])
+
+# =========================
+# Avatar-Dateien (Hash-Namen mit langem, unveränderlichem Cache)
+@app.route("/avatare/<name>")
+def avatar_datei(name):
+    resp = send_from_directory(app.config["UPLOAD_FOLDER"], name, max_age=app.config["AVATAR_MAX_AGE"])
+    if HASHED_NAME.match(name):
+        resp.headers["Cache-Control"] = f"public, max-age={app.config['AVATAR_MAX_AGE']}, immutable"
+    else:
+        resp.cache_control.max_age = 300   # alte Dateinamen können überschrieben werden
+    return resp
+
+def remove_avatar_files(avatar, user_id):
+    """Dateien eines alten Avatars löschen, wenn kein anderer User denselben Hash benutzt"""
+    if not avatar or User.query.filter(User.avatar == avatar, User.id != user_id).first():
+        return
+    for name in variant_files(os.path.basename(avatar), app.config["AVATAR_GROESSEN"]):
+        try:
+            os.remove(os.path.join(app.config["UPLOAD_FOLDER"], name))
+        except FileNotFoundError:
+            pass
+
+# =========================
+# Avatar-Verarbeitung im Hintergrund (Upload liegt schon als Temp-Datei vor)
+def avatar_job_handler(job):
+    p = job["payload"]
+    with app.app_context():
+        if p["art"] == "aufraeumen":
+            remove_avatar_files(p["avatar"], p["user_id"])
+            return None
+
+        try:
+            with open(p["pfad"], "rb") as f:
+                name = store_avatar(
+                    app.config["UPLOAD_FOLDER"],
+                    f.read(),
+                    app.config["AVATAR_GROESSEN"],
+                    fmt=app.config["AVATAR_FORMAT"],
+                    quality=app.config["AVATAR_QUALITAET"],
+                )
+        except UngueltigesBild as e:
+            app_log.warning("avatar_fehler", extra={"felder": {"user_id": p["user_id"], "fehler": str(e)}})
+            raise
+        finally:
+            os.remove(p["pfad"])
+
+        user = db.session.get(User, p["user_id"])
+        if user is None:
+            return None
+        old_avatar, new_avatar = user.avatar, f"avatars/{name}"
+        if old_avatar != new_avatar:
+            user.avatar = new_avatar
+            db.session.commit()
+            if old_avatar:
+                avatar_jobs.submit({"art": "aufraeumen", "avatar": old_avatar, "user_id": user.id},
+                                   user_id=user.id, priority=5)
+        return {"avatar": new_avatar}
+
+avatar_jobs = JobWorkerPool(
+    MemoryJobStore(keep_finished=100),
+    handler=avatar_job_handler,
+    workers=app.config["AVATAR_WORKER"],
+    max_retries=0,
+    retry_on=(),
+)
+avatar_jobs.start()
 
 # =========================
 # Profilseite (Avatar)
@@ -213,35 +796,74 @@ def chatbot():
 def profile():
     if not session.get("user_id"):
         return redirect(url_for("anmelden"))
-    user = User.query.get(session["user_id"])
+    user = current_user()
 
     if request.method == "POST":
-        file = request.files.get("avatar")
-        if not file or file.filename == "":
-            flash("Keine Datei ausgewählt.", "error")
-        elif not allowed_file(file.filename):
-            flash("Ungültiger Dateityp. Erlaubt sind: png, jpg, jpeg, gif, webp", "error")
-        else:
-            avatar_name = secure_filename(file.filename)
-            ext = avatar_name.rsplit(".", 1)[1].lower()
-            unique_name = f"user_{user.id}_{int(time())}.{ext}"
-
-            if user.avatar:
-                try:
-                    old_path = os.path.join(app.config["UPLOAD_FOLDER"], os.path.basename(user.avatar))
-                    if os.path.exists(old_path):
-                        os.remove(old_path)
-                except Exception:
-                    pass
-
-            save_path = os.path.join(app.config["UPLOAD_FOLDER"], unique_name)
-            file.save(save_path)
-            user.avatar = f"avatars/{unique_name}"
-            db.session.commit()
-            flash("Datei erfolgreich hochgeladen!", "success")
+        # Body selbst stückweise lesen (nicht request.files), damit Müll früh abbricht
+        try:
+            if request.mimetype != "multipart/form-data":
+                raise UploadFehler("Keine Datei ausgewählt.")
+            path, _kind = stream_upload(
+                request.stream,
+                request.mimetype_params.get("boundary", ""),
+                "avatar",
+                max_bytes=app.config["AVATAR_MAX_BYTES"],
+                content_length=request.content_length,
+            )
+        except RequestEntityTooLarge:
+            # schon request.stream prüft MAX_CONTENT_LENGTH gegen Content-Length
+            flash("Datei ist zu groß.", "error")
+            return redirect(url_for("profile"))
+        except UploadFehler as e:
+            flash(str(e), "error")
             return redirect(url_for("profile"))
 
-    return render_template("profil.html", user=user)
+        # Verkleinern/Kodieren und Aufräumen laufen im Hintergrund; das Ergebnis zeigt die Profilseite
+        job = avatar_jobs.submit({"art": "verarbeiten", "pfad": path, "user_id": user.id}, user_id=user.id)
+        session["avatar_job"] = job["id"]
+        flash("Bild hochgeladen, wird verarbeitet …", "info")
+        return redirect(url_for("profile"))
+
+    in_arbeit = False
+    job_id = session.get("avatar_job")
+    if job_id:
+        job = avatar_jobs.store.get(job_id)
+        if job is None or job["status"] in (DONE, FAILED):
+            session.pop("avatar_job")
+            if job is not None and job["status"] == FAILED:
+                flash(f"Bild konnte nicht verarbeitet werden: {job['error']}", "error")
+        else:
+            in_arbeit = True
+
+    return render_template("profil.html", user=user, in_arbeit=in_arbeit)
+
+# =========================
+# Bedingte GETs (ETag / Last-Modified / 304)
+def cached_json(scopes, build):
+    """JSON-Antwort mit ETag; build() läuft nur, wenn sich in scopes etwas geändert hat.
+
+    build() liefert ein dict (wird gecacht) oder eine fertige Fehler-Antwort.
+    """
+    state = [versionen.get(scope) for scope in scopes]
+    etag = make_etag(versionen.epoch, session.get("user_id"), request.full_path, [v for v, _ in state])
+
+    if etag in request.if_none_match:
+        response_cache.not_modified += 1
+        body = b""
+    else:
+        body = response_cache.get(etag)
+        if body is None:
+            result = build()
+            if not isinstance(result, dict):
+                return result
+            body = app.json.dumps_bytes(result)
+            response_cache.put(etag, body)
+
+    resp = Response(body, mimetype="application/json")
+    resp.set_etag(etag)
+    resp.last_modified = max(t for _, t in state)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp.make_conditional(request)
 
 # =========================
 # Chat API Routes
@@ -262,6 +884,7 @@ def api_new_chat():
     c = Chat(user_id=user_id, title=title)
     db.session.add(c)
     db.session.commit()
+    versionen.bump(("chats", user_id))
     return jsonify({"id": c.id, "title": c.title, "created_at": c.created_at.isoformat()})
 # =========================
 # Liste aller Chats für den Benutzer
@@ -269,11 +892,33 @@ def api_new_chat():
 def api_list_chats():
     if not session.get("user_id"):
         return jsonify({"error": "unauthorized"}), 401
-    rows = (Chat.query
-            .filter_by(user_id=session["user_id"])
-            .order_by(Chat.created_at.desc())
-            .all())
-    return jsonify({"chats": [{"id": r.id, "title": r.title, "created": r.created_at.isoformat()} for r in rows]})
+    user_id = session["user_id"]
+
+    def build():
+        # nur die Spalten, keine ORM-Objekte; created wird vom JSON-Provider geschrieben
+        rows = (db.session.query(Chat.id, Chat.title, Chat.created_at.label("created"))
+                .filter(Chat.user_id == user_id)
+                .order_by(Chat.created_at.desc())
+                .all())
+        return {"chats": [r._asdict() for r in rows]}
+
+    return cached_json([("chats", user_id)], build)
+# =========================
+# Chats samt Nachrichten löschen (set-basiert, ohne Objekte zu laden)
+def delete_chats(user_id, chat_ids):
+    """DELETE ... WHERE für Nachrichten und Chats in einer Transaktion"""
+    if not chat_ids:
+        return 0
+    # ON DELETE CASCADE greift in SQLite nur mit PRAGMA foreign_keys, daher explizit
+    ChatMessage.query.filter(ChatMessage.chat_id.in_(chat_ids)).delete(synchronize_session=False)
+    drop_archives(db.session.connection(), chat_ids)
+    deleted = Chat.query.filter(Chat.id.in_(chat_ids)).delete(synchronize_session=False)
+    db.session.commit()
+    for chat_id in chat_ids:
+        kontext_cache.invalidate(chat_id)
+    versionen.bump(("chats", user_id), *[("chat", chat_id) for chat_id in chat_ids])
+    return deleted
+
 # =========================
 # Alle Chats löschen 
 @app.route("/admin/clear_chats")
@@ -284,14 +929,8 @@ def clear_chats():
 
     user_id = session.get("user_id")
 
-  
-    chats = Chat.query.filter_by(user_id=user_id).all()
-
-
-    for c in chats:
-        db.session.delete(c)
-
-    db.session.commit()
+    chat_ids = [row[0] for row in db.session.query(Chat.id).filter_by(user_id=user_id)]
+    delete_chats(user_id, chat_ids)
 
    
     return redirect(url_for("chatbot"))
@@ -306,8 +945,7 @@ def delete_chat(chat_id):
     chat = Chat.query.filter_by(id=chat_id, user_id=session["user_id"]).first()
     if not chat:
         return jsonify({"error": "Chat nicht gefunden."}), 404
-    db.session.delete(chat)
-    db.session.commit()
+    delete_chats(session["user_id"], [chat.id])
     return jsonify({"message": "Chat erfolgreich gelöscht."})
 
 # =========================
@@ -338,6 +976,7 @@ def rename_chat(chat_id):
         # Titel aktualisieren
         chat.title = new_title
         db.session.commit()
+        versionen.bump(("chats", session["user_id"]))
         
         # JSON zurückgeben
         return jsonify({
@@ -348,7 +987,7 @@ def rename_chat(chat_id):
         
     except Exception as e:
         db.session.rollback()
-        print(f"❌ Fehler beim Umbenennen: {e}")
+        app_log.exception("umbenennen_fehler", extra={"felder": {"chat_id": chat_id}})
         return jsonify({"error": f"Server Fehler: {str(e)}"}), 500
 
 
@@ -358,9 +997,14 @@ def rename_chat(chat_id):
 def get_colours():
     if not session.get("user_id"):
         return jsonify({"error": "unauthorized"}), 401
-    user = User.query.get(session["user_id"])
-    theme = getattr(user, "theme", "pink") or "pink"
-    return jsonify({"theme": theme})
+    user_id = session["user_id"]
+
+    def build():
+        user = current_user()
+        theme = getattr(user, "theme", "pink") or "pink"
+        return {"theme": theme}
+
+    return cached_json([("nutzer", user_id)], build)
 
 # =========================
 # Set Farben API
@@ -378,7 +1022,7 @@ def set_colours():
         if theme not in allowed:
             return jsonify({"error": "Ungültiges Theme. Erlaubt: pink, blue, dark."}), 400
             
-        user = User.query.get(session["user_id"])
+        user = db.session.get(User, session["user_id"])
         user.theme = theme
         db.session.commit()
         return jsonify({"theme": theme})
@@ -386,36 +1030,451 @@ def set_colours():
     except Exception as e:
         return jsonify({"error": f"Server Fehler: {str(e)}"}), 500
 
+# =========================
+# System-Prompt für die KI-Persönlichkeit
+SYSTEM_PROMPT = """
+Du bist Moddins KI-Bot.
+
+Persönlichkeit:
+- Du wirkst wie ein kluger, entspannter Freund.
+- Du bist freundlich, humorvoll und gelegentlich leicht sarkastisch – aber nie verletzend.
+- Du antwortest immer auf Deutsch.
+- Du bist hilfsbereit und erklärst Dinge klar und verständlich.
+- Du machst keine unnötig langen Texte. Präzise, aber nicht zu knapp.
+
+Smalltalk:
+- Du DARFST gelegentlich leichte Smalltalk-Elemente benutzen („klingt spannend“, „cooler Gedanke“, „was geht bei dir so?“).
+- Aber du machst das NICHT ständig und NICHT mehrmals hintereinander.
+- Du stellst keine aufdringlichen Fragen.
+- Du verhältst dich wie ein normaler Mensch: locker, aber nicht pushy.
+
+Identität:
+- Wenn der Nutzer fragt „Wer bist du?“ oder „Wie heißt du?“ antwortest du:
+  „Ich bin Moddins KI-Bot.“
+- Du stellst dich NICHT selbstständig vor, außer der Nutzer fragt danach.
+
+Stil:
+- Maximal 1–2 passende Emojis, optional.
+- Kein übertriebenes Motivieren, kein Kitsch, keine Zwangs-Fröhlichkeit.
+- Wenn Sarkasmus, dann sehr leicht und freundlich.
+
+Was du vermeiden sollst:
+- Keine wiederholten Standardfloskeln wie „Wie kann ich dir heute helfen?“
+- Kein künstliches „Wir lernen uns kennen“-Gerede.
+- Kein übermäßiges Nachfragen.
+- Keine langen Monologe.
+- Keine ständig wiederkehrenden Vorschläge.
+
+Ziel:
+- Natürlich, locker, schlau und angenehm zu reden.
+
+
+"""
+
+
 # =========================
 # Chat Messages API
 
+def message_cursor(m):
+    """Cursor für Keyset-Pagination: <created_at>_<id>"""
+    return f"{m.created_at.isoformat()}_{m.id}"
+
+def parse_cursor(value):
+    created, msg_id = value.rsplit("_", 1)
+    return datetime.fromisoformat(created), int(msg_id)
+
 @app.route("/api/chats/<int:chat_id>/messages", methods=["GET"])
 def list_messages(chat_id):
-    """Nachrichten eines Chats laden"""
+    """Nachrichten eines Chats laden (seitenweise, neueste Seite zuerst)
+
+    ?before=<cursor>  ältere Nachrichten (beim Hochscrollen)
+    ?after=<cursor>   neu gespeicherte Nachrichten (inkrementeller Sync, nach id)
+    ?since=<ISO-Zeit> alle Nachrichten seit diesem Zeitpunkt
+    ?limit=<n>        Seitengröße (max. 200)
+
+    Mit If-None-Match kommt 304, solange der Chat sich nicht geändert hat.
+    """
     if not session.get("user_id"):
         return jsonify({"error": "unauthorized"}), 401
+    return cached_json([("chat", chat_id)], partial(messages_page, chat_id, session["user_id"]))
 
-    chat = Chat.query.filter_by(id=chat_id, user_id=session["user_id"]).first()
+# Spalten für die Nachrichten-API (Row-Tupel statt ChatMessage-Objekte)
+MESSAGE_COLUMNS = (ChatMessage.id, ChatMessage.content, ChatMessage.created_at, ChatMessage.user_id)
+
+def messages_page(chat_id, user_id):
+    chat = db.session.query(Chat.id).filter_by(id=chat_id, user_id=user_id).first()
     if not chat:
         return jsonify({"error": "Chat nicht gefunden."}), 404
+    if is_archived(chat.id):
+        # GET schreibt nicht: auspacken nur über POST /api/chats/<id>/rehydrate
+        return jsonify({"error": "Chat ist archiviert.", "archiviert": True}), 409
+
+    limit = max(1, min(request.args.get("limit", 50, type=int), 200))
+    before = request.args.get("before")
+    after = request.args.get("after")
+    since = request.args.get("since")
+
+    try:
+        query = db.session.query(*MESSAGE_COLUMNS).filter(ChatMessage.chat_id == chat.id)
+        if after:
+            # vorwärts nach id statt nach Zeit: die User-Nachricht wird erst nach der
+            # KI-Antwort gespeichert, trägt aber die Sendezeit. Ein Zeit-Cursor, der
+            # schon weiter ist, würde sie nie mehr liefern; die id steigt beim Einfügen.
+            _c_time, c_id = parse_cursor(after)
+            rows = (query.filter(ChatMessage.id > c_id).order_by(ChatMessage.id.asc())
+                    .limit(limit + 1).all())
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+        elif since:
+            query = query.filter(ChatMessage.created_at > datetime.fromisoformat(since))
+            rows = (query.order_by(ChatMessage.created_at.asc(), ChatMessage.id.asc())
+                    .limit(limit + 1).all())
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+        else:
+            # rückwärts: neueste zuerst, danach wieder chronologisch sortieren
+            if before:
+                c_time, c_id = parse_cursor(before)
+                query = query.filter(or_(ChatMessage.created_at < c_time,
+                                         and_(ChatMessage.created_at == c_time, ChatMessage.id < c_id)))
+            rows = (query.order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
+                    .limit(limit + 1).all())
+            has_more = len(rows) > limit
+            rows = list(reversed(rows[:limit]))
+    except ValueError:
+        return jsonify({"error": "Ungültiger Cursor."}), 400
 
-    rows = (ChatMessage.query
-            .filter_by(chat_id=chat.id)                     
-            .order_by(ChatMessage.created_at.asc())
-            .all())
+    return {
+        "messages": [m._asdict() for m in rows],
+        "before_cursor": message_cursor(rows[0]) if rows else before,
+        "after_cursor": message_cursor(max(rows, key=lambda m: m.id)) if rows else after,
+        "has_more": has_more,   # gibt es in dieser Richtung noch mehr?
+    }
 
+# =========================
+# Volltextsuche über alle Chats des Users (FTS5, bm25-Ranking)
+@app.route("/api/search", methods=["GET"])
+def api_search():
+    """?q=<text>&limit=<n>&offset=<n>; Treffer mit Snippet, bestes zuerst"""
+    if not session.get("user_id"):
+        return jsonify({"error": "unauthorized"}), 401
+    if db.engine.dialect.name != "sqlite":
+        return jsonify({"error": "Die Suche gibt es nur mit SQLite (FTS5)."}), 501
+
+    q = (request.args.get("q") or "").strip()
+    if len(q) < 2:
+        return jsonify({"error": "Suchbegriff ist zu kurz."}), 400
+    limit = max(1, min(request.args.get("limit", 20, type=int), 50))
+    offset = max(0, request.args.get("offset", 0, type=int))
+
+    conn = db.session.connection()
+    rows, has_more = search_messages(conn, session["user_id"], q, limit=limit, offset=offset)
+    chats = search_chats(conn, session["user_id"], q) if offset == 0 else []
+    # archivierte Chats haben keine einzelnen Nachrichten mehr im Index, nur den Chat
+    archived = search_archived(conn, session["user_id"], q) if offset == 0 else []
     return jsonify({
-        "messages": [
+        "results": [
+            {
+                "id": r.id,
+                "chat_id": r.chat_id,
+                "chat_title": r.title,
+                "user_id": r.user_id,
+                "created_at": r.created_at,
+                "snippet": r.snippet,
+            }
+            for r in rows
+        ],
+        "chats": [{"id": c.id, "title": c.title} for c in chats],
+        "archiv": [
             {
-                "id": m.id,
-                "content": m.content,
-                "created_at": m.created_at.isoformat(),
-                "user_id": m.user_id
+                "chat_id": a.chat_id,
+                "chat_title": a.title,
+                "snippet": text_snippet((m.content for m in unpack_messages(a.data)), q),
             }
-            for m in rows
-        ]
+            for a in archived
+        ],
+        "next_offset": offset + limit if has_more else None,
     })
 
+# =========================
+# Export / Import aller Chats eines Users (NDJSON, optional gzip)
+app.config["EXPORT_BATCH"] = 1000               # Zeilen pro DB-Batch (yield_per / executemany)
+app.config["IMPORT_MAX_BYTES"] = 200 * 1024 * 1024
+app.config["IMPORT_MAX_ENTPACKT"] = 500 * 1024 * 1024   # Bytes nach dem Entpacken von gzip
+app.config["IMPORT_MAX_NACHRICHTEN"] = 100_000
+
+@app.route("/api/export", methods=["GET"])
+def api_export():
+    """Alle Chats + Nachrichten als NDJSON-Download (?gzip=1 komprimiert)"""
+    user = current_user()
+    if not user:
+        return jsonify({"error": "unauthorized"}), 401
+
+    lines = export_lines(db.session, Chat, ChatMessage, user.id, user.username, batch=app.config["EXPORT_BATCH"],
+                         archived=archived_messages(user.id))
+    filename = f"chats_{user.username}_{datetime.utcnow():%Y%m%d}.ndjson"
+    mimetype = "application/x-ndjson"
+    if request.args.get("gzip"):
+        lines = gzip_chunks(lines)
+        filename += ".gz"
+        mimetype = "application/gzip"
+    return Response(gestreamt(lines), mimetype=mimetype, headers={
+        "Content-Disposition": content_disposition(filename),   # Username kann beliebige Zeichen enthalten
+        "Cache-Control": "no-store",
+    })
+
+@app.route("/api/import", methods=["POST"])
+def api_import():
+    """NDJSON (oder .ndjson.gz) aus /api/export als neue Chats einlesen"""
+    if not session.get("user_id"):
+        return jsonify({"error": "unauthorized"}), 401
+    user_id = session["user_id"]
+    request.max_content_length = app.config["IMPORT_MAX_BYTES"]
+
+    free = max(0, 20 - Chat.query.filter_by(user_id=user_id).count())
+    db.session.commit()   # keine offene Lese-Transaktion, während import_lines schreibt
+    try:
+        counts = import_lines(
+            db.engine, Chat, ChatMessage, user_id,
+            open_ndjson(request.stream, max_bytes=app.config["IMPORT_MAX_ENTPACKT"]),
+            batch=app.config["EXPORT_BATCH"],
+            max_chats=free,
+            max_messages=app.config["IMPORT_MAX_NACHRICHTEN"],
+        )
+    except ImportFehler as e:
+        return jsonify({"error": str(e)}), 400
+    except RequestEntityTooLarge:
+        return jsonify({"error": "Datei ist zu groß."}), 413
+    except (OSError, EOFError, UnicodeDecodeError) as e:
+        # kaputtes gzip / kein UTF-8
+        return jsonify({"error": f"Datei kann nicht gelesen werden: {e}"}), 400
+    except DBAPIError as e:
+        return jsonify({"error": f"Import fehlgeschlagen: {e.orig}"}), 400
+    versionen.bump(("chats", user_id))
+    return jsonify(counts), 201
+
+# =========================
+# Aufbewahrung: LoginHistory kürzen, alte Chats archivieren, SQLite aufräumen
+app.config["WARTUNG_AKTIV"] = True
+app.config["WARTUNG_INTERVALL"] = 6 * 3600          # Sekunden zwischen zwei Läufen
+app.config["WARTUNG_LOGIN_HISTORY_TAGE"] = 90       # ältere Logins löschen, None = behalten
+app.config["WARTUNG_ARCHIV_TAGE"] = 180             # Chats ohne neue Nachricht seit N Tagen archivieren, None = nie
+app.config["WARTUNG_ARCHIV_MAX"] = 500              # Chats pro Lauf
+app.config["WARTUNG_BATCH"] = 1000                  # Zeilen pro DELETE / INSERT
+app.config["WARTUNG_VACUUM_SEITEN"] = 2000          # freie Seiten pro Lauf zurückgeben
+app.config["WARTUNG_INCREMENTAL_VACUUM"] = False    # alte DBs im Hintergrund umstellen? Volles VACUUM sperrt die DB
+                                                    # minutenlang -> lieber gezielt: flask --app app1 wartung --vacuum
+
+archiv_lock = threading.Lock()   # Archivieren und Auspacken nie gleichzeitig
+
+def is_archived(chat_id):
+    """Nur ein Lookup per Primärschlüssel"""
+    return db.session.query(ChatArchiv.chat_id).filter_by(chat_id=chat_id).first() is not None
+
+def ensure_rehydrated(chat_id):
+    """Archivierten Chat wieder auspacken (nur aus POST-Routen: schreibt in die DB)"""
+    if not is_archived(chat_id):
+        return 0
+    with archiv_lock:
+        db.session.commit()   # neuer Snapshot: ein anderer Thread war vielleicht schneller
+        n = rehydrate_chat(db.session.connection(), chat_id, batch=app.config["WARTUNG_BATCH"])
+        db.session.commit()
+    if n:
+        kontext_cache.invalidate(chat_id)
+        versionen.bump(("chat", chat_id))
+        app_log.info("archiv_ausgepackt", extra={"felder": {"chat_id": chat_id, "nachrichten": n}})
+    return n
+
+def archived_messages(user_id):
+    """(chat_id, Nachrichten) der archivierten Chats eines Users, nur lesend (für den Export)"""
+    rows = (db.session.query(ChatArchiv.chat_id, ChatArchiv.data)
+            .join(Chat, Chat.id == ChatArchiv.chat_id)
+            .filter(Chat.user_id == user_id)
+            .order_by(ChatArchiv.chat_id))
+    for chat_id, data in rows.yield_per(1):
+        yield chat_id, unpack_messages(data)
+
+@app.route("/api/chats/<int:chat_id>/rehydrate", methods=["POST"])
+def rehydrate_chat_route(chat_id):
+    """Archivierten Chat auspacken (GET /messages antwortet dann nicht mehr mit 409)"""
+    if not session.get("user_id"):
+        return jsonify({"error": "unauthorized"}), 401
+    chat = db.session.query(Chat.id).filter_by(id=chat_id, user_id=session["user_id"]).first()
+    if not chat:
+        return jsonify({"error": "Chat nicht gefunden."}), 404
+    return jsonify({"nachrichten": ensure_rehydrated(chat.id)})
+
+def wartung_einmal(vacuum=False):
+    """Ein Wartungslauf; jeder Schritt in eigenen, kurzen Transaktionen.
+    vacuum=True stellt eine alte DB einmalig auf auto_vacuum=INCREMENTAL um (volles VACUUM)"""
+    result = {}
+    with app.app_context():
+        if app.config["WARTUNG_LOGIN_HISTORY_TAGE"] is not None:
+            result["login_history_geloescht"] = prune_login_history(
+                db.engine, app.config["WARTUNG_LOGIN_HISTORY_TAGE"], batch=app.config["WARTUNG_BATCH"])
+
+        if app.config["WARTUNG_ARCHIV_TAGE"] is not None:
+            archived = 0
+            for chat_id in chats_to_archive(db.engine, app.config["WARTUNG_ARCHIV_TAGE"],
+                                            app.config["WARTUNG_ARCHIV_MAX"]):
+                with archiv_lock, db.engine.begin() as conn:
+                    n = archive_chat(conn, chat_id)
+                if n:
+                    kontext_cache.invalidate(chat_id)
+                    versionen.bump(("chat", chat_id))
+                    archived += 1
+            result["chats_archiviert"] = archived
+
+        result.update(sqlite_housekeeping(
+            db.engine,
+            vacuum_pages=app.config["WARTUNG_VACUUM_SEITEN"],
+            enable_incremental=vacuum or app.config["WARTUNG_INCREMENTAL_VACUUM"],
+        ))
+    return result
+
+wartung = Wartung(wartung_einmal, interval=app.config["WARTUNG_INTERVALL"])
+if app.config["WARTUNG_AKTIV"]:
+    wartung.start()
+
+# =========================
+# Kontext-Fenster eines Chats holen
+def get_kontext(chat_id, before_id=None):
+    """Fenster mit dem Verlauf vor der Nachricht before_id (None = ganzer Chat)"""
+    conditions = [ChatMessage.chat_id == chat_id]
+    if before_id is not None:
+        conditions.append(ChatMessage.id < before_id)
+
+    def loader():
+        rows = (ChatMessage.query
+                .filter(*conditions)
+                .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
+                .limit(app.config["KONTEXT_LADEN_MAX"])
+                .all())
+        return [(m.id, "assistant" if m.user_id == 0 else "user", m.content) for m in reversed(rows)]
+
+    with stufe("kontext"):
+        last_id = db.session.query(func.max(ChatMessage.id)).filter(*conditions).scalar()
+        return kontext_cache.get(chat_id, loader, last_id)
+
+# =========================
+# KI-Antwort holen: Cache -> semantischer Cache -> Zusammenlegen -> Warteschlange -> Modell
+def ki_antwort(text, route, history):
+    """Komplette Antwort als (text, think); bei Überlast auf das Fallback-Modell"""
+    try:
+        return _ki_antwort(text, route, history)
+    except KiUeberlastet:
+        fallback = ki_router.fallback_for(route)
+        if not fallback:
+            raise
+        return _ki_antwort(text, fallback, history)
+
+def _ki_antwort(text, route, history):
+    model_call = partial(ki_dispatcher.run, route["model"], ask_deepseek, timeout=route["max_wait"])
+    coalesced_call = partial(ask_coalesced, ki_flight, model_call)
+    return ask_cached(
+        antwort_cache,
+        antwort_policy,
+        partial(ask_semantic, semantik_cache, semantik_policy, coalesced_call),
+        input_content=text,
+        system_prompt=SYSTEM_PROMPT,
+        model=route["model"],
+        deep_think=route["deep_think"],
+        history=history,
+        options=route["options"],
+    )
+
+def ki_antwort_stream(text, route, history):
+    """Antwort als Generator von Text-Stücken; bei Überlast auf das Fallback-Modell"""
+    started = False
+    try:
+        for piece in _ki_antwort_stream(text, route, history):
+            started = True
+            yield piece
+    except KiUeberlastet:
+        fallback = ki_router.fallback_for(route)
+        if started or not fallback:
+            raise
+        yield from _ki_antwort_stream(text, fallback, history)
+
+def _ki_antwort_stream(text, route, history):
+    model, deep_think = route["model"], route["deep_think"]
+    # dieselben Cache-Stufen wie _ki_antwort (ask_cached -> ask_semantic), nur als Stream
+    key, hit = lookup_cached(antwort_cache, antwort_policy, text, SYSTEM_PROMPT, model, deep_think, history)
+    if hit is not None:
+        yield hit["reply"]
+        return
+
+    vec, hit = lookup_semantic(semantik_cache, semantik_policy, text, SYSTEM_PROMPT, model, deep_think, history)
+    if hit is not None:
+        store_cached(antwort_cache, key, hit["reply"], hit["think"])
+        yield hit["reply"]
+        return
+
+    metrik_route = aktuelle_route()
+
+    def model_stream():
+        # läuft bei ki_flight in einem eigenen Thread: Route für die Metriken mitnehmen
+        _metrik_thread.route = metrik_route
+        try:
+            yield from ki_dispatcher.stream(
+                model,
+                ask_deepseek_stream,
+                input_content=text,
+                system_prompt=SYSTEM_PROMPT,
+                model=model,
+                deep_think=deep_think,
+                history=history,
+                options=route["options"],
+                timeout=route["max_wait"],
+            )
+        finally:
+            _metrik_thread.route = None
+    if ki_flight:
+        pieces = ki_flight.stream(flight_key(model, deep_think, SYSTEM_PROMPT, history, text), model_stream)
+    else:
+        pieces = model_stream()
+
+    parts = []
+    for piece in pieces:
+        parts.append(piece)
+        yield piece
+
+    reply = "".join(parts).strip()
+    store_cached(antwort_cache, key, reply, "")
+    store_semantic(semantik_cache, model, SYSTEM_PROMPT, vec, reply, "")
+
+# =========================
+# Einen Turn speichern: User-Nachricht + KI-Antwort in einer Transaktion
+def save_turn(chat_id, user_id, text, created_at, bot_reply=None):
+    """Ein INSERT (insertmanyvalues) und ein Commit pro Turn statt zwei.
+
+    bot_reply=None speichert nur die User-Nachricht; eine leere Antwort ("")
+    wird gespeichert wie jede andere (z.B. nur ein <think>-Block).
+    """
+    msg = ChatMessage(chat_id=chat_id, user_id=user_id, content=text, created_at=created_at)
+    rows = [msg]
+    bot_msg = None
+    if bot_reply is not None:
+        bot_msg = ChatMessage(chat_id=chat_id, user_id=0, content=bot_reply,  # 0 = System / KI
+                              created_at=datetime.utcnow())
+        rows.append(bot_msg)
+    try:
+        with stufe("speichern"):
+            db.session.add_all(rows)
+            db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    versionen.bump(("chat", chat_id))
+    return msg, bot_msg
+
+def message_json(m):
+    return {
+        "id": m.id,
+        "content": m.content,
+        "created_at": m.created_at.isoformat()
+    }
+
 # =========================
 # Neue Nachricht erstellen + KI antworten lassen
 @app.route("/api/chats/<int:chat_id>/messages", methods=["POST"])
@@ -427,6 +1486,7 @@ def create_message(chat_id):
     chat = Chat.query.filter_by(id=chat_id, user_id=session["user_id"]).first()
     if not chat:
         return jsonify({"error": "Chat nicht gefunden."}), 404
+    ensure_rehydrated(chat.id)   # vor dem Speichern: ausgepackte Nachrichten bekommen neue ids
 
     try:
         data = request.get_json()
@@ -437,132 +1497,343 @@ def create_message(chat_id):
         if not text:
             return jsonify({"error": "Nachricht darf nicht leer sein."}), 400
 
-        # 1. User-Nachricht speichern
-        msg = ChatMessage(chat_id=chat.id, user_id=session["user_id"], content=text)
-        db.session.add(msg)
-        db.session.commit()
+        sent_at = datetime.utcnow()
 
-        # 2. gesamten Chatverlauf laden (falls du ihn später nutzen willst)
-        all_messages = ChatMessage.query.filter_by(
-            chat_id=chat.id
-        ).order_by(ChatMessage.created_at.asc()).all()
+        # Job-Modus: User-Nachricht sofort speichern, KI im Hintergrund (Ergebnis über /api/jobs/<id>)
+        if app.config["KI_JOB_MODUS"] or data.get("async"):
+            msg, _ = save_turn(chat.id, session["user_id"], text, sent_at)
+            route = choose_model_for_prompt(text)
+            job = ki_jobs.submit(
+                {"chat_id": chat.id, "message_id": msg.id, "text": text, "route": route},
+                user_id=session["user_id"],
+                priority=route["priority"],
+            )
+            return jsonify({
+                "user_message": message_json(msg),
+                "job": job_info(job)
+            }), 202, {"Location": url_for("get_job", job_id=job["id"])}
 
-        
-        messages_for_ai = []# Vorbereitung der Nachrichten für die KI
-        for mi in all_messages:
-            if mi.user_id == session["user_id"]:
-                role = "user"
-            else:
-                role = "assistant"
-            messages_for_ai.append({
-                "role": role,
-                "content": mi.content
-            })
-
-        # 3. System-Prompt für deine KI-Persönlichkeit
-        system_prompt = """
-Du bist Moddins KI-Bot.
+        # 1. Verlauf für die KI (Fenster aus dem Cache, nur bei Bedarf aus der DB)
+        kontext = get_kontext(chat.id)
+        history = kontext.messages()
 
-Persönlichkeit:
-- Du wirkst wie ein kluger, entspannter Freund.
-- Du bist freundlich, humorvoll und gelegentlich leicht sarkastisch – aber nie verletzend.
-- Du antwortest immer auf Deutsch.
-- Du bist hilfsbereit und erklärst Dinge klar und verständlich.
-- Du machst keine unnötig langen Texte. Präzise, aber nicht zu knapp.
+        # 2. KI antworten lassen (ohne offene Schreib-Transaktion)
+        try:
+            route=choose_model_for_prompt(text)
 
-Smalltalk:
-- Du DARFST gelegentlich leichte Smalltalk-Elemente benutzen („klingt spannend“, „cooler Gedanke“, „was geht bei dir so?“).
-- Aber du machst das NICHT ständig und NICHT mehrmals hintereinander.
-- Du stellst keine aufdringlichen Fragen.
-- Du verhältst dich wie ein normaler Mensch: locker, aber nicht pushy.
+            with stufe("ki"):
+                bot_reply, _think = ki_antwort(text, route, history)
+        except (KiUeberlastet, FlightTimeout) as e:
+            save_turn(chat.id, session["user_id"], text, sent_at)
+            return jsonify({"error": "Die KI ist gerade ausgelastet. Bitte gleich nochmal versuchen."}), 503, {"Retry-After": "5"}
+        except Exception as e:
+            save_turn(chat.id, session["user_id"], text, sent_at)
+            return jsonify({"error": f"KI Fehler: {str(e)}"}), 500
 
-Identität:
-- Wenn der Nutzer fragt „Wer bist du?“ oder „Wie heißt du?“ antwortest du:
-  „Ich bin Moddins KI-Bot.“
-- Du stellst dich NICHT selbstständig vor, außer der Nutzer fragt danach.
+        # 3. User-Nachricht + KI-Antwort zusammen speichern
+        msg, bot_msg = save_turn(chat.id, session["user_id"], text, sent_at, bot_reply)
 
-Stil:
-- Maximal 1–2 passende Emojis, optional.
-- Kein übertriebenes Motivieren, kein Kitsch, keine Zwangs-Fröhlichkeit.
-- Wenn Sarkasmus, dann sehr leicht und freundlich.
+        kontext.append("user", msg.content, msg.id)
+        kontext.append("assistant", bot_msg.content, bot_msg.id)
 
-Was du vermeiden sollst:
-- Keine wiederholten Standardfloskeln wie „Wie kann ich dir heute helfen?“
-- Kein künstliches „Wir lernen uns kennen“-Gerede.
-- Kein übermäßiges Nachfragen.
-- Keine langen Monologe.
-- Keine ständig wiederkehrenden Vorschläge.
+        # 4. Antwort ans Frontend
+        return jsonify({
+            "user_message": message_json(msg),
+            "bot_message": message_json(bot_msg)
+        }), 201
 
-Ziel:
-- Natürlich, locker, schlau und angenehm zu reden.
+    except Exception as e:
+        return jsonify({"error": f"Server Fehler: {str(e)}"}), 500
+
+# =========================
+# Neue Nachricht erstellen + KI-Antwort streamen (Server-Sent Events)
+def sse_event(data, event=None):
+    """Ein SSE-Ereignis als Text bauen"""
+    out = ""
+    if event:
+        out += f"event: {event}\n"
+    out += f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+    return out
+
+@app.route("/api/chats/<int:chat_id>/messages/stream", methods=["POST"])
+def create_message_stream(chat_id):
+    """Neue Nachricht anlegen + KI-Antwort Token für Token senden"""
+    if not session.get("user_id"):
+        return jsonify({"error": "unauthorized"}), 401
 
+    chat = Chat.query.filter_by(id=chat_id, user_id=session["user_id"]).first()
+    if not chat:
+        return jsonify({"error": "Chat nicht gefunden."}), 404
+    ensure_rehydrated(chat.id)   # vor dem Speichern: ausgepackte Nachrichten bekommen neue ids
 
-"""
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"error": "Keine Daten erhalten"}), 400
 
-        # 4. KI antworten lassen
-        try:
-            route=choose_model_for_prompt(text)
-            model1=route["model"]
-            use_deep_think=route["deep_think"]
+    text = (data.get("content") or "").strip()
+    if not text:
+        return jsonify({"error": "Nachricht darf nicht leer sein."}), 400
 
-            bot_reply, _think = ask_deepseek(
-                input_content=text,
-                system_prompt=system_prompt,
-                model=model1,
-                deep_think=use_deep_think,
-            )
+    # 1. User-Nachricht wird erst am Ende zusammen mit der Antwort gespeichert
+    sent_at = datetime.utcnow()
+    user_id = session["user_id"]
+    route = choose_model_for_prompt(text)
+    chat_id = chat.id
+    kontext = get_kontext(chat.id)
+    history = kontext.messages()
+    user_message = {
+        "id": None,
+        "content": text,
+        "created_at": sent_at.isoformat()
+    }
+
+    def generate():
+        yield sse_event(user_message, "user_message")
+
+        parts = []
+        finished = False
+        try:
+            # 2. KI-Antwort stückweise weiterreichen
+            with stufe("ki"):
+                for piece in ki_antwort_stream(text, route, history):
+                    parts.append(piece)
+                    yield sse_event({"delta": piece})
+            finished = True
+        except (KiUeberlastet, FlightTimeout):
+            yield sse_event({"error": "Die KI ist gerade ausgelastet. Bitte gleich nochmal versuchen."}, "error")
         except Exception as e:
-            return jsonify({"error": f"KI Fehler: {str(e)}"}), 500
+            yield sse_event({"error": f"KI Fehler: {str(e)}"}, "error")
+        finally:
+            # 3. Turn in einer Transaktion speichern (auch wenn der Client vorher abbricht)
+            bot_reply = "".join(parts).strip() if finished or parts else None
+            msg, bot_msg = save_turn(chat_id, user_id, text, sent_at, bot_reply)
+            if bot_msg:
+                kontext.append("user", text, msg.id)
+                kontext.append("assistant", bot_reply, bot_msg.id)
+
+        if finished:
+            yield sse_event({
+                "id": bot_msg.id if bot_msg else None,
+                "content": bot_reply,
+                "created_at": bot_msg.created_at.isoformat() if bot_msg else None,
+                "user_message": message_json(msg)
+            }, "done")
+
+    return Response(
+        gestreamt(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-        # 5. KI-Antwort speichern
-        bot_msg = ChatMessage(
-            chat_id=chat.id,
-            user_id=0,             # 0 = System / KI
-            content=bot_reply
-        )
+# =========================
+# Hintergrund-Jobs für KI-Antworten
+def ki_job_handler(job):
+    """Läuft im Worker-Thread: KI-Antwort erzeugen und speichern"""
+    p = job["payload"]
+    with app.app_context():
+        if not db.session.get(Chat, p["chat_id"]):
+            raise ValueError("Chat wurde inzwischen gelöscht.")
+
+        kontext = get_kontext(p["chat_id"], p["message_id"])
+        with stufe("ki", route="ki_job", model=p["route"]["model"]):
+            bot_reply, _think = ki_antwort(p["text"], p["route"], kontext.messages())
+
+        bot_msg = ChatMessage(chat_id=p["chat_id"], user_id=0, content=bot_reply)
         db.session.add(bot_msg)
         db.session.commit()
+        versionen.bump(("chat", p["chat_id"]))
 
-        # 6. Antwort ans Frontend
-        return jsonify({
-            "user_message": {
-                "id": msg.id,
-                "content": msg.content,
-                "created_at": msg.created_at.isoformat()
-            },
-            "bot_message": {
-                "id": bot_msg.id,
-                "content": bot_msg.content,
-                "created_at": bot_msg.created_at.isoformat()
-            }
-        }), 201
+        kontext.append("user", p["text"], p["message_id"])
+        kontext.append("assistant", bot_reply, bot_msg.id)
 
-    except Exception as e:
-        return jsonify({"error": f"Server Fehler: {str(e)}"}), 500
+        return {"bot_message": message_json(bot_msg)}
+
+def job_info(job):
+    return {
+        "id": job["id"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "result": job["result"],
+        "error": job["error"] if job["status"] == FAILED else None,
+    }
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """Status eines Jobs; mit ?wait=N wird bis zu N Sekunden auf das Ergebnis gewartet"""
+    if not session.get("user_id"):
+        return jsonify({"error": "unauthorized"}), 401
+
+    job = ki_jobs.store.get(job_id)
+    if not job or job["user_id"] != session["user_id"]:
+        return jsonify({"error": "Job nicht gefunden."}), 404
+
+    wait = min(request.args.get("wait", 0, type=float), 30)
+    if wait > 0 and job["status"] not in (DONE, FAILED):
+        job = ki_jobs.wait(job_id, wait)
+        if job is None:
+            # inzwischen aus dem Speicher verdrängt (MemoryJobStore behält nur die letzten)
+            return jsonify({"error": "Job nicht gefunden."}), 404
+
+    return jsonify(job_info(job))
+
+# =========================
+# Auslastung der KI (Warteschlangen pro Modell)
+@app.route("/api/ki/status", methods=["GET"])
+def ki_status():
+    if not session.get("user_id"):
+        return jsonify({"error": "unauthorized"}), 401
+    return jsonify({
+        "models": ki_dispatcher.stats(),
+        "routes": ki_router.stats(),
+        "zusammengelegt": ki_flight.stats() if ki_flight else None,
+        "jobs": ki_jobs.stats(),
+        "cache": antwort_cache.stats() if antwort_cache else None,
+        "semantik_cache": semantik_cache.stats() if semantik_cache else None,
+        "etag_cache": response_cache.stats(),
+        "wartung": wartung.stats(),
+    })
 
 # =========================
 # Modell Auswahl basierend auf dem Prompt
 def choose_model_for_prompt(text:str):
-    t=(text or "").lower()
+    """Route für den Prompt (Modell, deep_think, Budgets) aus routing.json"""
+    with stufe("routing"):
+        route = ki_router.choose(text)
+    if has_request_context():
+        g.ki_model = route["model"]
+    return route
 
-    keywords=["warum", "wieso", "erklär", "erklärung",
-        "analysiere", "analyse",
-        "code", "python", "bug", "funktioniert nicht", "fehler",
-        "mathe", "berechne", "rechnung", "algorithmus", "logik"]
-    if any(k in t for k in keywords) or len(t)>200:
-              return {
-            "model": "deepseek-r1:8b",
-            "deep_think": True
-        }
 
 
 
+# =========================
+# Query-Plan Audit: die häufigsten Abfragen dürfen chat/chat_message nicht komplett scannen
+def hot_queries():
+    """name -> ORM-Query/select() oder (text(), params)"""
+    now = datetime.utcnow()
     return {
-        "model": "llama3.1:8b",
-        "deep_think": False
+        "chat_liste": Chat.query.filter_by(user_id=1).order_by(Chat.created_at.desc()),
+        "chat_anzahl": Chat.query.filter_by(user_id=1).with_entities(func.count(Chat.id)),
+        "chat_suchen": Chat.query.filter_by(id=1, user_id=1),
+        "nachrichten_neueste": (ChatMessage.query.filter_by(chat_id=1)
+                                .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
+                                .limit(51)),
+        "nachrichten_vorher": (ChatMessage.query.filter_by(chat_id=1)
+                               .filter(or_(ChatMessage.created_at < now,
+                                           and_(ChatMessage.created_at == now, ChatMessage.id < 10)))
+                               .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
+                               .limit(51)),
+        "kontext_letzte_id": (db.session.query(func.max(ChatMessage.id))
+                              .filter(ChatMessage.chat_id == 1, ChatMessage.id < 10)),
+        "nachrichten_nachher": (db.session.query(*MESSAGE_COLUMNS)
+                                .filter(ChatMessage.chat_id == 1, ChatMessage.id > 10)
+                                .order_by(ChatMessage.id.asc())
+                                .limit(51)),
+        "export": export_query(Chat, ChatMessage, 1),
+        "suche": (SEARCH_MESSAGES, search_params(1, "hallo welt")),
     }
 
-
+def audit_hot_queries():
+    """[(name, plan, fehler)] für alle Hot-Queries (db-audit und Tests)"""
+    results = []
+    for name, query in hot_queries().items():
+        query, params = query if isinstance(query, tuple) else (query, None)
+        try:
+            results.append((name, assert_no_table_scan(db, query, name, params), None))
+        except AssertionError as e:
+            results.append((name, None, str(e)))
+    return results
+
+@app.cli.command("avatare-umwandeln")
+def avatare_umwandeln():
+    """Alte Avatare (Originaldateien) in Hash-Varianten umwandeln (flask --app app1 avatare-umwandeln)"""
+    for user in User.query.filter(User.avatar.isnot(None)).all():
+        old = os.path.basename(user.avatar)
+        if HASHED_NAME.match(old):
+            continue
+        path = os.path.join(app.config["UPLOAD_FOLDER"], old)
+        try:
+            old_size = os.path.getsize(path)
+            with open(path, "rb") as f:
+                name = store_avatar(app.config["UPLOAD_FOLDER"], f.read(), app.config["AVATAR_GROESSEN"],
+                                    fmt=app.config["AVATAR_FORMAT"], quality=app.config["AVATAR_QUALITAET"])
+        except (OSError, UngueltigesBild) as e:
+            print(f"❌ {user.username}: {e}")
+            continue
+        user.avatar = f"avatars/{name}"
+        db.session.commit()
+        remove_avatar_files(f"avatars/{old}", user.id)
+        print(f"✅ {user.username}: {old} ({old_size} Bytes) -> {name}")
+
+@app.cli.command("export")
+@click.argument("username")
+@click.option("-o", "--output", type=click.Path(dir_okay=False), help="Datei (Standard: stdout)")
+@click.option("--gzip", "compress", is_flag=True, help="gzip-komprimiert schreiben")
+def export_command(username, output, compress):
+    """Chats eines Users als NDJSON exportieren (flask --app app1 export <user> -o datei.ndjson)"""
+    user = User.query.filter_by(username=username.lower()).first()
+    if not user:
+        raise click.ClickException(f"User {username} nicht gefunden")
+    chunks = export_lines(db.session, Chat, ChatMessage, user.id, user.username, batch=app.config["EXPORT_BATCH"],
+                          archived=archived_messages(user.id))
+    if compress:
+        chunks = gzip_chunks(chunks)
+    out = open(output, "wb") if output else click.get_binary_stream("stdout")
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+    finally:
+        if output:
+            out.close()
+
+@app.cli.command("import")
+@click.argument("username")
+@click.argument("datei", type=click.File("rb"))
+def import_command(username, datei):
+    """NDJSON-Export (auch .gz) in die Chats eines Users einlesen (flask --app app1 import <user> datei)"""
+    user = User.query.filter_by(username=username.lower()).first()
+    if not user:
+        raise click.ClickException(f"User {username} nicht gefunden")
+    try:
+        counts = import_lines(db.engine, Chat, ChatMessage, user.id, open_ndjson(datei),
+                              batch=app.config["EXPORT_BATCH"])
+    except (ImportFehler, DBAPIError) as e:
+        raise click.ClickException(str(e))
+    print(f"✅ {counts['chats']} Chats, {counts['nachrichten']} Nachrichten importiert")
+
+@app.cli.command("wartung")
+@click.option("--vacuum", is_flag=True,
+              help="DB einmalig auf auto_vacuum=INCREMENTAL umstellen (volles VACUUM, sperrt die DB)")
+def wartung_command(vacuum):
+    """Einen Wartungslauf sofort ausführen (flask --app app1 wartung [--vacuum])"""
+    result = wartung.run(vacuum=vacuum)
+    if wartung.last_error:
+        raise click.ClickException(wartung.last_error)
+    print(f"✅ {result}")
+
+@app.cli.command("suche-neu-aufbauen")
+def suche_neu_aufbauen():
+    """FTS5-Index komplett neu aus den Tabellen aufbauen (flask --app app1 suche-neu-aufbauen)"""
+    with db.engine.begin() as conn:
+        if install_fts(conn, rebuild=False):
+            rebuild_fts(conn)
+            n = reindex_archives(conn)
+            print(f"✅ Suchindex neu aufgebaut ({n} archivierte Chats)")
+        else:
+            print("❌ Suchindex gibt es nur mit SQLite")
+
+@app.cli.command("db-audit")
+def db_audit():
+    """Query-Pläne der Hot-Queries prüfen (flask --app app1 db-audit)"""
+    failed = False
+    for name, plan, error in audit_hot_queries():
+        if error:
+            failed = True
+            print(f"❌ {error}")
+        else:
+            print(f"✅ {name}: {' | '.join(plan)}")
+    if failed:
+        raise SystemExit(1)
 
 
 # Start
@@ -0,0 +1,93 @@
+import hashlib
+import io
+import os
+import re
+
+try:  # optional; ohne Pillow können keine Avatare verarbeitet werden
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# Dateiname: <sha256-prefix>_<größe>.<ext>, Inhalt ändert sich nie
+HASHED_NAME = re.compile(r"^(?P<digest>[0-9a-f]{32})_(?P<size>\d+)\.(?P<ext>webp|jpg)$")
+
+MAX_PIXELS = 40_000_000   # Schutz vor Dekompressions-Bomben
+
+
+class UngueltigesBild(ValueError):
+    pass
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def variant_name(digest, size, fmt):
+    return f"{digest}_{size}.{'webp' if fmt == 'WEBP' else 'jpg'}"
+
+
+def render_variants(data, sizes, fmt="WEBP", quality=82):
+    """Bild dekodieren, quadratisch zuschneiden, verkleinern, neu kodieren.
+
+    Liefert {größe: bytes}. Metadaten (EXIF, GPS, ICC ...) werden nicht
+    übernommen; die EXIF-Drehung wird vorher angewendet.
+    """
+    if Image is None:
+        raise RuntimeError("Pillow ist nicht installiert.")
+    try:
+        img = Image.open(io.BytesIO(data))
+        if img.width * img.height > MAX_PIXELS:
+            raise UngueltigesBild("Bild ist zu groß.")
+        img.load()
+    except UngueltigesBild:
+        raise
+    except Exception as e:
+        raise UngueltigesBild(f"Bild kann nicht gelesen werden: {e}") from e
+
+    img = ImageOps.exif_transpose(img)
+    has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+    img = img.convert("RGBA" if has_alpha and fmt == "WEBP" else "RGB")
+
+    out = {}
+    for size in sizes:
+        thumb = ImageOps.fit(img, (size, size), method=Image.Resampling.LANCZOS)
+        buf = io.BytesIO()
+        if fmt == "WEBP":
+            thumb.save(buf, "WEBP", quality=quality, method=4)
+        else:
+            thumb.save(buf, "JPEG", quality=quality, optimize=True, progressive=True)
+        out[size] = buf.getvalue()
+    return out
+
+
+def store_avatar(folder, data, sizes, fmt="WEBP", quality=82):
+    """Varianten unter dem Inhalts-Hash speichern; gleiche Uploads werden nur einmal verarbeitet.
+
+    Gibt den Dateinamen der größten Variante zurück (der kommt in User.avatar).
+    """
+    digest = content_hash(data)
+    names = {size: variant_name(digest, size, fmt) for size in sizes}
+    if not all(os.path.exists(os.path.join(folder, n)) for n in names.values()):
+        for size, blob in render_variants(data, sizes, fmt, quality).items():
+            path = os.path.join(folder, names[size])
+            tmp = f"{path}.tmp{os.getpid()}"
+            with open(tmp, "wb") as f:
+                f.write(blob)
+            os.replace(tmp, path)   # atomar, halbe Dateien werden nie ausgeliefert
+    return names[max(sizes)]
+
+
+def variant_for(name, size):
+    """Dateiname der Variante in size; alte Avatare (ohne Hash) bleiben wie sie sind"""
+    m = HASHED_NAME.match(name)
+    if not m:
+        return name
+    return f"{m['digest']}_{size}.{m['ext']}"
+
+
+def variant_files(name, sizes):
+    """Alle Dateien, die zu einem Avatar gehören"""
+    m = HASHED_NAME.match(name)
+    if not m:
+        return [name]
+    return [f"{m['digest']}_{size}.{m['ext']}" for size in sizes]
@@ -0,0 +1,99 @@
+"""Benchmark: gleichzeitige Schreibzugriffe auf SQLite, Standard vs. getuntes Profil.
+
+Jeder Worker ist ein eigener Prozess (wie gunicorn-Worker) und schreibt pro
+Transaktion eine Nachricht mit commit, so wie create_message es tut.
+
+Aufruf (aus dem Projektordner):
+    python benchmarks/bench_db_schreiben.py --workers 1 4 8 --writes 300
+"""
+import argparse
+import multiprocessing as mp
+import os
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from db_profil import engine_options, install_sqlite_pragmas
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS chat_message ("
+    " id INTEGER PRIMARY KEY, chat_id INTEGER NOT NULL, user_id INTEGER NOT NULL,"
+    " content TEXT NOT NULL, created_at DATETIME NOT NULL)"
+)
+
+
+def make_engine(path, profil):
+    uri = f"sqlite:///{path}"
+    if profil == "standard":
+        # wie vorher: keine Optionen, Standard-Journal, 5 s Default-Timeout von sqlite3
+        return create_engine(uri)
+    engine = create_engine(uri, **engine_options(uri))
+    install_sqlite_pragmas(engine)
+    return engine
+
+
+def worker(path, profil, writes, worker_id, results):
+    engine = make_engine(path, profil)
+    ok = locked = 0
+    for i in range(writes):
+        try:
+            with engine.begin() as conn:
+                conn.execute(
+                    text("INSERT INTO chat_message (chat_id, user_id, content, created_at)"
+                         " VALUES (:c, :u, :t, datetime('now'))"),
+                    {"c": worker_id, "u": worker_id, "t": f"Nachricht {i} " + "x" * 200},
+                )
+                # wie im echten Turn: danach den Verlauf lesen
+                conn.execute(text("SELECT COUNT(*) FROM chat_message WHERE chat_id = :c"), {"c": worker_id})
+            ok += 1
+        except OperationalError as e:
+            if "locked" in str(e):
+                locked += 1
+            else:
+                raise
+    results.put((ok, locked))
+
+
+def run(profil, workers, writes):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        engine = make_engine(path, profil)
+        with engine.begin() as conn:
+            conn.execute(text(SCHEMA))
+        engine.dispose()
+
+        results = mp.Queue()
+        procs = [mp.Process(target=worker, args=(path, profil, writes, w, results)) for w in range(workers)]
+        start = perf_counter()
+        for p in procs:
+            p.start()
+        totals = [results.get() for _ in procs]
+        for p in procs:
+            p.join()
+        seconds = perf_counter() - start
+
+    ok = sum(t[0] for t in totals)
+    locked = sum(t[1] for t in totals)
+    print(f"{profil:>9} | {workers:>2} Worker | {ok / seconds:8.0f} Writes/s | "
+          f"{locked:>5} 'database is locked' | {seconds:6.2f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--writes", type=int, default=300, help="Transaktionen pro Worker")
+    args = parser.parse_args()
+
+    for workers in args.workers:
+        for profil in ("standard", "getunt"):
+            run(profil, workers, args.writes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Micro-Benchmark: 10k Nachrichten laden und als JSON serialisieren.
+
+Vergleicht den alten Weg (ChatMessage-Objekte, dict + isoformat() pro Zeile,
+json aus der Standardbibliothek) mit Spalten-Projektion + SchnellJSONProvider.
+
+Aufruf (aus dem Projektordner):
+    python benchmarks/bench_json.py --messages 10000 --runs 20
+"""
+import argparse
+import json
+import statistics
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from flask import Flask
+from sqlalchemy import Column, DateTime, Integer, Text, create_engine
+from sqlalchemy.orm import Session, declarative_base
+
+import json_provider
+from json_provider import SchnellJSONProvider
+
+Base = declarative_base()
+
+
+class ChatMessage(Base):
+    __tablename__ = "chat_message"
+    id = Column(Integer, primary_key=True)
+    chat_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, nullable=False)
+    content = Column(Text, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+
+
+def setup(n):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    start = datetime(2026, 1, 1)
+    with Session(engine) as s:
+        s.execute(ChatMessage.__table__.insert(), [
+            {"chat_id": 1, "user_id": i % 2, "content": f"Nachricht {i}: " + "lorem ipsum " * 20,
+             "created_at": start + timedelta(seconds=i)}
+            for i in range(n)
+        ])
+        s.commit()
+    return engine
+
+
+def alt(engine):
+    with Session(engine) as s:
+        rows = s.query(ChatMessage).filter_by(chat_id=1).order_by(ChatMessage.created_at, ChatMessage.id).all()
+        data = {"messages": [
+            {"id": m.id, "content": m.content, "created_at": m.created_at.isoformat(), "user_id": m.user_id}
+            for m in rows
+        ]}
+        return json.dumps(data).encode("utf-8")
+
+
+def neu(engine, provider):
+    columns = (ChatMessage.id, ChatMessage.content, ChatMessage.created_at, ChatMessage.user_id)
+    with Session(engine) as s:
+        rows = s.query(*columns).filter(ChatMessage.chat_id == 1).order_by(ChatMessage.created_at, ChatMessage.id).all()
+        return provider.dumps_bytes({"messages": [r._asdict() for r in rows]})
+
+
+def measure(fn, runs):
+    times = []
+    for _ in range(runs):
+        t = perf_counter()
+        body = fn()
+        times.append(perf_counter() - t)
+    return statistics.median(times) * 1000, len(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    engine = setup(args.messages)
+    app = Flask(__name__)
+    provider = SchnellJSONProvider(app)
+
+    assert json.loads(alt(engine)) == provider.loads(neu(engine, provider)), "Ausgabe unterscheidet sich"
+
+    ms, size = measure(lambda: alt(engine), args.runs)
+    print(f"ORM + dict + json         : {ms:7.1f} ms  ({size / 1024:.0f} KB)")
+
+    orjson = json_provider.orjson
+    json_provider.orjson = None
+    ms, size = measure(lambda: neu(engine, provider), args.runs)
+    print(f"Projektion + stdlib json  : {ms:7.1f} ms  ({size / 1024:.0f} KB)")
+    json_provider.orjson = orjson
+
+    if orjson is not None:
+        ms, size = measure(lambda: neu(engine, provider), args.runs)
+        print(f"Projektion + orjson       : {ms:7.1f} ms  ({size / 1024:.0f} KB)")
+    else:
+        print("orjson nicht installiert")
+
+
+if __name__ == "__main__":
+    main()
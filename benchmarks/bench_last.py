@@ -0,0 +1,278 @@
+"""Lasttest: app1 unter gunicorn gegen einen lokalen Fake-ollama-Server.
+
+Der Fake-Server (fake_ollama.py) spricht die ollama-API (/api/chat mit und ohne Stream,
+/api/generate fürs Vorladen) und antwortet mit einstellbarer Token-Rate,
+Verzögerung bis zum ersten Token und optionalem <think>-Block. Jeder
+virtuelle User läuft den Ablauf
+
+    register -> anmelden -> Chat anlegen -> N Nachrichten -> Liste -> umbenennen -> löschen
+
+durch; gemessen werden p50/p95/p99, Durchsatz, Fehler und "database is locked"
+pro Route. Mit --json lassen sich Läufe vergleichen; der Exit-Code ist 1, wenn
+es Lock-Fehler gab oder die Fehlerquote über --max-fehlerquote liegt.
+
+Aufruf (aus dem Projektordner):
+    python benchmarks/bench_last.py --users 200 --concurrency 32 --messages 5
+    python benchmarks/bench_last.py --stream --token-rate 40 --first-token-ms 300 --think-tokens 50
+    python benchmarks/bench_last.py --nur-ollama --ollama-port 11500   # nur den Fake-Server starten
+"""
+import argparse
+import json
+import math
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from time import perf_counter, sleep
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from fake_ollama import free_port, start_fake_ollama  # Fake-Server (auch für tests/)
+
+LOCK_TEXT = "database is locked"
+
+
+# =========================
+# app1 unter gunicorn
+
+def start_gunicorn(port, ollama_url, db_path, threads, log_path):
+    env = dict(os.environ, OLLAMA_HOST=ollama_url, DATABASE_URL=f"sqlite:///{db_path}", WEB_THREADS=str(threads))
+    log = open(log_path, "wb")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "app1:app", "--worker-class", "gthread", "--threads", str(threads),
+         "--workers", "1", "--bind", f"127.0.0.1:{port}", "--timeout", "120"],
+        cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    return proc, log
+
+
+def wait_ready(url, proc, timeout=60):
+    deadline = perf_counter() + timeout
+    while perf_counter() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f"gunicorn ist beendet (Exit-Code {proc.returncode})")
+        try:
+            if httpx.get(f"{url}/", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        sleep(0.2)
+    raise RuntimeError(f"{url} antwortet nicht nach {timeout}s")
+
+
+# =========================
+# Messung
+
+class Messung:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.locks = defaultdict(int)
+        self.status = defaultdict(lambda: defaultdict(int))
+        self.ttft = []
+
+    def add(self, route, seconds, status, ok, body=""):
+        with self.lock:
+            self.latencies[route].append(seconds)
+            self.status[route][status] += 1
+            if not ok:
+                self.errors[route] += 1
+                if LOCK_TEXT in body:
+                    self.locks[route] += 1
+
+
+def perzentil(values, p):
+    """Nearest-Rank-Perzentil"""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def call(messung, route, client, method, url, expect, **kwargs):
+    t = perf_counter()
+    try:
+        resp = client.request(method, url, **kwargs)
+    except httpx.HTTPError as e:
+        messung.add(route, perf_counter() - t, type(e).__name__, False, str(e))
+        return None
+    ok = resp.status_code in expect
+    messung.add(route, perf_counter() - t, resp.status_code, ok, "" if ok else resp.text)
+    return resp if ok else None
+
+
+def call_stream(messung, route, client, url, payload):
+    """SSE-Nachricht: Gesamtzeit pro Route, Zeit bis zum ersten Delta extra"""
+    t = perf_counter()
+    first = None
+    body = []
+    status = None
+    try:
+        with client.stream("POST", url, json=payload) as resp:
+            status = resp.status_code
+            for line in resp.iter_lines():
+                body.append(line)
+                if first is None and line.startswith("data: ") and '"delta"' in line:
+                    first = perf_counter() - t
+        text = "\n".join(body)
+        ok = status == 200 and "event: done" in text
+    except httpx.HTTPError as e:
+        text, ok, status = str(e), False, type(e).__name__
+    messung.add(route, perf_counter() - t, status, ok, "" if ok else text)
+    if first is not None:
+        with messung.lock:
+            messung.ttft.append(first)
+
+
+def user_flow(messung, base_url, run_id, index, messages, stream):
+    name = f"last{run_id}_{index}"
+    with httpx.Client(base_url=base_url, timeout=180, follow_redirects=False) as client:
+        form = {"username": name, "password": "geheim123"}
+        if not call(messung, "POST /register", client, "POST", "/register", {302}, data=form):
+            return False
+        if not call(messung, "POST /anmelden", client, "POST", "/anmelden", {302}, data=form):
+            return False
+        resp = call(messung, "POST /api/chats", client, "POST", "/api/chats", {200, 201})
+        if not resp:
+            return False
+        chat_id = resp.json()["id"]
+
+        for i in range(messages):
+            payload = {"content": f"Frage {i} von {name}: Wie wird das Wetter morgen in Paris?"}
+            if stream:
+                call_stream(messung, "POST /messages/stream", client, f"/api/chats/{chat_id}/messages/stream", payload)
+            else:
+                call(messung, "POST /messages", client, "POST", f"/api/chats/{chat_id}/messages", {201}, json=payload)
+
+        call(messung, "GET /messages", client, "GET", f"/api/chats/{chat_id}/messages", {200})
+        call(messung, "GET /api/chats", client, "GET", "/api/chats", {200})
+        call(messung, "PUT /api/chats", client, "PUT", f"/api/chats/{chat_id}", {200}, json={"title": f"Chat {name}"})
+        call(messung, "DELETE /api/chats", client, "DELETE", f"/api/chats/{chat_id}", {200})
+    return True
+
+
+def report(messung, seconds, flows_ok, flows, server_locks):
+    rows = []
+    print(f"\n{'Route':<24} {'n':>6} {'Fehler':>7} {'Lock':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8}")
+    for route, values in messung.latencies.items():
+        ms = [v * 1000 for v in values]
+        row = {
+            "route": route, "n": len(values), "fehler": messung.errors[route], "lock": messung.locks[route],
+            "p50_ms": perzentil(ms, 50), "p95_ms": perzentil(ms, 95), "p99_ms": perzentil(ms, 99),
+            "req_s": len(values) / seconds, "status": dict(messung.status[route]),
+        }
+        rows.append(row)
+        print(f"{route:<24} {row['n']:>6} {row['fehler']:>7} {row['lock']:>5} {row['p50_ms']:>9.1f} "
+              f"{row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f} {row['req_s']:>8.1f}")
+    if messung.ttft:
+        ms = [v * 1000 for v in messung.ttft]
+        print(f"{'erstes Token (Stream)':<24} {len(ms):>6} {'':>7} {'':>5} {perzentil(ms, 50):>9.1f} "
+              f"{perzentil(ms, 95):>9.1f} {perzentil(ms, 99):>9.1f}")
+    total = sum(len(v) for v in messung.latencies.values())
+    print(f"\n{flows_ok}/{flows} Abläufe in {seconds:.1f}s | {total / seconds:.1f} req/s | "
+          f"{flows_ok / seconds:.2f} Abläufe/s | '{LOCK_TEXT}' im Server-Log: {server_locks}")
+    return {
+        "sekunden": seconds, "ablaeufe": flows, "ablaeufe_ok": flows_ok, "routen": rows,
+        "ttft_ms": {p: perzentil([v * 1000 for v in messung.ttft], p) for p in (50, 95, 99)} if messung.ttft else None,
+        "server_locks": server_locks,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50, help="Abläufe (virtuelle User) insgesamt")
+    parser.add_argument("--concurrency", type=int, default=16, help="gleichzeitige User")
+    parser.add_argument("--messages", type=int, default=3, help="Nachrichten pro Chat")
+    parser.add_argument("--stream", action="store_true", help="Nachrichten über /messages/stream (SSE) senden")
+    parser.add_argument("--threads", type=int, default=16, help="gunicorn-Threads (wie im Procfile)")
+    parser.add_argument("--url", help="laufende App statt gunicorn zu starten (Fake-ollama muss sie selbst kennen)")
+    parser.add_argument("--tokens", type=int, default=60, help="Tokens pro Antwort")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="Tokens pro Sekunde, 0 = sofort")
+    parser.add_argument("--first-token-ms", type=float, default=200.0, help="Verzögerung bis zum ersten Token")
+    parser.add_argument("--think-tokens", type=int, default=0, help="Länge des <think>-Blocks (nur --think-models)")
+    parser.add_argument("--think-models", nargs="*", default=["deepseek-r1:8b"])
+    parser.add_argument("--ollama-port", type=int, default=0)
+    parser.add_argument("--nur-ollama", action="store_true", help="nur den Fake-ollama-Server laufen lassen")
+    parser.add_argument("--json", help="Ergebnis als JSON speichern")
+    parser.add_argument("--max-fehlerquote", type=float, default=0.0, help="darüber Exit-Code 1")
+    args = parser.parse_args()
+
+    ollama = start_fake_ollama(
+        args.ollama_port or free_port(), tokens=args.tokens, token_rate=args.token_rate,
+        first_token_ms=args.first_token_ms, think_tokens=args.think_tokens, think_models=args.think_models,
+    )
+    ollama_url = f"http://127.0.0.1:{ollama.server_address[1]}"
+    print(f"Fake-ollama: {ollama_url} ({args.tokens} Tokens, {args.token_rate} tok/s, "
+          f"erstes Token nach {args.first_token_ms:.0f} ms, think {args.think_tokens})")
+    if args.nur_ollama:
+        try:
+            signal.pause()
+        except KeyboardInterrupt:
+            return
+
+    tmp = tempfile.mkdtemp(prefix="bench_last_")
+    log_path = os.path.join(tmp, "gunicorn.log")
+    proc = log = None
+    try:
+        if args.url:
+            base_url = args.url.rstrip("/")
+            wait_ready(base_url, None)
+        else:
+            port = free_port()
+            base_url = f"http://127.0.0.1:{port}"
+            proc, log = start_gunicorn(port, ollama_url, os.path.join(tmp, "bench.db"), args.threads, log_path)
+            wait_ready(base_url, proc)
+        print(f"App: {base_url} | {args.users} User, {args.concurrency} gleichzeitig, "
+              f"{args.messages} Nachrichten{' (Stream)' if args.stream else ''}")
+
+        messung = Messung()
+        run_id = uuid.uuid4().hex[:6]
+        start = perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as ex:
+            results = list(ex.map(
+                lambda i: user_flow(messung, base_url, run_id, i, args.messages, args.stream),
+                range(args.users),
+            ))
+        seconds = perf_counter() - start
+    finally:
+        if proc is not None:
+            proc.send_signal(signal.SIGTERM)
+            try:
+                proc.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+            log.close()
+        ollama.shutdown()
+
+    server_locks = 0
+    if os.path.exists(log_path):
+        with open(log_path, encoding="utf-8", errors="replace") as f:
+            server_locks = f.read().count(LOCK_TEXT)
+    result = report(messung, seconds, sum(results), args.users, server_locks)
+    result["ollama_anfragen"] = ollama.requests
+    result["einstellungen"] = vars(args)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+    shutil.rmtree(tmp, ignore_errors=True)
+
+    total = sum(len(v) for v in messung.latencies.values())
+    errors = sum(messung.errors.values())
+    if server_locks or sum(messung.locks.values()) or (total and errors / total > args.max_fehlerquote):
+        print("❌ Fehler oder Lock-Fehler über der Grenze")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
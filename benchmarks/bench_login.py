@@ -0,0 +1,72 @@
+"""Benchmark: Logins/s beim Passwort-Prüfen, im Request-Thread vs. im Prozess-Pool.
+
+Nebenbei läuft ein "Chat-Thread", der ständig kurze Python-Arbeit erledigt; seine
+Latenz zeigt, wie stark das Hashen die anderen Threads des Workers ausbremst.
+
+Aufruf (aus dem Projektordner):
+    python benchmarks/bench_login.py --threads 16 --logins 64 --workers 0 1 2 4
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from time import perf_counter, sleep
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from passwort import PasswortDienst
+
+
+def chat_thread(stop, latencies):
+    """Simuliert eine leichte Chat-Anfrage alle 5 ms"""
+    while not stop.is_set():
+        t = perf_counter()
+        sum(i * i for i in range(2000))
+        latencies.append(perf_counter() - t)
+        sleep(0.005)
+
+
+def run(workers, method, threads, logins):
+    dienst = PasswortDienst(method=method, workers=workers, max_pending=threads * 2, timeout=60)
+    dienst.start()
+    pw_hash = dienst.hash("geheim123")
+
+    stop = threading.Event()
+    latencies = []
+    side = threading.Thread(target=chat_thread, args=(stop, latencies), daemon=True)
+    side.start()
+
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as ex:
+        results = list(ex.map(lambda _: dienst.check(pw_hash, "geheim123"), range(logins)))
+    seconds = perf_counter() - start
+    stop.set()
+    side.join()
+    dienst.shutdown()
+
+    assert all(results)
+    per_core = logins / seconds / min(max(1, workers), os.cpu_count() or 1)
+    p95 = statistics.quantiles(latencies, n=20)[-1] * 1000 if len(latencies) > 20 else float("nan")
+    label = "im Thread" if workers == 0 else f"{workers} Prozess(e)"
+    print(f"{label:>14} | {logins / seconds:7.1f} Logins/s | {per_core:7.1f} pro Kern | "
+          f"Chat-Thread p95 {p95:6.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--method", default="scrypt:32768:8:1")
+    parser.add_argument("--threads", type=int, default=16, help="gleichzeitige Login-Requests")
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, os.cpu_count() or 1])
+    args = parser.parse_args()
+
+    print(f"Methode {args.method}, {args.threads} Threads, {args.logins} Logins")
+    for workers in args.workers:
+        run(workers, args.method, args.threads, args.logins)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Benchmark für den semantischen Cache: Trefferquote und Lookup-Latenz.
+
+Aufruf (aus dem Projektordner):
+    python benchmarks/bench_semantik_cache.py --sizes 10000 100000
+"""
+import argparse
+import random
+import sys
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+
+from semantik_cache import HashingEmbedder, SemantikCache, VectorIndex
+
+THEMEN = ["python", "mathe", "wetter", "fußball", "kochen", "musik", "filme", "reisen",
+          "schule", "arbeit", "katzen", "hunde", "autos", "bahn", "handy", "laptop"]
+# Gleiche Position = gleiche Frage, nur anders formuliert
+FRAGEN = ["was ist {}", "erklär mir {}", "was weißt du über {}", "erzähl mir was über {}",
+          "wie funktioniert {}"]
+UMFORMULIERT = ["was ist eigentlich {}", "erkläre mir bitte {}", "was weißt du denn über {}",
+                "erzähl mir etwas über {}", "wie funktioniert eigentlich {}"]
+
+
+def thema(rng, i):
+    return f"{rng.choice(THEMEN)} {i}"
+
+
+def percentile(values, p):
+    return float(np.percentile(np.asarray(values) * 1000, p))
+
+
+def run(size, queries, threshold, dim, seed=1):
+    rng = random.Random(seed)
+    embedder = HashingEmbedder(dim=dim)
+    cache = SemantikCache(embedder, VectorIndex(dim, capacity=size), threshold=threshold)
+
+    stored = []
+    start = perf_counter()
+    for i in range(size):
+        frage, t = rng.randrange(len(FRAGEN)), thema(rng, i)
+        text = FRAGEN[frage].format(t)
+        cache.store("llama3.1:8b", "", embedder(text), {"reply": f"Antwort {i}", "think": ""})
+        stored.append((frage, t))
+    fill_seconds = perf_counter() - start
+
+    latencies = []
+    richtig = falsch = 0
+    for _ in range(queries):
+        # Hälfte Umformulierungen bekannter Fragen, Hälfte neue Fragen
+        expected = None
+        if rng.random() < 0.5:
+            expected = rng.randrange(size)
+            frage, t = stored[expected]
+            text = UMFORMULIERT[frage].format(t)
+        else:
+            text = rng.choice(FRAGEN).format(thema(rng, size + rng.randrange(10 * size)))
+        vec = embedder(text)
+        t0 = perf_counter()
+        hit = cache.lookup("llama3.1:8b", "", vec)
+        latencies.append(perf_counter() - t0)
+        if hit is not None:
+            if hit["reply"] == f"Antwort {expected}":
+                richtig += 1
+            else:
+                falsch += 1
+
+    stats = cache.stats()
+    print(f"{size:>8} Einträge | befüllen {fill_seconds:6.1f}s | "
+          f"Trefferquote {stats['hit_rate']:.3f} (richtig {richtig}, falsch {falsch}) | "
+          f"Lookup p50 {percentile(latencies, 50):7.3f} ms  p95 {percentile(latencies, 95):7.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--threshold", type=float, default=0.92)
+    parser.add_argument("--dim", type=int, default=256)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        run(size, args.queries, args.threshold, args.dim)
+
+
+if __name__ == "__main__":
+    main()
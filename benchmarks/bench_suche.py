@@ -0,0 +1,121 @@
+"""Benchmark: Volltextsuche (FTS5 + bm25) vs. LIKE '%...%' auf einem synthetischen Korpus.
+
+Legt eine Wegwerf-SQLite-Datei mit N Nachrichten an (Trigger halten den Index
+schon beim Einfügen aktuell) und misst Such-Latenzen pro User.
+
+Aufruf (aus dem Projektordner):
+    python benchmarks/bench_suche.py --messages 1000000 --users 1000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import create_engine, text
+
+from db_profil import install_sqlite_pragmas
+from suche import install_fts, search_messages
+
+WOERTER = ("python schleife funktion liste fehler datenbank hauptstadt frankreich paris rezept nudeln "
+           "tomaten fußball bundesliga wetter regen sonne mathe bruch gleichung katze hund urlaub "
+           "zug bahn verspätung handy akku laptop musik gitarre film serie buch schule prüfung").split()
+SUCHEN = ["paris", "datenbank fehler", "nudeln tomaten", "gitarre", "prüf", "bahn verspätung"]
+
+SCHEMA = [
+    "CREATE TABLE chat (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, title VARCHAR(150) NOT NULL,"
+    " created_at DATETIME)",
+    "CREATE TABLE chat_message (id INTEGER PRIMARY KEY, chat_id INTEGER NOT NULL, user_id INTEGER NOT NULL,"
+    " content TEXT NOT NULL, created_at DATETIME NOT NULL)",
+    "CREATE INDEX ix_chat_message_chat_created ON chat_message (chat_id, created_at, id)",
+]
+
+
+def satz(rng):
+    return " ".join(rng.choice(WOERTER) for _ in range(rng.randint(6, 30)))
+
+
+def fill(engine, messages, users, chats_per_user, batch=10000, seed=1):
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO chat (id, user_id, title, created_at) VALUES (:id, :u, :t, :c)"), [
+            {"id": u * chats_per_user + k + 1, "u": u + 1, "t": f"Chat {k} {rng.choice(WOERTER)}", "c": start}
+            for u in range(users) for k in range(chats_per_user)
+        ])
+    n_chats = users * chats_per_user
+    t = perf_counter()
+    for offset in range(0, messages, batch):
+        rows = []
+        for i in range(offset, min(offset + batch, messages)):
+            chat_id = rng.randint(1, n_chats)
+            rows.append({"chat": chat_id, "u": 0 if i % 2 else (chat_id - 1) // chats_per_user + 1,
+                         "text": satz(rng), "c": start + timedelta(seconds=i)})
+        with engine.begin() as conn:
+            conn.execute(text("INSERT INTO chat_message (chat_id, user_id, content, created_at)"
+                              " VALUES (:chat, :u, :text, :c)"), rows)
+    return messages / (perf_counter() - t)
+
+
+def like_search(conn, user_id, query, limit=20):
+    clauses = " AND ".join(f"m.content LIKE :w{i}" for i in range(len(query.split())))
+    params = {f"w{i}": f"%{w}%" for i, w in enumerate(query.split())}
+    return conn.execute(text(
+        "SELECT m.id FROM chat_message m JOIN chat c ON c.id = m.chat_id"
+        f" WHERE c.user_id = :u AND {clauses} ORDER BY m.created_at DESC LIMIT :limit"
+    ), dict(params, u=user_id, limit=limit)).all()
+
+
+def measure(fn, runs):
+    times = []
+    for _ in range(runs):
+        t = perf_counter()
+        fn()
+        times.append((perf_counter() - t) * 1000)
+    times.sort()
+    return statistics.median(times), times[int(len(times) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--chats", type=int, default=20, help="Chats pro User")
+    parser.add_argument("--runs", type=int, default=40)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "suche.db")
+        engine = create_engine(f"sqlite:///{path}")
+        install_sqlite_pragmas(engine)
+        with engine.begin() as conn:
+            for stmt in SCHEMA:
+                conn.execute(text(stmt))
+            install_fts(conn)
+
+        rate = fill(engine, args.messages, args.users, args.chats)
+        print(f"{args.messages} Nachrichten eingefügt: {rate:,.0f}/s (inkl. Index-Trigger), "
+              f"DB {os.path.getsize(path) / 2**20:.0f} MB")
+
+        rng = random.Random(7)
+        with engine.connect() as conn:
+            for query in SUCHEN:
+                users = [rng.randint(1, args.users) for _ in range(args.runs)]
+                it = iter(users * 2)
+                fts = measure(lambda: search_messages(conn, next(it), query), args.runs)
+                it = iter(users * 2)
+                like = measure(lambda: like_search(conn, next(it), query), args.runs)
+                hits = len(search_messages(conn, users[0], query, limit=50)[0])
+                print(f"{query:>18} | FTS5 p50 {fts[0]:7.2f} ms p95 {fts[1]:7.2f} ms | "
+                      f"LIKE p50 {like[0]:7.2f} ms p95 {like[1]:7.2f} ms | {hits} Treffer (max 50)")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
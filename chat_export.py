@@ -0,0 +1,206 @@
+import gzip
+import io
+import json
+import re
+import unicodedata
+import zlib
+from datetime import datetime
+from urllib.parse import quote
+
+from sqlalchemy import select
+
+# NDJSON: eine JSON-Zeile pro Datensatz, in dieser Reihenfolge:
+#   {"typ": "export", "version": 1, ...}
+#   {"typ": "chat", "id": 3, "title": "...", "created_at": "..."}
+#   {"typ": "nachricht", "chat_id": 3, "role": "user"|"assistant", "content": "...", "created_at": "..."}
+# Nachrichten kommen nach ihrem Chat, sortiert nach Chat und Zeit; die Nachrichten
+# archivierter Chats folgen am Ende (direkt aus dem Archiv, ohne es auszupacken).
+FORMAT_VERSION = 1
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def _line(obj):
+    return (json.dumps(obj, ensure_ascii=False, default=_default) + "\n").encode("utf-8")
+
+
+def _default(o):
+    if isinstance(o, datetime):
+        return o.isoformat()
+    raise TypeError(f"{type(o).__name__} ist nicht JSON-serialisierbar")
+
+
+def content_disposition(filename):
+    """attachment-Header: ASCII-Ersatzname plus filename* in UTF-8 (RFC 6266 / RFC 5987)"""
+    fallback = unicodedata.normalize("NFKD", filename).encode("ascii", "ignore").decode("ascii")
+    fallback = re.sub(r"[^A-Za-z0-9._-]+", "_", fallback).strip("._") or "export"
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+
+def export_query(Chat, ChatMessage, user_id):
+    """Alle Nachrichten eines Users, nach Chat und Zeit sortiert (auch für den Plan-Check)"""
+    return (
+        select(ChatMessage.chat_id, ChatMessage.user_id, ChatMessage.content, ChatMessage.created_at)
+        .join(Chat, Chat.id == ChatMessage.chat_id)
+        .where(Chat.user_id == user_id)
+        .order_by(ChatMessage.chat_id, ChatMessage.created_at, ChatMessage.id)
+    )
+
+
+def export_lines(session, Chat, ChatMessage, user_id, username, batch=1000, archived=()):
+    """Generator mit NDJSON-Zeilen (bytes); liest die DB in Batches (yield_per)
+
+    archived: (chat_id, rows) der archivierten Chats, rows mit user_id, content, created_at
+    """
+    yield _line({"typ": "export", "version": FORMAT_VERSION, "user": username,
+                 "exportiert": datetime.utcnow()})
+
+    chats = session.execute(
+        select(Chat.id, Chat.title, Chat.created_at)
+        .where(Chat.user_id == user_id)
+        .order_by(Chat.id)
+    ).all()   # höchstens ein paar Dutzend Zeilen
+    for c in chats:
+        yield _line({"typ": "chat", "id": c.id, "title": c.title, "created_at": c.created_at})
+
+    rows = session.execute(export_query(Chat, ChatMessage, user_id).execution_options(yield_per=batch))
+    for m in rows:
+        yield _message_line(m.chat_id, m)
+
+    for chat_id, archived_rows in archived:
+        for m in archived_rows:
+            yield _message_line(chat_id, m)
+
+
+def _message_line(chat_id, m):
+    return _line({
+        "typ": "nachricht",
+        "chat_id": chat_id,
+        "role": "assistant" if m.user_id == 0 else "user",
+        "content": m.content,
+        "created_at": m.created_at,
+    })
+
+
+def gzip_chunks(chunks, level=6):
+    """Bytes-Stücke gzip-komprimiert weiterreichen (ohne alles zu puffern)"""
+    comp = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        out = comp.compress(chunk)
+        if out:
+            yield out
+    yield comp.flush()
+
+
+class ImportFehler(ValueError):
+    pass
+
+
+class _Begrenzt(io.RawIOBase):
+    """Liest höchstens max_bytes aus raw, sonst ImportFehler (auch für entpacktes gzip)"""
+
+    def __init__(self, raw, max_bytes):
+        self.raw = raw
+        self.max_bytes = max_bytes
+        self.total = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = self.raw.readinto(buffer)
+        self.total += n or 0
+        if self.total > self.max_bytes:
+            raise ImportFehler(f"Import ist entpackt größer als {self.max_bytes} Bytes.")
+        return n
+
+
+def open_ndjson(stream, max_bytes=None):
+    """Binär-Stream -> Iterator über Zeilen; gzip wird am Magic-Header erkannt.
+
+    max_bytes begrenzt die Daten nach dem Entpacken (gzip-Bomben).
+    """
+    buffered = io.BufferedReader(stream) if not hasattr(stream, "peek") else stream
+    if buffered.peek(2)[:2] == GZIP_MAGIC:
+        buffered = gzip.GzipFile(fileobj=buffered)
+    if max_bytes is not None:
+        buffered = io.BufferedReader(_Begrenzt(buffered, max_bytes))
+    return io.TextIOWrapper(buffered, encoding="utf-8")
+
+
+def import_lines(engine, Chat, ChatMessage, user_id, lines, batch=1000, max_chats=None, max_messages=None):
+    """NDJSON-Zeilen in die DB schreiben; Nachrichten per executemany in Batches.
+
+    Jeder Chat und jeder Batch Nachrichten läuft in einer eigenen, kurzen
+    Transaktion, damit andere Schreiber (SQLite: eine Schreibsperre für alle)
+    nicht für die ganze Datei warten. Schlägt der Import fehl, werden die schon
+    angelegten Chats samt Nachrichten wieder gelöscht. Chats bekommen neue ids
+    (die alten aus der Datei werden umgemappt).
+    Gibt {"chats": n, "nachrichten": n} zurück.
+    """
+    chat_ids = {}
+    pending = []
+    counts = {"chats": 0, "nachrichten": 0}
+    insert_message = ChatMessage.__table__.insert()
+
+    def flush():
+        if pending:
+            with engine.begin() as conn:
+                conn.execute(insert_message, pending)
+            counts["nachrichten"] += len(pending)
+            pending.clear()
+
+    try:
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                obj = json.loads(line)
+                typ = obj["typ"]
+                if typ == "export":
+                    if obj.get("version") != FORMAT_VERSION:
+                        raise ImportFehler(f"Unbekannte Export-Version {obj.get('version')}")
+                elif typ == "chat":
+                    if max_chats is not None and counts["chats"] >= max_chats:
+                        raise ImportFehler(f"Maximal {max_chats} Chats möglich.")
+                    with engine.begin() as conn:
+                        result = conn.execute(Chat.__table__.insert().values(
+                            user_id=user_id,
+                            title=str(obj["title"])[:150],
+                            created_at=datetime.fromisoformat(obj["created_at"]),
+                        ))
+                    chat_ids[obj["id"]] = result.inserted_primary_key[0]
+                    counts["chats"] += 1
+                elif typ == "nachricht":
+                    if max_messages is not None and counts["nachrichten"] + len(pending) >= max_messages:
+                        raise ImportFehler(f"Maximal {max_messages} Nachrichten möglich.")
+                    content = obj["content"]
+                    if not isinstance(content, str):
+                        raise ImportFehler("content muss ein Text sein")
+                    pending.append({
+                        "chat_id": chat_ids[obj["chat_id"]],
+                        "user_id": 0 if obj["role"] == "assistant" else user_id,
+                        "content": content,
+                        "created_at": datetime.fromisoformat(obj["created_at"]),
+                    })
+                    if len(pending) >= batch:
+                        flush()
+                else:
+                    raise ImportFehler(f"Unbekannter Typ {typ!r}")
+            except ImportFehler as e:
+                raise ImportFehler(f"Zeile {number}: {e}") from e
+            except (KeyError, TypeError, ValueError) as e:
+                raise ImportFehler(f"Zeile {number}: ungültiger Datensatz ({e})") from e
+        flush()
+    except BaseException:
+        _remove_chats(engine, Chat, ChatMessage, list(chat_ids.values()))
+        raise
+    return counts
+
+
+def _remove_chats(engine, Chat, ChatMessage, ids):
+    """Halb importierte Chats wieder entfernen (Nachrichten zuerst, wegen der FTS-Trigger)"""
+    if not ids:
+        return
+    with engine.begin() as conn:
+        conn.execute(ChatMessage.__table__.delete().where(ChatMessage.__table__.c.chat_id.in_(ids)))
+        conn.execute(Chat.__table__.delete().where(Chat.__table__.c.id.in_(ids)))
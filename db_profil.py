@@ -0,0 +1,59 @@
+import os
+
+from sqlalchemy import event
+
+# Pragmas, die bei jeder neuen SQLite-Verbindung gesetzt werden
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",          # Leser blockieren Schreiber nicht mehr
+    "synchronous": "NORMAL",        # mit WAL sicher genug, deutlich weniger fsyncs
+    "busy_timeout": 5000,           # ms warten statt sofort "database is locked"
+    "cache_size": -8000,            # ~8 MB Page-Cache pro Verbindung (x bis zu 30 Verbindungen im Pool)
+    "mmap_size": 256 * 1024 * 1024, # Datei per Memory-Map lesen
+    "temp_store": "MEMORY",
+    "auto_vacuum": "INCREMENTAL",   # greift nur bei neuen DBs; bestehende stellt die Wartung um
+}
+
+
+def database_uri(default="sqlite:///site.db"):
+    """DATABASE_URL aus der Umgebung (z.B. PostgreSQL), sonst SQLite"""
+    uri = os.environ.get("DATABASE_URL", default)
+    # Heroku & Co. liefern noch das alte Schema "postgres://"
+    if uri.startswith("postgres://"):
+        uri = "postgresql://" + uri[len("postgres://"):]
+    return uri
+
+
+def is_sqlite(uri):
+    return uri.startswith("sqlite")
+
+
+def engine_options(uri, pool_size=10, max_overflow=20, pool_timeout=10, pool_recycle=1800, busy_timeout_ms=5000):
+    """SQLALCHEMY_ENGINE_OPTIONS passend zur Datenbank"""
+    if is_sqlite(uri):
+        return {
+            "pool_size": pool_size,
+            "max_overflow": max_overflow,
+            "pool_timeout": pool_timeout,
+            "connect_args": {"timeout": busy_timeout_ms / 1000, "check_same_thread": False},
+        }
+    return {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": pool_timeout,
+        "pool_recycle": pool_recycle,
+        "pool_pre_ping": True,
+    }
+
+
+def install_sqlite_pragmas(engine, pragmas=None):
+    """Pragmas bei jedem Verbindungsaufbau setzen (nur für SQLite)"""
+    if engine.dialect.name != "sqlite":
+        return
+    pragmas = SQLITE_PRAGMAS if pragmas is None else pragmas
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_conn, _record):
+        cursor = dbapi_conn.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
@@ -0,0 +1,83 @@
+import hashlib
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+
+class Versionen:
+    """Versionszähler pro Bereich, z.B. ("chat", 7) oder ("chats", user_id).
+
+    Jede Änderung ruft bump() auf (nach dem Commit). ETags bestehen aus den
+    Zählern, also ändert sich das ETag genau dann, wenn sich etwas geändert hat.
+    Die Epoche ist pro Prozessstart neu, damit nach einem Neustart keine alten
+    ETags mehr passen.
+    """
+
+    def __init__(self):
+        self.epoch = uuid.uuid4().hex[:8]
+        self._started = datetime.now(timezone.utc).replace(microsecond=0)
+        self._items = {}          # scope -> (version, last_modified)
+        self._lock = threading.Lock()
+
+    def get(self, scope):
+        with self._lock:
+            return self._items.get(scope, (0, self._started))
+
+    def bump(self, *scopes):
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        with self._lock:
+            for scope in scopes:
+                version, _ = self._items.get(scope, (0, self._started))
+                self._items[scope] = (version + 1, now)
+
+
+def make_etag(*parts):
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()[:20]
+
+
+class ResponseCache:
+    """Fertig serialisierte Antworten, Schlüssel ist das ETag (LRU, Byte-Grenze)"""
+
+    def __init__(self, max_entries=2000, max_bytes=16 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def get(self, etag):
+        with self._lock:
+            body = self._items.get(etag)
+            if body is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(etag)
+            self.hits += 1
+            return body
+
+    def put(self, etag, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(etag, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._items[etag] = body
+            self._bytes += len(body)
+            while len(self._items) > self.max_entries or self._bytes > self.max_bytes:
+                _, dropped = self._items.popitem(last=False)
+                self._bytes -= len(dropped)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._items),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified,
+            }
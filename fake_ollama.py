@@ -0,0 +1,127 @@
+"""Fake-ollama für Tests und Lasttests: spricht die ollama-API ohne echtes Modell.
+
+/api/chat mit und ohne Stream, /api/generate fürs Vorladen, /api/version und
+/api/tags. Antworten kommen mit einstellbarer Token-Rate, Verzögerung bis zum
+ersten Token und optionalem <think>-Block; die Einstellungen lassen sich auch
+während des Laufs am Server-Objekt ändern.
+"""
+import json
+import socket
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter, sleep
+
+
+class FakeOllama(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, tokens=60, token_rate=50.0, first_token_ms=200, think_tokens=0,
+                 think_models=("deepseek-r1:8b",)):
+        super().__init__(address, FakeOllamaHandler)
+        self.tokens = tokens
+        self.token_rate = token_rate
+        self.first_token_ms = first_token_ms
+        self.think_tokens = think_tokens
+        self.think_models = set(think_models)
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def pieces(self, model):
+        """Antwort als Token-Liste, bei Think-Modellen mit <think>-Block davor"""
+        out = []
+        if self.think_tokens and model in self.think_models:
+            out.append("<think>")
+            out.extend(f"überlege{i} " for i in range(self.think_tokens))
+            out.append("</think>\n\n")
+        out.extend(f"wort{i} " for i in range(self.tokens))
+        return out
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, obj, status=200):
+        data = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _chunk(self, obj):
+        data = json.dumps(obj).encode() + b"\n"
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/api/version":
+            return self._send_json({"version": "0.0.0-fake"})
+        if self.path == "/api/tags":
+            return self._send_json({"models": []})
+        self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        server = self.server
+        with server._lock:
+            server.requests += 1
+        body = self._body()
+        model = body.get("model", "")
+        now = datetime.now(timezone.utc).isoformat()
+
+        if self.path == "/api/generate":   # Vorladen beim Start
+            return self._send_json({"model": model, "created_at": now, "response": "", "done": True})
+        if self.path != "/api/chat":
+            return self._send_json({"error": "not found"}, 404)
+
+        pieces = server.pieces(model)
+        delay = 1.0 / server.token_rate if server.token_rate > 0 else 0.0
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in body.get("messages", []))
+        start = perf_counter()
+        sleep(server.first_token_ms / 1000)
+
+        def final(extra):
+            eval_ns = int((perf_counter() - start) * 1e9)
+            return {"model": model, "created_at": now, "done": True, "done_reason": "stop",
+                    "total_duration": eval_ns, "load_duration": 0,
+                    "prompt_eval_count": prompt_tokens, "prompt_eval_duration": int(server.first_token_ms * 1e6),
+                    "eval_count": len(pieces), "eval_duration": max(1, eval_ns - int(server.first_token_ms * 1e6)),
+                    **extra}
+
+        if not body.get("stream", True):
+            sleep(delay * len(pieces))
+            return self._send_json(final({"message": {"role": "assistant", "content": "".join(pieces)}}))
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for i, piece in enumerate(pieces):
+                if i:
+                    sleep(delay)
+                self._chunk({"model": model, "created_at": now, "done": False,
+                             "message": {"role": "assistant", "content": piece}})
+            self._chunk(final({"message": {"role": "assistant", "content": ""}}))
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+
+def start_fake_ollama(port, **settings):
+    server = FakeOllama(("127.0.0.1", port), **settings)
+    threading.Thread(target=server.serve_forever, name="fake-ollama", daemon=True).start()
+    return server
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
@@ -0,0 +1,41 @@
+from datetime import date, datetime
+
+from flask.json.provider import DefaultJSONProvider
+
+try:  # optional, deutlich schneller als json aus der Standardbibliothek
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class SchnellJSONProvider(DefaultJSONProvider):
+    """JSON für jsonify/request.get_json: orjson, falls installiert, sonst stdlib.
+
+    Datumswerte werden in beiden Fällen als ISO-8601 geschrieben (wie
+    datetime.isoformat()), damit Routen sie nicht selbst umwandeln müssen.
+    """
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, (datetime, date)):
+            return o.isoformat()
+        return DefaultJSONProvider.default(o)
+
+    def _orjson_option(self):
+        return orjson.OPT_SORT_KEYS if self.sort_keys else 0
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self._orjson_option()).decode("utf-8")
+
+    def dumps_bytes(self, obj):
+        """Wie dumps(), aber direkt als UTF-8 Bytes (spart das Kodieren für Responses)"""
+        if orjson is None:
+            return super().dumps(obj).encode("utf-8")
+        return orjson.dumps(obj, default=self.default, option=self._orjson_option())
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
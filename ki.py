@@ -1,32 +1,272 @@
-from ollama import chat, ChatResponse
+from ollama import Client, ChatResponse
+import httpx
+import logging
 import re
+import threading
+from time import perf_counter
+
+THINK_START = "<think>"
+THINK_END = "</think>"
+# Ein <think>-Block ohne </think> (Antwort am Token-Limit abgeschnitten) geht bis zum Ende
+THINK_BLOCK = re.compile(r"<think>(.*?)(?:</think>|$)", flags=re.DOTALL)
+
+log = logging.getLogger("ki")
+
+
+# =========================
+# Gemeinsamer ollama-Client (Verbindungs-Pool, Timeouts, keep_alive)
+
+_settings = {
+    "host": None,                 # None = OLLAMA_HOST aus der Umgebung
+    "connect_timeout": 5.0,
+    "read_timeout": 120.0,
+    "max_connections": 32,
+    "keep_alive": {},             # Modell -> keep_alive, z.B. {"llama3.1:8b": "1h"}
+    "default_keep_alive": "30m",
+    "observer": None,             # observer(stats) nach jeder Generierung, z.B. für /metrics
+}
+_client = None
+_client_lock = threading.Lock()
+
+
+def configure_client(**settings):
+    """Einstellungen für den gemeinsamen Client setzen (vor der ersten Anfrage)"""
+    global _client
+    unknown = set(settings) - set(_settings)
+    if unknown:
+        raise ValueError(f"Unbekannte Einstellung(en): {', '.join(sorted(unknown))}")
+    with _client_lock:
+        _settings.update(settings)
+        if _client is not None:
+            _client._client.close()
+            _client = None
+
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = Client(
+                host=_settings["host"],
+                timeout=httpx.Timeout(_settings["read_timeout"], connect=_settings["connect_timeout"]),
+                limits=httpx.Limits(
+                    max_connections=_settings["max_connections"],
+                    max_keepalive_connections=_settings["max_connections"],
+                ),
+            )
+        return _client
+
+
+def keep_alive_for(model):
+    return _settings["keep_alive"].get(model, _settings["default_keep_alive"])
+
+
+def chat(model, messages, **kwargs):
+    """ollama chat über den gemeinsamen Client, mit keep_alive pro Modell"""
+    kwargs.setdefault("keep_alive", keep_alive_for(model))
+    return get_client().chat(model=model, messages=messages, **kwargs)
+
+
+def warmup(models):
+    """Modelle vorab in den Speicher laden, damit die erste Antwort nicht kalt startet"""
+    for model in models:
+        try:
+            get_client().generate(model=model, prompt="", keep_alive=keep_alive_for(model))
+            log.info("modell_geladen", extra={"felder": {"model": model}})
+        except Exception as e:
+            log.warning("modell_nicht_geladen", extra={"felder": {"model": model, "fehler": str(e)}})
+
+
+def _report(stats, response_text=None, print_log=False):
+    """Kennzahlen einer Generierung an den Observer und ins Log (eine strukturierte Zeile)"""
+    observer = _settings["observer"]
+    if observer:
+        try:
+            observer(stats)
+        except Exception:
+            log.exception("observer_fehler")
+    log.info("ki_antwort", extra={"felder": stats})
+    if print_log and response_text is not None:
+        log.debug("ki_text", extra={"felder": {"model": stats["model"], "text": response_text}})
+
+
+def _eval_stats(model, stream, start, first, done_part, chars):
+    """Zeiten aus der Messung + Token-Zahlen aus der letzten ollama-Antwort (eval_count/eval_duration)"""
+    total = perf_counter() - start
+    eval_count = getattr(done_part, "eval_count", None) if done_part is not None else None
+    eval_duration = getattr(done_part, "eval_duration", None) if done_part is not None else None
+    if first is None and done_part is not None:
+        # ohne Stream: Zeit bis zum ersten Token = Laden + Prompt auswerten (laut ollama)
+        load = getattr(done_part, "load_duration", None) or 0
+        prompt = getattr(done_part, "prompt_eval_duration", None) or 0
+        first = (load + prompt) / 1e9 if (load or prompt) else None
+    return {
+        "model": model,
+        "stream": stream,
+        "ttft": first,
+        "total": total,
+        "prompt_tokens": getattr(done_part, "prompt_eval_count", None) if done_part is not None else None,
+        "eval_count": eval_count,
+        "tokens_per_s": eval_count / (eval_duration / 1e9) if eval_count and eval_duration else None,
+        "chars": chars,
+        "done_reason": getattr(done_part, "done_reason", None) if done_part is not None else None,
+    }
+
+
+def build_messages(input_content, system_prompt="", history=None):
+    """System-Prompt + bisheriger Verlauf + neue Nutzer-Nachricht"""
+    messages = [{"role": "system", "content": system_prompt}]
+    messages.extend(history or [])
+    messages.append({"role": "user", "content": input_content})
+    return messages
+
 
 def ask_deepseek(
     input_content,
     system_prompt="",
     model="llama3.1:8b",   
     deep_think=False,
-    print_log=True
+    print_log=True,
+    history=None,
+    options=None
 ):
+    start = perf_counter()
     response: ChatResponse = chat(
         model=model,
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": input_content},
-        ],
+        messages=build_messages(input_content, system_prompt, history),
+        options=options,
     )
 
     response_text = response["message"]["content"]
-
-    if print_log:
-        print(response_text)
+    stats = _eval_stats(model, False, start, None, response, len(response_text))
 
     if not deep_think:
+        stats["think"] = 0.0
+        _report(stats, response_text, print_log)
         return response_text, ""
 
-    think_texts = re.findall(r"<think>(.*?)</think>", response_text, flags=re.DOTALL)
-    think_texts = "\n\n".join(think_texts).strip()
-
-    clean_response = re.sub(r"<think>.*?</think>", "", response_text, flags=re.DOTALL).strip()
+    t = perf_counter()
+    think_texts = "\n\n".join(THINK_BLOCK.findall(response_text)).strip()
+    clean_response = THINK_BLOCK.sub("", response_text).strip()
+    stats["think"] = perf_counter() - t
+    _report(stats, response_text, print_log)
 
     return clean_response, think_texts
+
+
+# =========================
+# Streaming Variante
+
+class ThinkFilter:
+    """Entfernt <think>-Blöcke aus einem Token-Strom, Stück für Stück"""
+
+    def __init__(self):
+        self.buffer = ""
+        self.in_think = False
+        self.started = False   # erst ab dem ersten sichtbaren Zeichen ausgeben
+        self.think_parts = []
+
+    def _split_tag(self, tag):
+        """Text bis zum Tag abtrennen; ein angeschnittenes Tag am Ende bleibt im Puffer"""
+        pos = self.buffer.find(tag)
+        if pos != -1:
+            head = self.buffer[:pos]
+            self.buffer = self.buffer[pos + len(tag):]
+            return head, True
+
+        keep = 0
+        for i in range(1, len(tag)):
+            if self.buffer.endswith(tag[:i]):
+                keep = i
+        head = self.buffer[:len(self.buffer) - keep]
+        self.buffer = self.buffer[len(self.buffer) - keep:]
+        return head, False
+
+    def _visible(self, text):
+        if not self.started:
+            text = text.lstrip()
+            if text:
+                self.started = True
+        return text
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        out = []
+        while True:
+            if self.in_think:
+                head, found = self._split_tag(THINK_END)
+                self.think_parts.append(head)
+                if not found:
+                    break
+                self.in_think = False
+            else:
+                head, found = self._split_tag(THINK_START)
+                out.append(self._visible(head))
+                if not found:
+                    break
+                self.in_think = True
+        return "".join(out)
+
+    def flush(self):
+        rest, self.buffer = self.buffer, ""
+        if self.in_think:
+            self.think_parts.append(rest)
+            return ""
+        return self._visible(rest)
+
+    @property
+    def think_text(self):
+        return "".join(self.think_parts).strip()
+
+
+def ask_deepseek_stream(
+    input_content,
+    system_prompt="",
+    model="llama3.1:8b",
+    deep_think=False,
+    print_log=True,
+    history=None,
+    options=None
+):
+    """Wie ask_deepseek, liefert die Antwort aber als Generator von Text-Stücken"""
+    start = perf_counter()
+    stream = chat(
+        model=model,
+        messages=build_messages(input_content, system_prompt, history),
+        options=options,
+        stream=True,
+    )
+
+    think_filter = ThinkFilter() if deep_think else None
+    first = last = None
+    think_seconds = 0.0
+    parts = []
+
+    try:
+        for part in stream:
+            last = part
+            piece = part["message"]["content"]
+            if not piece:
+                continue
+            if first is None:
+                first = perf_counter() - start
+            parts.append(piece)
+            if think_filter:
+                t = perf_counter()
+                piece = think_filter.feed(piece)
+                think_seconds += perf_counter() - t
+                if not piece:
+                    continue
+            yield piece
+
+        if think_filter:
+            rest = think_filter.flush()
+            if rest:
+                yield rest
+    finally:
+        # auch bei Abbruch (Client weg, Fehler) einmal melden
+        stats = _eval_stats(model, True, start, first, last if last is not None and last.done else None,
+                            sum(map(len, parts)))
+        stats["think"] = think_seconds
+        stats["abgebrochen"] = last is None or not last.done
+        _report(stats, "".join(parts), print_log)
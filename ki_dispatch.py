@@ -0,0 +1,128 @@
+import threading
+from time import perf_counter
+from contextlib import contextmanager
+from collections import defaultdict
+
+
+class KiUeberlastet(Exception):
+    """Zu viele wartende Anfragen für ein Modell (oder Wartezeit abgelaufen)"""
+
+    def __init__(self, model, reason="Warteschlange voll"):
+        super().__init__(f"{model}: {reason}")
+        self.model = model
+        self.reason = reason
+
+
+class KiDispatcher:
+    """Begrenzt, wie viele Generierungen pro Modell gleichzeitig laufen.
+
+    Jede Anfrage holt sich einen Slot für ihr Modell. Sind alle Slots belegt,
+    wartet sie in der Warteschlange; ist die Warteschlange voll, wird sie sofort
+    abgelehnt, damit die Threads des Webservers für andere Routen frei bleiben.
+    max_total begrenzt laufende + wartende Anfragen über alle Modelle: jede davon
+    belegt einen Thread des Webservers, der Rest bleibt für die übrigen Routen.
+    """
+
+    def __init__(self, limits=None, default_limit=1, max_queue=8, wait_timeout=30, on_wait=None,
+                 max_total=None):
+        self.limits = dict(limits or {})
+        self.default_limit = default_limit
+        self.max_queue = max_queue
+        self.max_total = max_total
+        self.wait_timeout = wait_timeout
+        self.on_wait = on_wait   # on_wait(model, sekunden, bekommen) nach jeder Wartezeit auf einen Slot
+
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._waiting = defaultdict(int)
+        self._running = defaultdict(int)
+        self._rejected = defaultdict(int)
+        self._served = defaultdict(int)
+
+    def limit_for(self, model):
+        return self.limits.get(model, self.default_limit)
+
+    def _semaphore(self, model):
+        with self._lock:
+            sem = self._semaphores.get(model)
+            if sem is None:
+                sem = threading.BoundedSemaphore(self.limit_for(model))
+                self._semaphores[model] = sem
+            return sem
+
+    def _total(self):
+        # nur mit self._lock aufrufen
+        return sum(self._waiting.values()) + sum(self._running.values())
+
+    def queue_depth(self, model):
+        with self._lock:
+            return self._waiting[model]
+
+    def is_saturated(self, model):
+        """True, wenn alle Slots belegt sind und schon jemand wartet"""
+        with self._lock:
+            return self._running[model] >= self.limit_for(model) and self._waiting[model] > 0
+
+    @contextmanager
+    def slot(self, model, timeout=None):
+        """Slot für ein Modell belegen, solange der with-Block läuft"""
+        sem = self._semaphore(model)
+        timeout = self.wait_timeout if timeout is None else timeout
+
+        with self._lock:
+            if self._waiting[model] >= self.max_queue:
+                self._rejected[model] += 1
+                raise KiUeberlastet(model)
+            if self.max_total is not None and self._total() >= self.max_total:
+                self._rejected[model] += 1
+                raise KiUeberlastet(model, "Server ausgelastet")
+            self._waiting[model] += 1
+
+        start = perf_counter()
+        acquired = False
+        try:
+            acquired = sem.acquire(timeout=timeout)
+        finally:
+            with self._lock:
+                self._waiting[model] -= 1
+            if self.on_wait:
+                self.on_wait(model, perf_counter() - start, acquired)
+
+        if not acquired:
+            with self._lock:
+                self._rejected[model] += 1
+            raise KiUeberlastet(model, "Wartezeit abgelaufen")
+
+        with self._lock:
+            self._running[model] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._running[model] -= 1
+                self._served[model] += 1
+            sem.release()
+
+    def run(self, model, fn, /, *args, timeout=None, **kwargs):
+        """fn mit belegtem Slot ausführen (timeout = max. Wartezeit auf den Slot)"""
+        with self.slot(model, timeout):
+            return fn(*args, **kwargs)
+
+    def stream(self, model, gen_fn, /, *args, timeout=None, **kwargs):
+        """Generator durchreichen; der Slot bleibt bis zum Ende belegt"""
+        with self.slot(model, timeout):
+            yield from gen_fn(*args, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            models = set(self.limits) | set(self._semaphores)
+            return {
+                m: {
+                    "limit": self.limit_for(m),
+                    "running": self._running[m],
+                    "waiting": self._waiting[m],
+                    "rejected": self._rejected[m],
+                    "served": self._served[m],
+                }
+                for m in sorted(models)
+            }
@@ -0,0 +1,340 @@
+import heapq
+import itertools
+import json
+import logging
+import sqlite3
+import threading
+import uuid
+from time import time
+
+log = logging.getLogger("jobs")
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def new_job(payload, user_id, priority=0):
+    now = time()
+    return {
+        "id": uuid.uuid4().hex,
+        "status": PENDING,
+        "priority": priority,     # kleiner = früher dran
+        "user_id": user_id,
+        "payload": payload,
+        "result": None,
+        "error": None,
+        "attempts": 0,
+        "run_after": now,
+        "created": now,
+        "claimed_at": None,       # Lease: wird vom Worker per Heartbeat erneuert
+    }
+
+
+class MemoryJobStore:
+    """Jobs nur im Speicher (gehen bei einem Neustart verloren)"""
+
+    def __init__(self, keep_finished=1000):
+        self.keep_finished = keep_finished
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._heap = []            # (priority, seq, job_id)
+        self._seq = itertools.count()
+        self._finished = []        # Reihenfolge, um alte Ergebnisse zu vergessen
+
+    def put(self, job):
+        with self._lock:
+            self._jobs[job["id"]] = job
+            heapq.heappush(self._heap, (job["priority"], next(self._seq), job["id"]))
+
+    def claim(self):
+        now = time()
+        with self._lock:
+            later = []
+            job = None
+            while self._heap:
+                item = heapq.heappop(self._heap)
+                candidate = self._jobs.get(item[2])
+                if candidate is None or candidate["status"] != PENDING:
+                    continue
+                if candidate["run_after"] > now:
+                    later.append(item)
+                    continue
+                job = candidate
+                break
+            for item in later:
+                heapq.heappush(self._heap, item)
+            if job is None:
+                return None
+            job["status"] = RUNNING
+            job["attempts"] += 1
+            job["claimed_at"] = now
+            return dict(job)
+
+    def touch(self, job_ids):
+        now = time()
+        with self._lock:
+            for job_id in job_ids:
+                job = self._jobs.get(job_id)
+                if job and job["status"] == RUNNING:
+                    job["claimed_at"] = now
+
+    def finish(self, job_id, result):
+        self._close(job_id, DONE, result=result)
+
+    def fail(self, job_id, error):
+        self._close(job_id, FAILED, error=error)
+
+    def retry(self, job_id, error, run_after):
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(status=PENDING, error=error, run_after=run_after)
+            heapq.heappush(self._heap, (job["priority"], next(self._seq), job_id))
+
+    def _close(self, job_id, status, result=None, error=None):
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(status=status, result=result, error=error)
+            self._finished.append(job_id)
+            while len(self._finished) > self.keep_finished:
+                self._jobs.pop(self._finished.pop(0), None)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def depth(self):
+        with self._lock:
+            return sum(1 for j in self._jobs.values() if j["status"] == PENDING)
+
+
+class SqliteJobStore:
+    """Jobs in einer SQLite-Datei; offene Jobs überleben einen Neustart
+
+    Ein laufender Job gehört dem Worker nur, solange dessen Heartbeat claimed_at
+    erneuert. Ist claimed_at älter als lease Sekunden (Prozess abgestürzt oder
+    beendet), holt ihn claim() wieder ab. Andere Prozesse, die dieselbe Datei
+    benutzen, nehmen einem lebenden Worker den Job also nicht weg.
+    """
+
+    COLUMNS = ("id", "status", "priority", "user_id", "payload", "result", "error",
+               "attempts", "run_after", "created", "claimed_at")
+
+    def __init__(self, path, lease=120):
+        self.path = path
+        self.lease = lease
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS ki_jobs ("
+                " id TEXT PRIMARY KEY, status TEXT NOT NULL, priority INTEGER NOT NULL,"
+                " user_id INTEGER, payload TEXT NOT NULL, result TEXT, error TEXT,"
+                " attempts INTEGER NOT NULL DEFAULT 0, run_after REAL NOT NULL, created REAL NOT NULL,"
+                " claimed_at REAL)"
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(ki_jobs)")}
+            if "claimed_at" not in columns:
+                # Datei aus einer älteren Version: laufende Jobs haben noch keinen Lease
+                conn.execute("ALTER TABLE ki_jobs ADD COLUMN claimed_at REAL")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_ki_jobs_pending ON ki_jobs (status, priority, created)"
+            )
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _row(self, row):
+        if row is None:
+            return None
+        job = dict(zip(self.COLUMNS, row))
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def put(self, job):
+        values = dict(job, payload=json.dumps(job["payload"]), result=None)
+        self._conn().execute(
+            f"INSERT INTO ki_jobs ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(self.COLUMNS))})",
+            [values[c] for c in self.COLUMNS],
+        )
+
+    def claim(self):
+        conn = self._conn()
+        now = time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Lease abgelaufen (kein Heartbeat mehr): Job wieder freigeben
+            expired = conn.execute(
+                "UPDATE ki_jobs SET status = ? WHERE status = ? AND (claimed_at IS NULL OR claimed_at < ?)",
+                (PENDING, RUNNING, now - self.lease),
+            ).rowcount
+            if expired:
+                log.warning("job_lease_abgelaufen", extra={"felder": {"jobs": expired}})
+            row = conn.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM ki_jobs"
+                " WHERE status = ? AND run_after <= ? ORDER BY priority, created LIMIT 1",
+                (PENDING, now),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE ki_jobs SET status = ?, attempts = attempts + 1, claimed_at = ? WHERE id = ?",
+                    (RUNNING, now, row[0]),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        job = self._row(row)
+        if job:
+            job["status"] = RUNNING
+            job["attempts"] += 1
+            job["claimed_at"] = now
+        return job
+
+    def touch(self, job_ids):
+        """Heartbeat: Lease der laufenden Jobs verlängern"""
+        if not job_ids:
+            return
+        job_ids = list(job_ids)
+        self._conn().execute(
+            f"UPDATE ki_jobs SET claimed_at = ? WHERE status = ? AND id IN ({', '.join('?' * len(job_ids))})",
+            [time(), RUNNING, *job_ids],
+        )
+
+    def finish(self, job_id, result):
+        self._conn().execute(
+            "UPDATE ki_jobs SET status = ?, result = ?, error = NULL WHERE id = ?",
+            (DONE, json.dumps(result), job_id),
+        )
+
+    def fail(self, job_id, error):
+        self._conn().execute("UPDATE ki_jobs SET status = ?, error = ? WHERE id = ?", (FAILED, error, job_id))
+
+    def retry(self, job_id, error, run_after):
+        self._conn().execute(
+            "UPDATE ki_jobs SET status = ?, error = ?, run_after = ? WHERE id = ?",
+            (PENDING, error, run_after, job_id),
+        )
+
+    def get(self, job_id):
+        row = self._conn().execute(
+            f"SELECT {', '.join(self.COLUMNS)} FROM ki_jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        return self._row(row)
+
+    def depth(self):
+        return self._conn().execute("SELECT COUNT(*) FROM ki_jobs WHERE status = ?", (PENDING,)).fetchone()[0]
+
+
+class JobWorkerPool:
+    """Worker-Threads, die Jobs aus dem Store holen und handler(job) ausführen"""
+
+    def __init__(self, store, handler, workers=2, max_retries=2, retry_delay=3, retry_on=(Exception,),
+                 heartbeat=None):
+        self.store = store
+        self.handler = handler
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.retry_on = retry_on
+        # Heartbeat-Intervall: ein Drittel des Leases, damit ein verpasster Takt nicht reicht
+        lease = getattr(store, "lease", None)
+        self.heartbeat = heartbeat or (lease / 3 if lease else None)
+
+        self._active = set()       # job_ids, die gerade laufen (für den Heartbeat)
+        self._active_lock = threading.Lock()
+        self._wake = threading.Condition()
+        self._done = threading.Condition()
+        self._threads = []
+        self._stopping = False
+
+    def start(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._loop, name=f"ki-job-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        if self.heartbeat:
+            threading.Thread(target=self._heartbeat_loop, name="ki-job-heartbeat", daemon=True).start()
+
+    def stop(self):
+        self._stopping = True
+        with self._wake:
+            self._wake.notify_all()
+
+    def submit(self, payload, user_id, priority=0):
+        job = new_job(payload, user_id, priority)
+        self.store.put(job)
+        with self._wake:
+            self._wake.notify()
+        return job
+
+    def _loop(self):
+        while not self._stopping:
+            try:
+                job = self.store.claim()
+            except Exception as e:
+                log.exception("job_queue_fehler", extra={"felder": {"fehler": str(e)}})
+                job = None
+            if job is None:
+                with self._wake:
+                    self._wake.wait(timeout=1.0)
+                continue
+            self._run(job)
+
+    def _heartbeat_loop(self):
+        while not self._stopping:
+            with self._wake:
+                self._wake.wait(timeout=self.heartbeat)
+            with self._active_lock:
+                active = list(self._active)
+            try:
+                self.store.touch(active)
+            except Exception as e:
+                log.exception("job_heartbeat_fehler", extra={"felder": {"fehler": str(e)}})
+
+    def _run(self, job):
+        with self._active_lock:
+            self._active.add(job["id"])
+        try:
+            self._execute(job)
+        finally:
+            with self._active_lock:
+                self._active.discard(job["id"])
+        with self._done:
+            self._done.notify_all()
+
+    def _execute(self, job):
+        try:
+            result = self.handler(job)
+        except self.retry_on as e:
+            if job["attempts"] <= self.max_retries:
+                self.store.retry(job["id"], str(e), time() + self.retry_delay * job["attempts"])
+            else:
+                self.store.fail(job["id"], str(e))
+        except Exception as e:
+            self.store.fail(job["id"], str(e))
+        else:
+            self.store.finish(job["id"], result)
+
+    def wait(self, job_id, timeout):
+        """Job zurückgeben, sobald er fertig ist (oder nach timeout Sekunden)"""
+        deadline = time() + timeout
+        while True:
+            job = self.store.get(job_id)
+            remaining = deadline - time()
+            if job is None or job["status"] in (DONE, FAILED) or remaining <= 0:
+                return job
+            with self._done:
+                self._done.wait(timeout=min(remaining, 1.0))
+
+    def stats(self):
+        return {"workers": len(self._threads), "pending": self.store.depth()}
@@ -0,0 +1,172 @@
+import logging
+import threading
+from collections import OrderedDict, deque
+
+log = logging.getLogger("kontext")
+
+
+def estimate_tokens(text):
+    """Grobe Schätzung: ca. 4 Zeichen pro Token"""
+    return max(1, len(text or "") // 4)
+
+
+def extractive_summary(summary, turns, max_chars=160):
+    """Alte Turns ohne KI zusammenfassen: pro Turn der Anfang als eine Zeile"""
+    lines = [summary] if summary else []
+    for role, content in turns:
+        who = "Nutzer" if role == "user" else "KI"
+        short = " ".join(content.split())
+        if len(short) > max_chars:
+            short = short[:max_chars].rstrip() + " …"
+        lines.append(f"- {who}: {short}")
+    return "\n".join(lines)
+
+
+class LlmSummary:
+    """Alte Turns von einem (kleinen) Modell zusammenfassen lassen
+
+    Läuft über den Dispatcher wie jede andere KI-Anfrage (Slots, Warteschlange).
+    Ist das Modell ausgelastet oder nicht erreichbar, wird ohne KI gekürzt.
+    """
+
+    PROMPT = (
+        "Fasse den bisherigen Gesprächsverlauf in wenigen Stichpunkten auf Deutsch zusammen. "
+        "Behalte Namen, Fakten und offene Fragen. Keine Einleitung."
+    )
+
+    def __init__(self, ask_fn, model="llama3.1:8b", dispatcher=None, max_wait=5):
+        self.ask_fn = ask_fn
+        self.model = model
+        self.dispatcher = dispatcher
+        self.max_wait = max_wait     # Sekunden auf einen Slot warten, danach ohne KI
+
+    def __call__(self, summary, turns):
+        text = extractive_summary(summary, turns, max_chars=2000)
+        kwargs = dict(input_content=text, system_prompt=self.PROMPT, model=self.model, print_log=False)
+        try:
+            if self.dispatcher:
+                reply, _think = self.dispatcher.run(self.model, self.ask_fn, timeout=self.max_wait, **kwargs)
+            else:
+                reply, _think = self.ask_fn(**kwargs)
+        except Exception as e:
+            log.warning("zusammenfassung_ohne_ki", extra={"felder": {"model": self.model, "fehler": str(e)}})
+            return extractive_summary(summary, turns)
+        return reply.strip()
+
+
+class ChatKontext:
+    """Gleitendes Fenster der letzten Turns eines Chats mit Token-Budget.
+
+    Was aus dem Fenster fällt, wird genau einmal in die Zusammenfassung
+    eingearbeitet. Neue Turns werden nur angehängt, nichts wird neu geladen.
+
+    summarize() kann eine KI-Anfrage sein und läuft deshalb nie unter self.lock:
+    append() sammelt die herausgefallenen Turns nur, flush() fasst sie danach in
+    einem Aufruf zusammen (beim Neuaufbau einmal für alle geladenen Nachrichten).
+    """
+
+    def __init__(self, max_tokens=2048, summary_tokens=512, summarize=extractive_summary):
+        self.max_tokens = max_tokens
+        self.summary_tokens = summary_tokens
+        self.summarize = summarize
+        self.turns = deque()         # (role, content, tokens)
+        self.tokens = 0
+        self.summary = ""
+        self.last_id = None          # id der letzten Nachricht im Fenster
+        self.pending = []            # herausgefallen, aber noch nicht zusammengefasst
+        self.lock = threading.Lock()
+        self._summary_lock = threading.Lock()   # immer nur eine Zusammenfassung gleichzeitig
+
+    def append(self, role, content, msg_id=None, flush=True):
+        with self.lock:
+            tokens = estimate_tokens(content)
+            self.turns.append((role, content, tokens))
+            self.tokens += tokens
+            if msg_id is not None:
+                self.last_id = msg_id
+
+            while self.tokens > self.max_tokens and len(self.turns) > 1:
+                old_role, old_content, old_tokens = self.turns.popleft()
+                self.tokens -= old_tokens
+                self.pending.append((old_role, old_content))
+
+        if flush:
+            self.flush()
+
+    def flush(self):
+        """Gesammelte Turns in einem summarize()-Aufruf einarbeiten (ohne self.lock)"""
+        with self._summary_lock:
+            with self.lock:
+                batch, self.pending = self.pending, []
+                summary = self.summary
+            if not batch:
+                return
+            summary = self._trim_summary(self.summarize(summary, batch))
+            with self.lock:
+                self.summary = summary
+
+    def _trim_summary(self, summary):
+        """Zusammenfassung selbst auch begrenzen (älteste Zeilen fallen weg)"""
+        lines = summary.splitlines()
+        while len(lines) > 1 and estimate_tokens("\n".join(lines)) > self.summary_tokens:
+            lines.pop(0)
+        return "\n".join(lines)
+
+    def messages(self):
+        """Verlauf im Format von ollama (ohne System-Prompt und neue Frage)"""
+        with self.lock:
+            out = []
+            # während flush() läuft: die wartenden Turns schon mal ohne KI gekürzt anhängen
+            summary = extractive_summary(self.summary, self.pending) if self.pending else self.summary
+            if summary:
+                out.append({
+                    "role": "system",
+                    "content": "Zusammenfassung des bisherigen Gesprächs:\n" + summary
+                })
+            out.extend({"role": role, "content": content} for role, content, _ in self.turns)
+            return out
+
+
+class KontextCache:
+    """Hält die Fenster der zuletzt benutzten Chats im Speicher (LRU)"""
+
+    def __init__(self, max_chats=500, **kontext_args):
+        self.max_chats = max_chats
+        self.kontext_args = kontext_args
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chat_id, loader, last_id=None):
+        """Fenster für chat_id holen.
+
+        last_id ist die id der letzten bereits gespeicherten Nachricht. Passt sie
+        nicht zum Fenster (z.B. nach einem Neustart), wird über loader neu gebaut.
+        loader liefert (id, role, content) in zeitlicher Reihenfolge.
+        """
+        with self._lock:
+            kontext = self._items.get(chat_id)
+            if kontext is not None:
+                self._items.move_to_end(chat_id)
+
+        if kontext is not None and kontext.last_id == last_id:
+            return kontext
+
+        kontext = ChatKontext(**self.kontext_args)
+        for msg_id, role, content in loader():
+            kontext.append(role, content, msg_id, flush=False)
+        kontext.flush()
+        kontext.last_id = last_id
+
+        with self._lock:
+            self._items[chat_id] = kontext
+            self._items.move_to_end(chat_id)
+            while len(self._items) > self.max_chats:
+                self._items.popitem(last=False)
+        return kontext
+
+    def invalidate(self, chat_id=None):
+        with self._lock:
+            if chat_id is None:
+                self._items.clear()
+            else:
+                self._items.pop(chat_id, None)
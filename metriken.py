@@ -0,0 +1,171 @@
+import json
+import logging
+import threading
+from bisect import bisect_left
+from datetime import datetime, timezone
+
+# Prometheus-Textformat (Version 0.0.4), ohne zusätzliche Abhängigkeit
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+SEKUNDEN_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_RATE_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 50, 75, 100, 150, 250)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metrik:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: Labels {sorted(labels)} statt {list(self.labelnames)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._samples(items))
+        return lines
+
+
+class Counter(_Metrik):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self, items):
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(v)}" for key, v in items]
+
+
+class Histogram(_Metrik):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=SEKUNDEN_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            if i < len(self.buckets):
+                state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _samples(self, items):
+        out = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                out.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', _number(float(bound)))])} "
+                           f"{cumulative}")
+            out.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', '+Inf')])} {count}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return out
+
+
+class Gauge(_Metrik):
+    """Wert wird erst beim Abruf von /metrics geholt: collect() -> {(label, ...): wert}"""
+    kind = "gauge"
+
+    def __init__(self, name, help, labelnames=(), collect=None):
+        super().__init__(name, help, labelnames)
+        self.collect = collect
+
+    def render(self):
+        values = {tuple(map(str, k)) if isinstance(k, tuple) else (str(k),): v
+                  for k, v in (self.collect() or {}).items()}
+        with self._lock:
+            self._values = values
+        return super().render()
+
+    def _samples(self, items):
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(v)}" for key, v in items]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=SEKUNDEN_BUCKETS):
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name, help, labelnames=(), collect=None):
+        return self._add(Gauge(name, help, labelnames, collect))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# =========================
+# Strukturierte Logs: eine JSON-Zeile pro Ereignis
+
+class JsonFormatter(logging.Formatter):
+    """log.info("ereignis", extra={"felder": {...}}) -> {"ts": ..., "event": "ereignis", ...}"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        entry.update(getattr(record, "felder", None) or {})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def json_logger(name, level=logging.INFO, stream=None):
+    """Logger mit JSON-Zeilen auf stderr (bzw. stream); mehrfacher Aufruf ist harmlos"""
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    if not any(getattr(h, "_json", False) for h in logger.handlers):
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(JsonFormatter())
+        handler._json = True
+        logger.addHandler(handler)
+    logger.propagate = False
+    return logger
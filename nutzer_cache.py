@@ -0,0 +1,57 @@
+import threading
+from collections import OrderedDict
+from time import monotonic
+from types import SimpleNamespace
+
+USER_FIELDS = ("id", "username", "avatar", "theme", "is_admin", "created_at")
+
+
+def snapshot(obj, fields=USER_FIELDS):
+    """Nur-Lese-Kopie eines ORM-Objekts (hängt an keiner Session)"""
+    return SimpleNamespace(**{name: getattr(obj, name) for name in fields})
+
+
+class NutzerCache:
+    """User-Snapshots pro Prozess, kurze TTL und LRU-Grenze.
+
+    Änderungen (Theme, Avatar, Admin-Bearbeitung) rufen invalidate(user_id) auf;
+    die TTL fängt ab, was an der App vorbei in die Datenbank geschrieben wird.
+    """
+
+    def __init__(self, ttl=60, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._items = OrderedDict()   # user_id -> (expires, snapshot or None)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id, loader):
+        """Snapshot für user_id; loader(user_id) liefert ihn aus der DB (oder None)"""
+        now = monotonic()
+        with self._lock:
+            item = self._items.get(user_id)
+            if item is not None and item[0] > now:
+                self._items.move_to_end(user_id)
+                self.hits += 1
+                return item[1]
+            self.misses += 1
+
+        user = loader(user_id)
+        with self._lock:
+            self._items[user_id] = (now + self.ttl, user)
+            self._items.move_to_end(user_id)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+        return user
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._items.clear()
+            else:
+                self._items.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._items), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,93 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class PasswortUeberlastet(Exception):
+    """Zu viele Hash-Berechnungen warten schon"""
+
+
+def _hash(password, method):
+    return generate_password_hash(password, method=method)
+
+
+def _check(pw_hash, password):
+    return check_password_hash(pw_hash, password)
+
+
+def _noop():
+    return None
+
+
+def hash_method(pw_hash):
+    """Verfahren + Parameter eines gespeicherten Hashes, z.B. "scrypt:32768:8:1" """
+    return pw_hash.split("$", 1)[0]
+
+
+class PasswortDienst:
+    """Passwörter hashen/prüfen in einem eigenen Prozess-Pool.
+
+    scrypt/pbkdf2 kosten pro Aufruf viel CPU; im Pool blockieren sie weder den
+    Request-Thread noch (über die GIL) die anderen Threads des Web-Workers.
+    workers=0 rechnet direkt im aufrufenden Thread (z.B. für Skripte).
+    """
+
+    def __init__(self, method="scrypt:32768:8:1", workers=2, max_pending=64, timeout=10):
+        self.method = method
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pool = None
+        self.rehashed = 0
+
+    def start(self):
+        """Pool-Prozesse sofort starten (vor den ersten Threads der App forken)"""
+        if self.workers <= 0 or self._pool is not None:
+            return
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("fork"),
+        )
+        self._pool.submit(_noop).result()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _run(self, fn, *args):
+        if self.workers <= 0:
+            return fn(*args)
+        if self._pool is None:
+            self.start()
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PasswortUeberlastet("Zu viele gleichzeitige Anmeldungen.")
+        try:
+            future = self._pool.submit(fn, *args)
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            # noch in der Queue: gar nicht erst rechnen; läuft schon: Ergebnis verwerfen
+            future.cancel()
+            raise PasswortUeberlastet("Die Passwort-Berechnung dauert gerade zu lange.") from None
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(_hash, password, self.method)
+
+    def check(self, pw_hash, password):
+        return self._run(_check, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        return hash_method(pw_hash) != self.method
+
+    def verify(self, pw_hash, password):
+        """(ok, new_hash): new_hash ist gesetzt, wenn der Hash noch alte Parameter hat"""
+        if not self.check(pw_hash, password):
+            return False, None
+        if self.needs_rehash(pw_hash):
+            self.rehashed += 1
+            return True, self.hash(password)
+        return True, None
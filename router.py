@@ -0,0 +1,99 @@
+import json
+import re
+import threading
+from collections import defaultdict
+
+
+class Route:
+    """Eine Zeile der Routing-Tabelle: wann welches Modell benutzt wird"""
+
+    def __init__(self, name, model, deep_think=False, keywords=(), pattern=None, longer_than=None,
+                 max_wait=None, num_predict=None, priority=0, fallback=None):
+        self.name = name
+        self.model = model
+        self.deep_think = deep_think
+        self.longer_than = longer_than
+        self.max_wait = max_wait          # max. Sekunden in der Warteschlange
+        self.num_predict = num_predict    # max. Tokens pro Antwort, nur wenn gesetzt (Achtung: <think> zählt mit)
+        self.priority = priority          # für die Job-Queue: kleiner = früher dran
+        self.fallback = fallback
+
+        # Alle Schlüsselwörter in einen einzigen Regex (längste zuerst)
+        parts = [re.escape(k.lower()) for k in sorted(keywords, key=len, reverse=True)]
+        if pattern:
+            parts.append(pattern)
+        self.matcher = re.compile("|".join(parts)) if parts else None
+
+    def matches(self, text):
+        if self.matcher and self.matcher.search(text):
+            return True
+        return self.longer_than is not None and len(text) > self.longer_than
+
+    def as_dict(self, fallback_from=None):
+        route = {
+            "route": self.name,
+            "model": self.model,
+            "deep_think": self.deep_think,
+            "max_wait": self.max_wait,
+            "options": {"num_predict": self.num_predict} if self.num_predict else None,
+            "priority": self.priority,
+            "fallback": self.fallback,
+        }
+        if fallback_from:
+            route["fallback_from"] = fallback_from
+        return route
+
+
+class ModelRouter:
+    """Wählt pro Prompt eine Route; weicht auf das günstigere Modell aus,
+    wenn das teure gerade ausgelastet ist."""
+
+    def __init__(self, table, dispatcher=None):
+        self.routes = [Route(**r) for r in table["routes"]]
+        self.by_name = {r.name: r for r in self.routes}
+        self.default = self.by_name[table.get("default") or self.routes[-1].name]
+        self.dispatcher = dispatcher
+
+        self._lock = threading.Lock()
+        self._chosen = defaultdict(int)
+        self._fallbacks = defaultdict(int)
+
+    def _count(self, counter, name):
+        with self._lock:
+            counter[name] += 1
+
+    def choose(self, text):
+        t = (text or "").lower()
+        route = next((r for r in self.routes if r is not self.default and r.matches(t)), self.default)
+
+        # Teures Modell voll ausgelastet -> gleich das Fallback nehmen
+        if route.fallback and self.dispatcher and self.dispatcher.is_saturated(route.model):
+            self._count(self._fallbacks, route.name)
+            return self.by_name[route.fallback].as_dict(fallback_from=route.name)
+
+        self._count(self._chosen, route.name)
+        return route.as_dict()
+
+    def fallback_for(self, route):
+        """Fallback-Route (als dict) für eine gewählte Route, oder None"""
+        name = route.get("fallback")
+        if not name or name not in self.by_name:
+            return None
+        self._count(self._fallbacks, route["route"])
+        return self.by_name[name].as_dict(fallback_from=route["route"])
+
+    def stats(self):
+        with self._lock:
+            return {
+                r.name: {
+                    "model": r.model,
+                    "chosen": self._chosen[r.name],
+                    "fallbacks": self._fallbacks[r.name],
+                }
+                for r in self.routes
+            }
+
+
+def load_routing(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
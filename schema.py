@@ -0,0 +1,119 @@
+import re
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateTable
+
+
+# =========================
+# Migrationen
+
+def ensure_indexes(conn, metadata):
+    """Alle in den Modellen deklarierten Indizes anlegen, falls sie fehlen.
+
+    db.create_all() legt Indizes nur zusammen mit neuen Tabellen an; bei einer
+    bestehenden site.db fehlen sie sonst.
+    """
+    created = []
+    inspector = inspect(conn)
+    for table in metadata.sorted_tables:
+        existing = {ix["name"] for ix in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=conn)
+                created.append(index.name)
+    return created
+
+
+def rebuild_with_autoincrement(conn, table):
+    """SQLite: Tabelle mit AUTOINCREMENT neu anlegen, damit gelöschte ids nie wieder vergeben werden.
+
+    Indizes der Tabelle werden neu angelegt; Trigger auf der Tabelle gehen
+    verloren und müssen vom Aufrufer wiederhergestellt werden.
+    """
+    if conn.dialect.name != "sqlite":
+        return False
+    sql = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :t"),
+                       {"t": table.name}).scalar()
+    if sql is None or "AUTOINCREMENT" in sql.upper():
+        return False
+    new_name = f"{table.name}_neu"
+    create = str(CreateTable(table).compile(dialect=conn.dialect)).strip()
+    create = create.replace(f"CREATE TABLE {table.name} ", f"CREATE TABLE {new_name} ", 1)
+    columns = ", ".join(c.name for c in table.columns)
+
+    conn.exec_driver_sql("PRAGMA legacy_alter_table = ON")   # Views auf die Tabelle nicht umschreiben
+    try:
+        conn.exec_driver_sql(create)
+        conn.exec_driver_sql(f"INSERT INTO {new_name} ({columns}) SELECT {columns} FROM {table.name}")
+        conn.exec_driver_sql(f"DROP TABLE {table.name}")
+        conn.exec_driver_sql(f"ALTER TABLE {new_name} RENAME TO {table.name}")
+    finally:
+        conn.exec_driver_sql("PRAGMA legacy_alter_table = OFF")
+    for index in table.indexes:
+        index.create(bind=conn)
+    return True
+
+
+def run_migrations(db, migrations):
+    """Migrationen (version, beschreibung, fn(conn)) genau einmal ausführen"""
+    with db.engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            " version INTEGER PRIMARY KEY, name VARCHAR(200) NOT NULL, applied_at DATETIME NOT NULL)"
+        ))
+        done = {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+    applied = []
+    for version, name, fn in sorted(migrations, key=lambda m: m[0]):
+        if version in done:
+            continue
+        with db.engine.begin() as conn:
+            fn(conn)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:v, :n, :t)"),
+                {"v": version, "n": name, "t": datetime.utcnow()},
+            )
+        applied.append(f"{version}: {name}")
+    return applied
+
+
+# =========================
+# Query-Plan Audit (SQLite)
+
+# Tabellen, die mit den Nutzern wachsen: hier darf keine Query komplett lesen
+HOT_TABLES = ("chat", "chat_message")
+SCAN_LINE = re.compile(r"^SCAN (?:TABLE )?(\w+)")   # SQLite < 3.36: "SCAN TABLE chat"
+
+
+def explain_query_plan(db, query, params=None):
+    """EXPLAIN QUERY PLAN für eine SQLAlchemy-Query (auch text()), als Liste von Zeilen"""
+    stmt = getattr(query, "statement", query)
+    compiled = stmt.compile(dialect=db.engine.dialect)
+    params = compiled.construct_params(params)
+    positional = tuple(params[name] for name in (compiled.positiontup or []))
+    with db.engine.connect() as conn:
+        rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + compiled.string, positional).fetchall()
+    return [row[-1] for row in rows]
+
+
+def table_scans(plan, tables=HOT_TABLES):
+    """SCAN-Zeilen für die Tabellen, auch über einen (covering) Index oder die rowid.
+
+    Im Plan steht der Alias statt der Tabelle, die geprüften Queries benutzen daher keine.
+    """
+    problems = []
+    for line in plan:
+        match = SCAN_LINE.match(line)
+        if match and match.group(1) in tables:
+            problems.append(line)
+    return problems
+
+
+def assert_no_table_scan(db, query, name="query", params=None, tables=HOT_TABLES):
+    """AssertionError bei einem SCAN über chat/chat_message; sortieren ohne Index ist erlaubt"""
+    plan = explain_query_plan(db, query, params)
+    problems = table_scans(plan, tables)
+    if problems:
+        raise AssertionError(f"{name}: {'; '.join(problems)} (Plan: {' | '.join(plan)})")
+    return plan
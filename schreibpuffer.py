@@ -0,0 +1,109 @@
+import atexit
+import logging
+import threading
+from time import monotonic
+
+log = logging.getLogger("schreibpuffer")
+
+
+class SchreibPuffer:
+    """Write-behind: Zeilen im Speicher sammeln und gebündelt schreiben.
+
+    flush_fn(rows) bekommt eine Liste von Zeilen und schreibt sie in einem
+    Rutsch (z.B. ein executemany in einer Transaktion). Geschrieben wird,
+    sobald max_batch Zeilen da sind oder flush_interval Sekunden vergangen sind.
+    Ist der Puffer voll (max_pending), wartet put() bis zu put_timeout Sekunden
+    auf Platz und schreibt sonst selbst (Backpressure statt unbegrenztem RAM).
+    """
+
+    def __init__(self, flush_fn, max_batch=100, flush_interval=2.0, max_pending=5000, put_timeout=1.0,
+                 name="schreibpuffer"):
+        self.flush_fn = flush_fn
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.put_timeout = put_timeout
+        self.name = name
+
+        self._cond = threading.Condition()
+        self._rows = []
+        self._flush_lock = threading.Lock()   # immer nur ein flush_fn gleichzeitig
+        self._thread = None
+        self._stopping = False
+        self.written = 0
+        self.batches = 0
+        self.errors = 0
+        self.blocked = 0
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def put(self, row):
+        with self._cond:
+            if len(self._rows) >= self.max_pending:
+                self.blocked += 1
+                self._cond.notify_all()
+                self._cond.wait_for(lambda: len(self._rows) < self.max_pending, timeout=self.put_timeout)
+            full = len(self._rows) >= self.max_pending
+            if not full:
+                self._rows.append(row)
+                if len(self._rows) >= self.max_batch:
+                    self._cond.notify_all()
+                return
+        # Hintergrund-Thread kommt nicht hinterher: selbst schreiben
+        self._write([row])
+
+    def flush(self):
+        """Alles, was im Puffer liegt, sofort schreiben"""
+        while True:
+            with self._cond:
+                rows, self._rows = self._rows[:self.max_batch], self._rows[self.max_batch:]
+                self._cond.notify_all()
+            if not rows:
+                return
+            self._write(rows)
+
+    def close(self):
+        """Beim Beenden: Thread stoppen und den Rest schreiben"""
+        self._stopping = True
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def _loop(self):
+        while not self._stopping:
+            deadline = monotonic() + self.flush_interval
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._stopping or len(self._rows) >= self.max_batch or monotonic() >= deadline,
+                    timeout=self.flush_interval,
+                )
+            self.flush()
+
+    def _write(self, rows):
+        with self._flush_lock:
+            try:
+                self.flush_fn(rows)
+                self.written += len(rows)
+                self.batches += 1
+            except Exception as e:
+                self.errors += 1
+                log.error("schreiben_fehlgeschlagen",
+                          extra={"felder": {"puffer": self.name, "zeilen": len(rows), "fehler": str(e)}})
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._rows)
+        return {
+            "pending": pending,
+            "written": self.written,
+            "batches": self.batches,
+            "errors": self.errors,
+            "blocked": self.blocked,
+        }
@@ -0,0 +1,235 @@
+import hashlib
+import logging
+import os
+import threading
+import weakref
+from time import perf_counter, time
+
+try:
+    import numpy as np
+except ImportError:  # optional, nur für den semantischen Cache nötig
+    np = None
+
+from antwort_cache import normalize_text
+
+log = logging.getLogger("semantik")
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("Der semantische Cache braucht numpy (pip install numpy).")
+
+
+def namespace_id(model, system_prompt):
+    """Antworten nur innerhalb von gleichem Modell + System-Prompt wiederverwenden"""
+    raw = f"{model}\n{system_prompt.strip()}".encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(raw, digest_size=8).digest(), "little", signed=True)
+
+
+class HashingEmbedder:
+    """Einfacher Ersatz für ein Embedding-Modell (Tests, Benchmarks, ohne ollama).
+
+    Wörter und Buchstaben-Trigramme werden in feste Buckets gehasht.
+    """
+
+    def __init__(self, dim=256):
+        _require_numpy()
+        self.dim = dim
+
+    def _features(self, text):
+        t = normalize_text(text)
+        words = t.split()
+        yield from words
+        padded = f" {t} "
+        for i in range(len(padded) - 2):
+            yield padded[i:i + 3]
+
+    def __call__(self, text):
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for feature in self._features(text):
+            h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            vec[h % self.dim] += 1.0 if (h >> 63) & 1 else -1.0
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+
+class OllamaEmbedder:
+    """Embeddings von einem lokalen ollama-Modell (z.B. nomic-embed-text)"""
+
+    def __init__(self, model="nomic-embed-text", dim=768, client=None):
+        _require_numpy()
+        self.model = model
+        self.dim = dim
+        self.client = client
+
+    def __call__(self, text):
+        if self.client is not None:
+            response = self.client.embed(model=self.model, input=normalize_text(text))
+        else:
+            from ollama import embed
+            response = embed(model=self.model, input=normalize_text(text))
+        vec = np.asarray(response["embeddings"][0], dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+
+def process_path(path):
+    """"vektoren.npy" -> "vektoren.<pid>.npy" """
+    root, ext = os.path.splitext(path)
+    return f"{root}.{os.getpid()}{ext}"
+
+
+def _remove_file(path, owner_pid):
+    if os.getpid() != owner_pid:   # geforkte Kinder räumen nicht die Datei des Elternprozesses weg
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class VectorIndex:
+    """Feste Anzahl Vektoren in einer NumPy-Matrix, Suche per Kosinus (Skalarprodukt).
+
+    Mit path liegen die Vektoren in einer Memory-Map-Datei statt im RAM. Der Inhalt
+    gilt trotzdem nur für die Laufzeit des Prozesses: jeder Prozess (z.B. Gunicorn-Worker)
+    bekommt seine eigene Datei mit der PID im Namen, die beim Beenden gelöscht wird.
+    Ist der Index voll, wird der am längsten nicht benutzte Eintrag überschrieben (LRU).
+    """
+
+    def __init__(self, dim, capacity=10000, path=None):
+        _require_numpy()
+        self.dim = dim
+        self.capacity = capacity
+        self.path = process_path(path) if path else None
+        if self.path:
+            # mode="w+" legt die Datei neu an -> nie eine Datei eines anderen Prozesses
+            self.vectors = np.lib.format.open_memmap(self.path, mode="w+", dtype=np.float32, shape=(capacity, dim))
+            weakref.finalize(self, _remove_file, self.path, os.getpid())
+        else:
+            self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.namespaces = np.zeros(capacity, dtype=np.int64)
+        self.last_used = np.zeros(capacity, dtype=np.float64)
+        self.payloads = [None] * capacity
+        self.size = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def add(self, vec, namespace, payload):
+        with self._lock:
+            if self.size < self.capacity:
+                slot = self.size
+                self.size += 1
+            else:
+                slot = int(np.argmin(self.last_used))
+                self.evictions += 1
+            self.vectors[slot] = vec
+            self.namespaces[slot] = namespace
+            self.last_used[slot] = time()
+            self.payloads[slot] = payload
+            return slot
+
+    def search(self, vec, namespace, k=1):
+        """Top-k (slot, score) innerhalb eines Namespace, beste zuerst"""
+        with self._lock:
+            n = self.size
+            if n == 0:
+                return []
+            scores = self.vectors[:n] @ vec
+            scores[self.namespaces[:n] != namespace] = -1.0
+            k = min(k, n)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(int(i), float(scores[i])) for i in top if scores[i] > -1.0]
+
+    def get(self, slot):
+        with self._lock:
+            self.last_used[slot] = time()
+            return self.payloads[slot]
+
+
+class SemantikCache:
+    """Findet gespeicherte Antworten auch für umformulierte Fragen"""
+
+    def __init__(self, embedder, index, threshold=0.92, top_k=3):
+        self.embedder = embedder
+        self.index = index
+        self.threshold = threshold
+        self.top_k = top_k
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.lookup_seconds = 0.0
+
+    def embed(self, text):
+        return self.embedder(text)
+
+    def lookup(self, model, system_prompt, vec):
+        """Gespeicherte Antwort, wenn ein Eintrag ähnlich genug ist, sonst None"""
+        start = perf_counter()
+        found = None
+        for slot, score in self.index.search(vec, namespace_id(model, system_prompt), self.top_k):
+            if score >= self.threshold:
+                found = self.index.get(slot)
+                break
+        with self._lock:
+            self.lookup_seconds += perf_counter() - start
+            if found is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return found
+
+    def store(self, model, system_prompt, vec, payload):
+        self.index.add(vec, namespace_id(model, system_prompt), payload)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": self.index.size,
+                "capacity": self.index.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.index.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "avg_lookup_ms": round(1000 * self.lookup_seconds / lookups, 3) if lookups else 0.0,
+            }
+
+
+def lookup_semantic(cache, policy, input_content, system_prompt, model, deep_think, history):
+    """(vec, hit) für eine Anfrage; vec ist None, wenn sie nicht in den Cache darf"""
+    vec = None
+    if cache and policy.eligible(model, deep_think, history, input_content):
+        try:
+            vec = cache.embed(input_content)
+        except Exception as e:
+            log.warning("embedding_fehler", extra={"felder": {"fehler": str(e)}})
+    hit = cache.lookup(model, system_prompt, vec) if vec is not None else None
+    return vec, hit
+
+
+def store_semantic(cache, model, system_prompt, vec, reply, think):
+    """Antwort zum Vektor ablegen (leere Antworten nicht)"""
+    if vec is not None and reply:
+        cache.store(model, system_prompt, vec, {"reply": reply, "think": think})
+
+
+def ask_semantic(cache, policy, ask_fn, input_content, system_prompt="", model="llama3.1:8b",
+                 deep_think=False, history=None, **kwargs):
+    """ask_fn (Signatur wie ask_deepseek) mit semantischem Cache davor"""
+    vec, hit = lookup_semantic(cache, policy, input_content, system_prompt, model, deep_think, history)
+    if hit is not None:
+        return hit["reply"], hit["think"]
+
+    reply, think = ask_fn(
+        input_content=input_content,
+        system_prompt=system_prompt,
+        model=model,
+        deep_think=deep_think,
+        history=history,
+        **kwargs,
+    )
+    store_semantic(cache, model, system_prompt, vec, reply, think)
+    return reply, think
@@ -0,0 +1,191 @@
+import threading
+from functools import partial
+
+from antwort_cache import cache_key
+
+
+class FlightTimeout(TimeoutError):
+    """Eine mitlesende Anfrage hat zu lange auf den Leader gewartet"""
+
+
+class _Call:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.finished = False
+        self.result = None
+        self.error = None
+        self.chunks = []
+        self.consumers = 0   # nur Streams: wie viele Anfragen gerade mitlesen
+
+
+class _Reader:
+    """Iterator eines Mitlesers; meldet sich genau einmal ab.
+
+    Das Abmelden steckt nicht im finally des Generators: ein Generator, der nie
+    gestartet wurde, führt beim close() kein finally aus und hielte die
+    Generierung sonst für immer am Leben. Wird der Reader nicht gelesen und nur
+    weggeworfen, meldet __del__ ihn ab.
+    """
+
+    def __init__(self, gen, release):
+        self._gen = gen
+        self._release = release
+        self._open = True
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._gen)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self._open:
+            self._open = False
+            self._gen.close()
+            self._release()
+
+    __del__ = close
+
+
+class SingleFlight:
+    """Gleiche Anfragen, die gleichzeitig laufen, teilen sich eine Generierung.
+
+    Die erste Anfrage zu einem Key (Leader) ruft das Modell auf, alle weiteren
+    warten auf ihr Ergebnis. Beim Streaming läuft die Generierung in einem
+    eigenen Thread und alle Anfragen lesen mit; bricht ein Client ab (auch der
+    erste), laufen die anderen weiter. Erst wenn keiner mehr liest, wird die
+    Generierung beendet.
+
+    Mitleser warten höchstens wait_timeout Sekunden auf das Ergebnis bzw. beim
+    Streaming auf das nächste Stück, danach FlightTimeout.
+    """
+
+    def __init__(self, wait_timeout=300):
+        self.wait_timeout = wait_timeout
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._streams = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def _join(self, table, key, consumer=False):
+        """(call, is_leader) für einen Key"""
+        with self._lock:
+            call = table.get(key)
+            leader = call is None
+            if leader:
+                call = table[key] = _Call()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+            if consumer:
+                call.consumers += 1
+            return call, leader
+
+    def _finish(self, table, key, call):
+        with self._lock:
+            if table.get(key) is call:
+                del table[key]
+        with call.cond:
+            call.finished = True
+            call.cond.notify_all()
+
+    def do(self, key, fn):
+        call, leader = self._join(self._calls, key)
+        if not leader:
+            with call.cond:
+                if not call.cond.wait_for(lambda: call.finished, timeout=self.wait_timeout):
+                    raise FlightTimeout(f"Keine Antwort nach {self.wait_timeout} s (zusammengelegte Anfrage).")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            self._finish(self._calls, key, call)
+
+    def stream(self, key, gen_fn):
+        """Generator; ein Thread erzeugt die Stücke, jede Anfrage bekommt alle (auch die schon erzeugten)"""
+        call, leader = self._join(self._streams, key, consumer=True)
+        if leader:
+            threading.Thread(target=self._produce, args=(key, call, gen_fn),
+                             name="singleflight-stream", daemon=True).start()
+        return _Reader(self._consume(call), partial(self._leave, call))
+
+    def _leave(self, call):
+        with self._lock:
+            call.consumers -= 1
+
+    def _produce(self, key, call, gen_fn):
+        gen = gen_fn()
+        try:
+            for piece in gen:
+                with call.cond:
+                    call.chunks.append(piece)
+                    call.cond.notify_all()
+                with self._lock:
+                    if call.consumers == 0:
+                        # keiner liest mehr mit: aufhören, späte Anfragen starten neu
+                        self._streams.pop(key, None)
+                        call.error = RuntimeError("Generierung wurde abgebrochen.")
+                        break
+        except BaseException as e:
+            call.error = e
+        finally:
+            gen.close()
+            self._finish(self._streams, key, call)
+
+    def _consume(self, call):
+        sent = 0
+        while True:
+            with call.cond:
+                ready = call.cond.wait_for(lambda: sent < len(call.chunks) or call.finished,
+                                           timeout=self.wait_timeout)
+                if not ready:
+                    raise FlightTimeout(f"Kein neues Stück nach {self.wait_timeout} s (zusammengelegter Stream).")
+                new = call.chunks[sent:]
+                sent = len(call.chunks)
+                finished = call.finished
+            yield from new
+            if finished:
+                if call.error is not None:
+                    raise call.error
+                return
+
+    def stats(self):
+        with self._lock:
+            return {
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._calls) + len(self._streams),
+            }
+
+
+def flight_key(model, deep_think, system_prompt, history, input_content):
+    return f"{cache_key(model, system_prompt, history, input_content)}:{int(bool(deep_think))}"
+
+
+def ask_coalesced(flight, ask_fn, input_content, system_prompt="", model="llama3.1:8b",
+                  deep_think=False, history=None, **kwargs):
+    """ask_fn (Signatur wie ask_deepseek), gleichzeitige gleiche Anfragen zusammengelegt"""
+    call = partial(
+        ask_fn,
+        input_content=input_content,
+        system_prompt=system_prompt,
+        model=model,
+        deep_think=deep_think,
+        history=history,
+        **kwargs,
+    )
+    if flight is None:
+        return call()
+    return flight.do(flight_key(model, deep_think, system_prompt, history, input_content), call)
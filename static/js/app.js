@@ -3,6 +3,22 @@
   // Kleiner Helfer: statt document.querySelector(...) immer nur $(...)
   const $ = (sel) => document.querySelector(sel);
 
+  // GET mit ETag: bei 304 liefert der Server nichts, wir nehmen die gemerkte Antwort
+  const etagCache = new Map(); // url -> { etag, data }
+  async function fetchJson(url) {
+    const cached = etagCache.get(url);
+    const headers = { Accept: "application/json" };
+    if (cached) headers["If-None-Match"] = cached.etag;
+
+    const r = await fetch(url, { headers, cache: "no-store" });
+    if (r.status === 304 && cached) return { ok: true, data: cached.data };
+
+    const data = await r.json().catch(() => ({}));
+    const etag = r.headers.get("ETag");
+    if (r.ok && etag) etagCache.set(url, { etag, data });
+    return { ok: r.ok, data };
+  }
+
   // Warten, bis das DOM komplett geladen ist
   document.addEventListener("DOMContentLoaded", () => {
     /* ============================================================
@@ -56,11 +72,8 @@
       messagesEl.dataset.chatId = activeChatId ? String(activeChatId) : "";
     }
 
-    // Eine Nachricht (User oder Bot) im Chat anzeigen
-    function renderMessage(text, isBot = false) {
-      // Sicherheitscheck: nur anzeigen, wenn noch der gleiche Chat aktiv ist
-      if (messagesEl.dataset.chatId && messagesEl.dataset.chatId !== String(activeChatId || "")) return;
-
+    // DOM-Element für eine Nachricht bauen (noch nicht eingefügt)
+    function buildMessageEl(text, isBot = false) {
       const b = document.createElement("div");
       b.className = isBot ? "msg msg-in" : "msg msg-out";
       
@@ -71,7 +84,15 @@
         // User-Nachricht nur als Text
         b.textContent = text;
       }
-      
+      return b;
+    }
+
+    // Eine Nachricht (User oder Bot) im Chat anzeigen
+    function renderMessage(text, isBot = false) {
+      // Sicherheitscheck: nur anzeigen, wenn noch der gleiche Chat aktiv ist
+      if (messagesEl.dataset.chatId && messagesEl.dataset.chatId !== String(activeChatId || "")) return;
+
+      const b = buildMessageEl(text, isBot);
       messagesEl.appendChild(b);
       messagesEl.scrollTop = messagesEl.scrollHeight; // Immer nach unten scrollen
       return b;
@@ -107,6 +128,104 @@
       }
     }
 
+    /* ============================================================
+     *  KI-ANTWORT ALS STREAM (SERVER-SENT EVENTS) EMPFANGEN
+     * ============================================================ */
+
+    // Schickt die Nachricht und zeigt die Bot-Antwort Stück für Stück an
+    async function streamBotReply(chatId, text, thinkingIndicator) {
+      const r = await fetch(`/api/chats/${chatId}/messages/stream`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json", "Accept": "text/event-stream" },
+        body: JSON.stringify({ content: text })
+      });
+
+      if (!r.ok || !r.body) {
+        const data = await r.json().catch(() => ({}));
+        throw new Error(data?.error || `Fehler: ${r.status}`);
+      }
+
+      const reader = r.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      let botText = "";
+      let botEl = null;
+
+      // Ein einzelnes SSE-Ereignis ("event: ...\ndata: ...") verarbeiten
+      const handleEvent = (raw) => {
+        let event = "message";
+        let payload = "";
+        raw.split("\n").forEach(line => {
+          if (line.startsWith("event:")) event = line.slice(6).trim();
+          else if (line.startsWith("data:")) payload += line.slice(5).trim();
+        });
+        if (!payload) return;
+        const data = JSON.parse(payload);
+
+        if (event === "error") throw new Error(data.error || "KI Fehler");
+
+        if (event === "message" && data.delta) {
+          // Beim ersten Token: "Denkt nach..." durch die Bot-Blase ersetzen
+          if (!botEl) {
+            removeThinkingIndicator(thinkingIndicator);
+            botEl = renderMessage("", true);
+          }
+          botText += data.delta;
+          const span = botEl && botEl.querySelector(".msg-text");
+          if (span) span.textContent = botText;
+          messagesEl.scrollTop = messagesEl.scrollHeight;
+        }
+      };
+
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let idx;
+        while ((idx = buffer.indexOf("\n\n")) !== -1) {
+          const raw = buffer.slice(0, idx);
+          buffer = buffer.slice(idx + 2);
+          handleEvent(raw);
+        }
+      }
+
+      removeThinkingIndicator(thinkingIndicator);
+    }
+
+    /* ============================================================
+     *  JOB-MODUS: KI LÄUFT IM HINTERGRUND, ERGEBNIS PER LONG-POLL
+     * ============================================================ */
+
+    // Schickt die Nachricht als Job und wartet per Long-Poll auf die Antwort
+    async function sendViaJob(chatId, text, thinkingIndicator) {
+      const r = await fetch(`/api/chats/${chatId}/messages`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json", "Accept": "application/json" },
+        body: JSON.stringify({ content: text, async: true })
+      });
+      let data = await r.json().catch(() => ({}));
+      if (!r.ok) throw new Error(data?.error || `Fehler: ${r.status}`);
+
+      // Server hat direkt geantwortet (kein Job)
+      if (r.status !== 202) {
+        removeThinkingIndicator(thinkingIndicator);
+        if (data.bot_message?.content) renderMessage(data.bot_message.content, true);
+        return;
+      }
+
+      let job = data.job;
+      while (job.status !== "done" && job.status !== "failed") {
+        const p = await fetch(`/api/jobs/${job.id}?wait=25`, { headers: { Accept: "application/json" } });
+        job = await p.json().catch(() => ({}));
+        if (!p.ok) throw new Error(job?.error || `Fehler: ${p.status}`);
+      }
+
+      removeThinkingIndicator(thinkingIndicator);
+      if (job.status === "failed") throw new Error(job.error || "KI Fehler");
+      if (job.result?.bot_message?.content) renderMessage(job.result.bot_message.content, true);
+    }
+
     /* ============================================================
      *  AVATAR-MENÜ (PROFIL / LOGOUT ETC.)
      * ============================================================ */
@@ -165,6 +284,25 @@
      *  CHAT ÖFFNEN (NACHRICHTEN LADEN)
      * ============================================================ */
 
+    // Bereits geladene Nachrichten pro Chat (damit beim Wechseln nur Neues geholt wird)
+    const chatState = {};
+    let loadingOlder = false;
+
+    // Eine Seite Nachrichten vom Server holen (params: before/after/limit)
+    async function fetchMessagesPage(chatId, params = {}) {
+      const qs = new URLSearchParams(params).toString();
+      const url = `/api/chats/${chatId}/messages${qs ? "?" + qs : ""}`;
+      let { ok, data } = await fetchJson(url);
+      if (!ok && data?.archiviert) {
+        // archivierter Chat: einmal explizit auspacken lassen, dann nochmal laden
+        const r = await fetch(`/api/chats/${chatId}/rehydrate`, { method: "POST" });
+        if (!r.ok) throw new Error("Archivierter Chat konnte nicht geladen werden");
+        ({ ok, data } = await fetchJson(url));
+      }
+      if (!ok) throw new Error(data?.error || "Fehler beim Laden");
+      return data;
+    }
+
     // Hilfsfunktion zum Öffnen eines Chats anhand des Sidebar-Elements
     async function openChatByElement(item) {
       if (!item) return;
@@ -180,28 +318,84 @@
       clearMessagesUI();
 
       try {
-        const r = await fetch(`/api/chats/${chatId}/messages`, { headers: { Accept: "application/json" } });
-        const data = await r.json().catch(() => ({}));
-        if (!r.ok) throw new Error(data?.error || "Fehler beim Laden");
-        
-        // Jede Nachricht anzeigen, Bot oder User je nach user_id
-        (data.messages || []).forEach(m => {
-          const isBot = m.user_id === 0; // user_id 0 = Bot/KI
-          renderMessage(m.content, isBot);
-        });
+        let state = chatState[chatId];
+        if (!state) {
+          // Erstes Öffnen: nur die neueste Seite laden
+          const data = await fetchMessagesPage(chatId);
+          state = chatState[chatId] = {
+            messages: data.messages || [],
+            beforeCursor: data.before_cursor,
+            afterCursor: data.after_cursor,
+            hasMoreBefore: !!data.has_more
+          };
+        } else {
+          // Schon mal geöffnet: nur neue Nachrichten seit dem letzten Stand holen
+          let more = !!state.afterCursor;
+          while (more) {
+            const data = await fetchMessagesPage(chatId, { after: state.afterCursor, limit: 200 });
+            state.messages.push(...(data.messages || []));
+            state.afterCursor = data.after_cursor || state.afterCursor;
+            more = !!data.has_more;
+          }
+          if (!state.afterCursor) {
+            const data = await fetchMessagesPage(chatId);
+            state.messages = data.messages || [];
+            state.beforeCursor = data.before_cursor;
+            state.afterCursor = data.after_cursor;
+            state.hasMoreBefore = !!data.has_more;
+          }
+        }
+        if (activeChatId !== chatId) return; // inzwischen anderer Chat gewählt
+
+        // Jede Nachricht anzeigen, Bot oder User je nach user_id (0 = Bot/KI)
+        const frag = document.createDocumentFragment();
+        state.messages.forEach(m => frag.appendChild(buildMessageEl(m.content, m.user_id === 0)));
+        messagesEl.appendChild(frag);
+        messagesEl.scrollTop = messagesEl.scrollHeight;
       } catch (err) {
         console.error(err);
         Swal.fire({ icon: "error", title: "Fehler", text: "Nachrichten konnten nicht geladen werden." });
       }
     }
 
+    // Ältere Nachrichten nachladen, wenn ganz nach oben gescrollt wird
+    async function loadOlderMessages() {
+      const chatId = activeChatId;
+      const state = chatState[chatId];
+      if (!state || !state.hasMoreBefore || loadingOlder) return;
+
+      loadingOlder = true;
+      try {
+        const data = await fetchMessagesPage(chatId, { before: state.beforeCursor });
+        const older = data.messages || [];
+        state.messages.unshift(...older);
+        state.beforeCursor = data.before_cursor;
+        state.hasMoreBefore = !!data.has_more;
+        if (activeChatId !== chatId) return;
+
+        // Oben einfügen, ohne dass die Ansicht springt
+        const oldHeight = messagesEl.scrollHeight;
+        const frag = document.createDocumentFragment();
+        older.forEach(m => frag.appendChild(buildMessageEl(m.content, m.user_id === 0)));
+        messagesEl.prepend(frag);
+        messagesEl.scrollTop += messagesEl.scrollHeight - oldHeight;
+      } catch (err) {
+        console.error("Fehler beim Nachladen:", err);
+      } finally {
+        loadingOlder = false;
+      }
+    }
+
+    messagesEl.addEventListener("scroll", () => {
+      if (messagesEl.scrollTop < 60) loadOlderMessages();
+    });
+
     /* ============================================================
      *  CHATS VOM SERVER LADEN UND SIDEBAR AUFBAUEN
      * ============================================================ */
 
-    fetch("/api/chats")
-      .then((r) => r.json())
-      .then(async (d) => {
+    fetchJson("/api/chats")
+      .then(async ({ data: d }) => {
         if (!d.chats || d.chats.length === 0) return;
         list.innerHTML = "";
 
@@ -353,6 +547,7 @@
           if (el && el.parentNode) {
             el.remove();
           }
+          delete chatState[menuChatId];
           
           closeMenu();
 
@@ -523,27 +718,12 @@
           const thinkingIndicator = renderThinkingIndicator();
 
           try {
-            // Nachricht an Backend schicken
-            const r = await fetch(`/api/chats/${activeChatId}/messages`, {
-              method: "POST",
-              headers: { "Content-Type": "application/json", "Accept": "application/json" },
-              body: JSON.stringify({ content: text })
-            });
-            
-            const data = await r.json().catch(() => ({}));
-            
-            if (!r.ok) {
-              throw new Error(data?.error || `Fehler: ${r.status}`);
-            }
-
-            // "Denkt nach..." wieder entfernen
-            removeThinkingIndicator(thinkingIndicator);
-
-            // Bot-Antwort anzeigen, falls vorhanden
-            if (data.bot_message && data.bot_message.content) {
-              renderMessage(data.bot_message.content, true);
+            // Nachricht an Backend schicken, Antwort kommt als Stream oder über einen Job
+            if (document.body.dataset.kiModus === "job") {
+              await sendViaJob(activeChatId, text, thinkingIndicator);
+            } else {
+              await streamBotReply(activeChatId, text, thinkingIndicator);
             }
-
           } catch (err) {
             console.error(err);
             removeThinkingIndicator(thinkingIndicator);
@@ -574,9 +754,8 @@
     // Beim Laden: Theme vom Server holen
     (async () => {
       try {
-        const r = await fetch("/api/farben", { method: "GET", headers: { Accept: "application/json" } });
-        const data = await r.json().catch(() => ({}));
-        applyTheme((r.ok && data?.theme) ? data.theme : "pink");
+        const { ok, data } = await fetchJson("/api/farben");
+        applyTheme((ok && data?.theme) ? data.theme : "pink");
       } catch {
         applyTheme("pink");
       }
@@ -0,0 +1,206 @@
+import re
+import unicodedata
+
+from sqlalchemy import DateTime, text
+
+# FTS5-Index über Nachrichten und Chat-Titel (nur SQLite).
+# Die Texte liegen nicht doppelt im Index: die Views unten sind die "external
+# content"-Quelle, Trigger halten den Index bei jedem INSERT/UPDATE/DELETE aktuell.
+# owner (= Chat.user_id) ist eine indizierte Spalte, damit "owner:7 AND ..." die
+# Suche schon im Index auf einen User einschränkt.
+FTS_SCHEMA = [
+    "CREATE VIEW IF NOT EXISTS nachricht_fts_quelle AS"
+    " SELECT m.id AS id, c.user_id AS owner, m.content AS content"
+    " FROM chat_message m JOIN chat c ON c.id = m.chat_id",
+    "CREATE VIEW IF NOT EXISTS chat_fts_quelle AS SELECT id, user_id AS owner, title FROM chat",
+
+    "CREATE VIRTUAL TABLE IF NOT EXISTS nachricht_fts USING fts5("
+    " owner, content, content='nachricht_fts_quelle', content_rowid='id',"
+    " tokenize='unicode61 remove_diacritics 2')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS chat_fts USING fts5("
+    " owner, title, content='chat_fts_quelle', content_rowid='id',"
+    " tokenize='unicode61 remove_diacritics 2')",
+
+    # Nachrichten (beim Löschen muss der Chat noch existieren, siehe delete_chats)
+    """CREATE TRIGGER IF NOT EXISTS chat_message_fts_ai AFTER INSERT ON chat_message BEGIN
+        INSERT INTO nachricht_fts(rowid, owner, content)
+        SELECT new.id, c.user_id, new.content FROM chat c WHERE c.id = new.chat_id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS chat_message_fts_ad AFTER DELETE ON chat_message BEGIN
+        INSERT INTO nachricht_fts(nachricht_fts, rowid, owner, content)
+        SELECT 'delete', old.id, c.user_id, old.content FROM chat c WHERE c.id = old.chat_id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS chat_message_fts_au AFTER UPDATE OF content ON chat_message BEGIN
+        INSERT INTO nachricht_fts(nachricht_fts, rowid, owner, content)
+        SELECT 'delete', old.id, c.user_id, old.content FROM chat c WHERE c.id = old.chat_id;
+        INSERT INTO nachricht_fts(rowid, owner, content)
+        SELECT new.id, c.user_id, new.content FROM chat c WHERE c.id = new.chat_id;
+    END""",
+
+    # Chat-Titel
+    """CREATE TRIGGER IF NOT EXISTS chat_fts_ai AFTER INSERT ON chat BEGIN
+        INSERT INTO chat_fts(rowid, owner, title) VALUES (new.id, new.user_id, new.title);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS chat_fts_ad AFTER DELETE ON chat BEGIN
+        INSERT INTO chat_fts(chat_fts, rowid, owner, title) VALUES ('delete', old.id, old.user_id, old.title);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS chat_fts_au AFTER UPDATE OF title ON chat BEGIN
+        INSERT INTO chat_fts(chat_fts, rowid, owner, title) VALUES ('delete', old.id, old.user_id, old.title);
+        INSERT INTO chat_fts(rowid, owner, title) VALUES (new.id, new.user_id, new.title);
+    END""",
+
+    # Archivierte Chats (wartung.py): die Nachrichten liegen nur noch komprimiert in
+    # chat_archiv, daher ein Index ohne gespeicherten Text, rowid = chat_id. Zum Löschen
+    # braucht FTS5 dann die Originalwerte -> index_archiv/unindex_archiv mit demselben Text.
+    "CREATE VIRTUAL TABLE IF NOT EXISTS archiv_fts USING fts5("
+    " owner, content, content='',"
+    " tokenize='unicode61 remove_diacritics 2')",
+]
+
+SNIPPET_START = "«"
+SNIPPET_END = "»"
+
+
+def install_fts(conn, rebuild=True):
+    """Index, Views und Trigger anlegen; rebuild=True liest alle bestehenden Zeilen ein"""
+    if conn.dialect.name != "sqlite":
+        return False
+    for stmt in FTS_SCHEMA:
+        conn.execute(text(stmt))
+    if rebuild:
+        rebuild_fts(conn)
+    return True
+
+
+def rebuild_fts(conn):
+    conn.execute(text("INSERT INTO nachricht_fts(nachricht_fts) VALUES ('rebuild')"))
+    conn.execute(text("INSERT INTO chat_fts(chat_fts) VALUES ('rebuild')"))
+
+
+# =========================
+# Archiv-Index (von wartung.py beim Archivieren/Auspacken gepflegt)
+
+def archiv_text(contents):
+    """Alle Nachrichten eines archivierten Chats als ein Dokument"""
+    return "\n".join(contents)
+
+
+def index_archiv(conn, chat_id, content):
+    if conn.dialect.name != "sqlite":
+        return
+    conn.execute(text(
+        "INSERT INTO archiv_fts(rowid, owner, content)"
+        " SELECT id, user_id, :content FROM chat WHERE id = :c"
+    ), {"c": chat_id, "content": content})
+
+
+def unindex_archiv(conn, chat_id, content):
+    """content muss derselbe Text wie beim Indizieren sein (contentless FTS5)"""
+    if conn.dialect.name != "sqlite":
+        return
+    conn.execute(text(
+        "INSERT INTO archiv_fts(archiv_fts, rowid, owner, content)"
+        " SELECT 'delete', id, user_id, :content FROM chat WHERE id = :c"
+    ), {"c": chat_id, "content": content})
+
+
+def fts_query(user_input, column):
+    """Freitext in eine sichere FTS5-Abfrage übersetzen (alle Wörter, letztes als Präfix)"""
+    terms = re.findall(r"\w+", user_input.lower())[:12]
+    if not terms:
+        return None
+    parts = [f'"{t}"' for t in terms[:-1]] + [f'"{terms[-1]}"*']
+    return f"{column}:({' AND '.join(parts)})"
+
+
+# ohne Aliase, damit schema.assert_no_table_scan die Tabellen im Plan erkennt
+SEARCH_MESSAGES = text(
+    "SELECT chat_message.id, chat_message.chat_id, chat.title, chat_message.user_id, chat_message.created_at,"
+    " snippet(nachricht_fts, 1, :start, :end, '…', 16) AS snippet,"
+    " bm25(nachricht_fts, 0.0, 1.0) AS rank"
+    " FROM nachricht_fts"
+    " JOIN chat_message ON chat_message.id = nachricht_fts.rowid"
+    " JOIN chat ON chat.id = chat_message.chat_id"
+    " WHERE nachricht_fts MATCH :match"
+    " ORDER BY rank LIMIT :limit OFFSET :offset"
+).columns(created_at=DateTime)
+
+
+def search_params(user_id, user_input, limit=20, offset=0):
+    """Parameter für SEARCH_MESSAGES, None wenn der Suchtext keine Wörter enthält"""
+    match = fts_query(user_input, "content")
+    if match is None:
+        return None
+    return {
+        "match": f"owner:{int(user_id)} AND {match}",
+        "start": SNIPPET_START,
+        "end": SNIPPET_END,
+        "limit": limit + 1,
+        "offset": offset,
+    }
+
+
+def search_messages(conn, user_id, user_input, limit=20, offset=0):
+    """Nachrichten eines Users nach bm25 sortiert, mit Snippet; (rows, has_more)"""
+    params = search_params(user_id, user_input, limit, offset)
+    if params is None:
+        return [], False
+    rows = conn.execute(SEARCH_MESSAGES, params).all()
+    return rows[:limit], len(rows) > limit
+
+
+def search_chats(conn, user_id, user_input, limit=5):
+    match = fts_query(user_input, "title")
+    if match is None:
+        return []
+    return conn.execute(text(
+        "SELECT rowid AS id, highlight(chat_fts, 1, :start, :end) AS title"
+        " FROM chat_fts WHERE chat_fts MATCH :match"
+        " ORDER BY bm25(chat_fts, 0.0, 1.0) LIMIT :limit"
+    ), {
+        "match": f"owner:{int(user_id)} AND {match}",
+        "start": SNIPPET_START,
+        "end": SNIPPET_END,
+        "limit": limit,
+    }).all()
+
+
+def search_archived(conn, user_id, user_input, limit=5):
+    """Archivierte Chats, deren Nachrichten passen; data (Blob) für das Snippet"""
+    match = fts_query(user_input, "content")
+    if match is None:
+        return []
+    return conn.execute(text(
+        "SELECT chat.id AS chat_id, chat.title, chat_archiv.data"
+        " FROM archiv_fts"
+        " JOIN chat ON chat.id = archiv_fts.rowid"
+        " JOIN chat_archiv ON chat_archiv.chat_id = archiv_fts.rowid"
+        " WHERE archiv_fts MATCH :match"
+        " ORDER BY bm25(archiv_fts, 0.0, 1.0) LIMIT :limit"
+    ), {"match": f"owner:{int(user_id)} AND {match}", "limit": limit}).all()
+
+
+def _fold(word):
+    # wie tokenize='unicode61 remove_diacritics 2': klein, ohne Akzente
+    return "".join(ch for ch in unicodedata.normalize("NFKD", word.lower()) if not unicodedata.combining(ch))
+
+
+def text_snippet(texts, user_input, words=16):
+    """Snippet wie snippet() von FTS5, für Texte ohne gespeicherten Index (Archiv)"""
+    terms = [_fold(t) for t in re.findall(r"\w+", user_input)[:12]]
+    if not terms:
+        return None
+
+    def hit(token):
+        parts = [_fold(p) for p in re.findall(r"\w+", token)]
+        return any(p in terms[:-1] or p.startswith(terms[-1]) for p in parts)
+
+    for content in texts:
+        tokens = content.split()
+        first = next((i for i, token in enumerate(tokens) if hit(token)), None)
+        if first is None:
+            continue
+        start = max(0, first - words // 4)
+        part = [f"{SNIPPET_START}{t}{SNIPPET_END}" if hit(t) else t for t in tokens[start:start + words]]
+        return ("…" if start else "") + " ".join(part) + ("…" if start + words < len(tokens) else "")
+    return None
@@ -1,10 +1,18 @@
 from datetime import datetime
 import os
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from functools import partial
 from pathlib import Path
 from flask_admin import Admin, AdminIndexView
 from flask_admin.contrib.sqla import ModelView
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, Response, stream_with_context, g, send_from_directory, has_request_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, func, or_, and_, select
+from sqlalchemy.orm import object_session
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
-from time import time
+from time import time, perf_counter
+import click
@@ -0,0 +1,41 @@
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_ollama import free_port, start_fake_ollama  # noqa: E402
+
+# Vor dem Import von app1: eigene Temp-DB und ein Fake-Ollama statt des echten Servers
+TMP = tempfile.mkdtemp(prefix="ki_tests_")
+FAKE_SETTINGS = {"tokens": 5, "token_rate": 0, "first_token_ms": 0, "think_tokens": 0}
+fake_ollama = start_fake_ollama(free_port(), **FAKE_SETTINGS)
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(TMP, 'test.db')}"
+os.environ["OLLAMA_HOST"] = f"http://127.0.0.1:{fake_ollama.server_port}"
+
+import app1  # noqa: E402
+
+_namen = itertools.count(1)
+
+
+@pytest.fixture
+def fake():
+    """Fake-Ollama; Einstellungen gelten nur für den einen Test"""
+    yield fake_ollama
+    for name, value in FAKE_SETTINGS.items():
+        setattr(fake_ollama, name, value)
+
+
+@pytest.fixture
+def client():
+    """Test-Client mit frisch registriertem, angemeldetem User"""
+    c = app1.app.test_client()
+    name = f"tester{next(_namen)}"
+    c.post("/register", data={"username": name, "password": "geheim123"})
+    c.post("/anmelden", data={"username": name, "password": "geheim123"})
+    assert c.get("/api/chats").status_code == 200
+    return c
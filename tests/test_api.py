@@ -0,0 +1,155 @@
+from datetime import datetime, timedelta
+
+from werkzeug.security import generate_password_hash
+
+import app1
+from app1 import Chat, ChatMessage, User, db
+
+
+def new_chat(client, title=None):
+    chat_id = client.post("/api/chats").json["id"]
+    if title:
+        client.put(f"/api/chats/{chat_id}", json={"title": title})
+    return chat_id
+
+
+def user_id(client):
+    with client.session_transaction() as s:
+        return s["user_id"]
+
+
+def add_messages(chat_id, uid, contents, start=None):
+    """Nachrichten direkt in die DB, eine Minute Abstand (ohne KI)"""
+    start = start or datetime.utcnow() - timedelta(hours=1)
+    with app1.app.app_context():
+        db.session.add_all(ChatMessage(chat_id=chat_id, user_id=uid, content=c,
+                                       created_at=start + timedelta(minutes=i))
+                           for i, c in enumerate(contents))
+        db.session.commit()
+        app1.versionen.bump(("chat", chat_id))
+
+
+def page(client, chat_id, **params):
+    r = client.get(f"/api/chats/{chat_id}/messages", query_string=params)
+    assert r.status_code == 200, r.json
+    return r.json
+
+
+def contents(data):
+    return [m["content"] for m in data["messages"]]
+
+
+def test_keyset_vorher_und_nachher(client):
+    chat_id = new_chat(client)
+    add_messages(chat_id, user_id(client), [f"n{i}" for i in range(5)])
+
+    neueste = page(client, chat_id, limit=2)
+    assert contents(neueste) == ["n3", "n4"] and neueste["has_more"]
+    aelter = page(client, chat_id, limit=2, before=neueste["before_cursor"])
+    assert contents(aelter) == ["n1", "n2"]
+    rest = page(client, chat_id, limit=2, before=aelter["before_cursor"])
+    assert contents(rest) == ["n0"] and not rest["has_more"]
+
+    assert contents(page(client, chat_id, after=neueste["after_cursor"])) == []
+    # später gespeichert, aber mit älterer Zeit (wie die User-Nachricht nach der Generierung)
+    add_messages(chat_id, user_id(client), ["spaet"], start=datetime.utcnow() - timedelta(days=1))
+    neu = page(client, chat_id, after=neueste["after_cursor"])
+    assert contents(neu) == ["spaet"]
+    assert contents(page(client, chat_id, after=neu["after_cursor"])) == []
+
+    r = client.get(f"/api/chats/{chat_id}/messages", query_string={"before": "kaputt"})
+    assert r.status_code == 400
+
+
+def test_suche_nur_eigene_chats(client):
+    chat_id = new_chat(client)
+    add_messages(chat_id, user_id(client), ["Das Zauberwort heißt Quasselstrippe."])
+
+    r = client.get("/api/search", query_string={"q": "Quasselstrippe"})
+    assert [hit["chat_id"] for hit in r.json["results"]] == [chat_id]
+
+    other = app1.app.test_client()
+    other.post("/register", data={"username": "neugierig", "password": "geheim123"})
+    other.post("/anmelden", data={"username": "neugierig", "password": "geheim123"})
+    r = other.get("/api/search", query_string={"q": "Quasselstrippe"})
+    assert r.status_code == 200
+    assert r.json["results"] == [] and r.json["chats"] == []
+
+
+def test_export_import(client):
+    chat_id = new_chat(client, "Rundreise")
+    add_messages(chat_id, user_id(client), ["Frage mit Ümlaut", "Antwort"])
+    export = client.get("/api/export?gzip=1")
+    assert export.status_code == 200
+    assert "filename*=UTF-8''" in export.headers["Content-Disposition"]
+
+    other = app1.app.test_client()
+    other.post("/register", data={"username": "empfaenger", "password": "geheim123"})
+    other.post("/anmelden", data={"username": "empfaenger", "password": "geheim123"})
+    r = other.post("/api/import", data=export.data, content_type="application/gzip")
+    assert r.status_code == 201
+    assert r.json == {"chats": 1, "nachrichten": 2}
+
+    chats = other.get("/api/chats").json["chats"]
+    assert [c["title"] for c in chats] == ["Rundreise"]
+    assert contents(page(other, chats[0]["id"])) == ["Frage mit Ümlaut", "Antwort"]
+
+    kaputt = b'{"typ": "export", "version": 1}\n{"typ": "chat", "id": 1, "title": "x"}\n' \
+             b'{"typ": "nachricht", "chat_id": 1, "role": "user", "content": null}\n'
+    r = other.post("/api/import", data=kaputt, content_type="application/x-ndjson")
+    assert r.status_code == 400
+    with app1.app.app_context():   # nichts halb importiert
+        assert Chat.query.filter_by(user_id=user_id(other)).count() == 1
+
+
+def test_archivieren_und_auspacken(client):
+    chat_id = new_chat(client, "Altes Zeug")
+    add_messages(chat_id, user_id(client), ["Archivwort Pfefferminz", "Antwort"],
+                 start=datetime.utcnow() - timedelta(days=400))
+    with app1.app.app_context():
+        assert app1.wartung_einmal()["chats_archiviert"] >= 1
+        assert ChatMessage.query.filter_by(chat_id=chat_id).count() == 0
+
+    # GET schreibt nicht: erst nach dem expliziten POST gibt es die Nachrichten wieder
+    r = client.get(f"/api/chats/{chat_id}/messages")
+    assert r.status_code == 409 and r.json["archiviert"]
+    assert [a["chat_id"] for a in client.get("/api/search?q=Pfefferminz").json["archiv"]] == [chat_id]
+    assert "Pfefferminz" in client.get("/api/export").get_data(as_text=True)
+    with app1.app.app_context():
+        assert app1.is_archived(chat_id)
+
+    assert client.post(f"/api/chats/{chat_id}/rehydrate").json == {"nachrichten": 2}
+    assert contents(page(client, chat_id)) == ["Archivwort Pfefferminz", "Antwort"]
+    assert client.get("/api/search?q=Pfefferminz").json["archiv"] == []
+
+
+def test_job_modus(client):
+    chat_id = new_chat(client)
+    r = client.post(f"/api/chats/{chat_id}/messages", json={"content": "Bitte im Hintergrund", "async": True})
+    assert r.status_code == 202
+    job = r.json["job"]
+    assert r.headers["Location"].endswith(f"/api/jobs/{job['id']}")
+
+    r = client.get(f"/api/jobs/{job['id']}?wait=10")
+    assert r.json["status"] == "done"
+    assert r.json["result"]["bot_message"]["content"].startswith("wort0")
+    assert contents(page(client, chat_id))[0] == "Bitte im Hintergrund"
+    assert len(page(client, chat_id)["messages"]) == 2
+
+    assert client.get("/api/jobs/gibtesnicht").status_code == 404
+
+
+def test_passwort_wird_beim_login_neu_gehasht():
+    with app1.app.app_context():
+        user = User(username="altkunde")
+        user.password_hash = generate_password_hash("geheim123", method="pbkdf2:sha256:1000")
+        db.session.add(user)
+        db.session.commit()
+
+    c = app1.app.test_client()
+    r = c.post("/anmelden", data={"username": "altkunde", "password": "geheim123"})
+    assert r.status_code == 302
+    with app1.app.app_context():
+        pw_hash = User.query.filter_by(username="altkunde").one().password_hash
+    assert pw_hash.startswith(app1.app.config["PASSWORT_METHODE"] + "$")
+    assert app1.passwort_dienst.check(pw_hash, "geheim123")
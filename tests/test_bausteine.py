@@ -0,0 +1,225 @@
+import gc
+import io
+import os
+import threading
+import time
+
+import pytest
+
+from ki import ThinkFilter
+from ki_dispatch import KiDispatcher
+from ki_jobs import JobWorkerPool, SqliteJobStore, new_job
+from router import ModelRouter, load_routing
+from singleflight import FlightTimeout, SingleFlight
+from upload import UploadFehler, stream_upload
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 200
+
+
+def warten(bedingung, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not bedingung():
+        assert time.monotonic() < deadline, "Bedingung nicht erfüllt"
+        time.sleep(0.001)
+
+
+# =========================
+# ThinkFilter
+
+def filtern(chunks):
+    f = ThinkFilter()
+    visible = "".join(f.feed(c) for c in chunks) + f.flush()
+    return visible, f.think_text
+
+
+def test_think_tags_ueber_stueckgrenzen():
+    text = "<think>erst überlegen</think>\n\nDie Antwort."
+    # jede mögliche Stelle, an der ein Tag zerschnitten werden kann
+    for cut in range(1, len(text)):
+        assert filtern([text[:cut], text[cut:]]) == ("Die Antwort.", "erst überlegen")
+    assert filtern(list(text)) == ("Die Antwort.", "erst überlegen")
+
+
+def test_think_ohne_tags_und_angeschnittenes_tag():
+    assert filtern(["a < b", " und <thi", "s ist kein Tag"]) == ("a < b und <this ist kein Tag", "")
+    assert filtern(["<think>bricht ab"]) == ("", "bricht ab")
+
+
+# =========================
+# SingleFlight
+
+def test_singleflight_fan_out():
+    flight = SingleFlight(wait_timeout=5)
+    start = threading.Event()
+    calls = []
+
+    def gen():
+        calls.append(1)
+        start.wait(5)
+        yield from ["a", "b", "c"]
+
+    readers = [flight.stream("k", gen) for _ in range(3)]
+    results = [None] * 3
+
+    def read(i):
+        results[i] = list(readers[i])
+
+    threads = [threading.Thread(target=read, args=(i,)) for i in range(3)]
+    for t in threads:
+        t.start()
+    start.set()
+    for t in threads:
+        t.join(5)
+    assert results == [["a", "b", "c"]] * 3
+    assert len(calls) == 1
+    assert flight.stats()["coalesced"] == 2
+
+    # do(): Follower bekommen das Ergebnis des Leaders
+    release = threading.Event()
+    out = []
+    leader = threading.Thread(target=lambda: out.append(flight.do("x", lambda: release.wait(5) and 42)))
+    leader.start()
+    follower = threading.Thread(target=lambda: out.append(flight.do("x", lambda: 0)))
+    follower.start()
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert out == [42, 42]
+
+
+def test_singleflight_abbruch():
+    flight = SingleFlight(wait_timeout=5)
+    stopped = threading.Event()
+    produced = []
+
+    def gen():
+        try:
+            for i in range(10_000):
+                produced.append(i)
+                yield str(i)
+                stopped.wait(0.001)
+        finally:
+            stopped.set()
+
+    first = flight.stream("k", gen)
+    second = flight.stream("k", gen)
+    assert next(first) == "0"
+    del second            # nie gelesen: muss sich trotzdem abmelden
+    gc.collect()
+    first.close()
+    assert stopped.wait(5)
+    assert len(produced) < 10_000
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_singleflight_follower_timeout():
+    flight = SingleFlight(wait_timeout=0.2)
+    release = threading.Event()
+    leader = threading.Thread(target=lambda: flight.do("x", lambda: release.wait(5)))
+    leader.start()
+    warten(lambda: flight.stats()["in_flight"] == 1)
+    with pytest.raises(FlightTimeout):
+        flight.do("x", lambda: None)
+    release.set()
+    leader.join(5)
+
+    def slow():
+        yield "a"
+        release.clear()
+        release.wait(1)
+        yield "b"
+
+    with pytest.raises(FlightTimeout):
+        list(flight.stream("s", slow))
+
+
+# =========================
+# Job-Queue: Lease statt "beim Start alles zurücksetzen"
+
+def test_job_lease(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    store = SqliteJobStore(path, lease=0.5)
+    store.put(new_job({"n": 1}, user_id=1))
+    job = store.claim()
+
+    other = SqliteJobStore(path, lease=0.5)      # zweiter Prozess auf derselben Datei
+    assert other.claim() is None                 # laufender Job bleibt beim ersten
+    time.sleep(0.3)
+    store.touch([job["id"]])
+    time.sleep(0.3)
+    assert other.claim() is None                 # Heartbeat hat den Lease verlängert
+    time.sleep(0.7)
+    again = other.claim()                        # Lease abgelaufen: Job wird neu vergeben
+    assert (again["id"], again["attempts"]) == (job["id"], 2)
+
+    # der Pool hält den Lease selbst am Leben, auch wenn der Job länger läuft
+    runs = []
+    pool = JobWorkerPool(SqliteJobStore(str(tmp_path / "pool.db"), lease=0.3),
+                         lambda j: runs.append(j["id"]) or time.sleep(0.8) or "ok", workers=2)
+    pool.start()
+    job = pool.submit({}, user_id=1)
+    assert pool.wait(job["id"], 5)["result"] == "ok"
+    pool.stop()
+    assert runs == [job["id"]]
+
+
+# =========================
+# Modell-Routing
+
+def test_router_regeln():
+    dispatcher = KiDispatcher(limits={"deepseek-r1:8b": 1}, max_queue=4, wait_timeout=1)
+    router = ModelRouter(load_routing(os.path.join(ROOT, "routing.json")), dispatcher=dispatcher)
+
+    assert router.choose("Hallo, wie geht's?")["route"] == "schnell"
+    assert router.choose("Warum ist der Himmel blau?")["route"] == "nachdenken"
+    assert router.choose("Mein PYTHON-Skript hat einen Bug")["model"] == "deepseek-r1:8b"
+    assert router.choose("a" * 201)["route"] == "nachdenken"
+    assert router.fallback_for(router.choose("erklär mir das"))["route"] == "schnell"
+
+    # teures Modell voll ausgelastet und jemand wartet -> gleich das Fallback
+    release = threading.Event()
+    holder = threading.Thread(target=lambda: dispatcher.run("deepseek-r1:8b", release.wait, 5))
+    waiter = threading.Thread(target=lambda: dispatcher.run("deepseek-r1:8b", lambda: None))
+    holder.start()
+    warten(lambda: dispatcher.stats()["deepseek-r1:8b"]["running"] == 1)
+    waiter.start()
+    warten(lambda: dispatcher.is_saturated("deepseek-r1:8b"))
+    route = router.choose("Warum?")
+    assert (route["route"], route["fallback_from"]) == ("schnell", "nachdenken")
+    release.set()
+    holder.join(5)
+    waiter.join(5)
+
+
+# =========================
+# Upload
+
+def multipart(data, filename="bild.png"):
+    body = (b"--xyz\r\n"
+            b'Content-Disposition: form-data; name="avatar"; filename="' + filename.encode() + b'"\r\n'
+            b"Content-Type: application/octet-stream\r\n\r\n" + data + b"\r\n--xyz--\r\n")
+    return io.BytesIO(body), len(body)
+
+
+def test_stream_upload(tmp_path):
+    stream, length = multipart(PNG)
+    path, kind = stream_upload(stream, "xyz", "avatar", max_bytes=1024, content_length=length,
+                               chunk_size=16, tmp_dir=tmp_path)
+    assert kind == "png"
+    with open(path, "rb") as f:
+        assert f.read() == PNG
+
+
+@pytest.mark.parametrize("data, content_length, status", [
+    (PNG + b"\x00" * 2000, None, 413),             # beim Lesen zu groß
+    (PNG, 10 ** 9, 413),                            # Content-Length schon zu groß
+    (b"MZ\x90\x00 kein Bild, sondern ein Programm", None, 400),
+])
+def test_stream_upload_abgelehnt(tmp_path, data, content_length, status):
+    stream, _length = multipart(data)
+    with pytest.raises(UploadFehler) as e:
+        stream_upload(stream, "xyz", "avatar", max_bytes=1024, content_length=content_length,
+                      chunk_size=16, tmp_dir=tmp_path)
+    assert e.value.status == status
+    assert list(tmp_path.iterdir()) == []          # keine Temp-Datei übrig
@@ -0,0 +1,30 @@
+import pytest
+
+import app1
+from app1 import db
+from schema import assert_no_table_scan, table_scans
+
+
+def test_hot_queries_ohne_table_scan():
+    with app1.app.app_context():
+        results = app1.audit_hot_queries()
+    names = {name for name, _plan, _error in results}
+    assert {"nachrichten_vorher", "nachrichten_nachher", "export", "suche"} <= names
+    errors = [error for _name, _plan, error in results if error]
+    assert errors == []
+
+
+def test_table_scan_wird_erkannt():
+    with app1.app.app_context():
+        with pytest.raises(AssertionError, match="SCAN chat_message"):
+            assert_no_table_scan(db, app1.ChatMessage.query.filter(app1.ChatMessage.content == "x"), "ohne_index")
+    assert table_scans(["SCAN chat USING COVERING INDEX ix_chat_user_created"]) != []
+    assert table_scans(["SCAN nachricht_fts VIRTUAL TABLE INDEX 0:M2", "SEARCH chat USING INTEGER PRIMARY KEY (rowid=?)"]) == []
+
+
+def test_altes_plan_format():
+    # SQLite < 3.36 schreibt "SCAN TABLE <name>" bzw. "SEARCH TABLE <name>"
+    assert table_scans(["SCAN TABLE chat_message"]) == ["SCAN TABLE chat_message"]
+    assert table_scans(["SCAN TABLE chat USING COVERING INDEX ix_chat_user_created"]) != []
+    assert table_scans(["SEARCH TABLE chat_message USING INDEX ix_chat_message_chat_created (chat_id=?)",
+                        "SCAN TABLE login_history"]) == []
@@ -0,0 +1,81 @@
+import app1
+from app1 import Chat, ChatMessage, db
+
+
+def new_chat(client):
+    return client.post("/api/chats").json["id"]
+
+
+def messages(client, chat_id):
+    return [m["content"] for m in client.get(f"/api/chats/{chat_id}/messages").json["messages"]]
+
+
+def test_antwort_vom_modell(client):
+    chat_id = new_chat(client)
+    r = client.post(f"/api/chats/{chat_id}/messages", json={"content": "Wie geht es dir heute?"})
+    assert r.status_code == 201
+    assert r.json["bot_message"]["content"].startswith("wort0")
+    assert len(messages(client, chat_id)) == 2
+
+
+def test_leere_antwort_wird_gespeichert(client, fake):
+    fake.tokens = 0
+    chat_id = new_chat(client)
+    r = client.post(f"/api/chats/{chat_id}/messages", json={"content": "Sag bitte gar nichts."})
+    assert r.status_code == 201
+    assert r.json["bot_message"]["content"] == ""
+
+    r = client.post(f"/api/chats/{chat_id}/messages/stream", json={"content": "Und jetzt gestreamt?"})
+    assert r.status_code == 200
+    assert "event: done" in r.get_data(as_text=True)
+    assert messages(client, chat_id) == ["Sag bitte gar nichts.", "", "Und jetzt gestreamt?", ""]
+
+
+def test_geloeschte_chat_id_wird_nicht_wiederverwendet(client):
+    chat_id = new_chat(client)
+    client.post(f"/api/chats/{chat_id}/messages", json={"content": "Geheime Nachricht"})
+    assert client.delete(f"/api/chats/{chat_id}").status_code == 200
+
+    other = app1.app.test_client()
+    other.post("/register", data={"username": "nachmieter", "password": "geheim123"})
+    other.post("/anmelden", data={"username": "nachmieter", "password": "geheim123"})
+    new_id = new_chat(other)
+    assert new_id > chat_id
+    assert messages(other, new_id) == []
+
+
+def test_orm_loeschen_nimmt_nachrichten_mit(client):
+    chat_id = new_chat(client)
+    client.post(f"/api/chats/{chat_id}/messages", json={"content": "Wird mitgelöscht"})
+    with app1.app.app_context():
+        db.session.delete(db.session.get(Chat, chat_id))
+        db.session.commit()
+        assert ChatMessage.query.filter_by(chat_id=chat_id).count() == 0
+    assert client.get(f"/api/chats/{chat_id}/messages").status_code == 404
+
+
+def test_etag_wird_ungueltig(client):
+    chat_id = new_chat(client)
+    client.post(f"/api/chats/{chat_id}/messages", json={"content": "Erste Frage"})
+    r = client.get(f"/api/chats/{chat_id}/messages")
+    etag = r.headers["ETag"]
+    assert client.get(f"/api/chats/{chat_id}/messages", headers={"If-None-Match": etag}).status_code == 304
+
+    # neue Nachricht über die API
+    client.post(f"/api/chats/{chat_id}/messages", json={"content": "Zweite Frage"})
+    r = client.get(f"/api/chats/{chat_id}/messages", headers={"If-None-Match": etag})
+    assert r.status_code == 200
+    etag = r.headers["ETag"]
+
+    # direkt über die Session geändert (Mapper-Events)
+    with app1.app.app_context():
+        msg = ChatMessage.query.filter_by(chat_id=chat_id).first()
+        msg.content = "geändert"
+        db.session.commit()
+    r = client.get(f"/api/chats/{chat_id}/messages", headers={"If-None-Match": etag})
+    assert r.status_code == 200
+    assert r.json["messages"][0]["content"] == "geändert"
+
+    liste = client.get("/api/chats").headers["ETag"]
+    client.put(f"/api/chats/{chat_id}", json={"title": "Neuer Titel"})
+    assert client.get("/api/chats", headers={"If-None-Match": liste}).status_code == 200
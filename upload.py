@@ -0,0 +1,106 @@
+import os
+import tempfile
+
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData
+
+# Erkennung am Dateianfang statt an der Endung
+MAGIC_BYTES = (
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+)
+SNIFF_BYTES = 12
+
+
+class UploadFehler(ValueError):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def sniff_image(head):
+    """Bildtyp anhand der ersten Bytes, sonst None"""
+    for magic, kind in MAGIC_BYTES:
+        if head.startswith(magic):
+            return kind
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def stream_upload(stream, boundary, field_name, max_bytes, content_length=None, chunk_size=64 * 1024,
+                  tmp_dir=None):
+    """Eine Datei aus einem multipart/form-data-Body stückweise in eine Temp-Datei schreiben.
+
+    Der Body wird nicht komplett gepuffert: zu große Uploads (Content-Length
+    oder tatsächlich gelesene Bytes) und Dateien, die kein Bild sind, brechen
+    ab, sobald es feststeht. Gibt (pfad, bildtyp) zurück; der Aufrufer muss die
+    Temp-Datei wieder löschen.
+    """
+    if content_length is not None and content_length > max_bytes + 64 * 1024:
+        raise UploadFehler("Datei ist zu groß.", 413)
+
+    decoder = MultipartDecoder(boundary.encode("latin-1"), max_form_memory_size=64 * 1024)
+    out = path = kind = None
+    in_file = done = False
+    head = b""
+    size = 0
+
+    try:
+        while not done:
+            chunk = stream.read(chunk_size)
+            decoder.receive_data(chunk or None)
+            event = decoder.next_event()
+            while not isinstance(event, (Epilogue, NeedData)):
+                if isinstance(event, File):
+                    in_file = event.name == field_name and path is None and bool(event.filename)
+                    if in_file:
+                        fd, path = tempfile.mkstemp(prefix="avatar_", suffix=".upload", dir=tmp_dir)
+                        out = os.fdopen(fd, "wb")
+                elif isinstance(event, Data):
+                    if in_file:
+                        size += len(event.data)
+                        if size > max_bytes:
+                            raise UploadFehler("Datei ist zu groß.", 413)
+                        if kind is None:
+                            head += event.data[:SNIFF_BYTES]
+                            if len(head) >= SNIFF_BYTES or not event.more_data:
+                                kind = sniff_image(head)
+                                if kind is None:
+                                    raise UploadFehler("Die Datei ist kein gültiges Bild.")
+                        out.write(event.data)
+                        if not event.more_data:
+                            in_file = False
+                            out.close()
+                            out = None
+                else:
+                    in_file = False   # andere Felder werden ignoriert
+                event = decoder.next_event()
+            done = isinstance(event, Epilogue) or not chunk
+    except UploadFehler:
+        _discard(out, path)
+        raise
+    except RequestEntityTooLarge as e:
+        # MAX_CONTENT_LENGTH des Frameworks hat beim Lesen zugeschlagen
+        _discard(out, path)
+        raise UploadFehler("Datei ist zu groß.", 413) from e
+    except Exception as e:
+        _discard(out, path)
+        raise UploadFehler(f"Upload abgebrochen: {e}") from e
+
+    if out is not None or path is None or kind is None:
+        _discard(out, path)
+        raise UploadFehler("Keine Datei ausgewählt.")
+    return path, kind
+
+
+def _discard(out, path):
+    if out is not None:
+        out.close()
+    if path:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,215 @@
+import json
+import logging
+import threading
+import zlib
+from collections import namedtuple
+from datetime import datetime, timedelta
+from time import perf_counter
+
+from sqlalchemy import DateTime, bindparam, text
+
+from kontext import extractive_summary
+from suche import archiv_text, index_archiv, unindex_archiv
+
+log = logging.getLogger("wartung")
+
+
+# =========================
+# Archiv-Blobs (komprimierte Nachrichten eines Chats)
+
+ArchivZeile = namedtuple("ArchivZeile", "user_id content created_at")
+
+
+def pack_messages(rows):
+    """[(user_id, content, created_at), ...] -> zlib-komprimiertes JSON"""
+    data = [[r.user_id, r.content, r.created_at.isoformat()] for r in rows]
+    return zlib.compress(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 9)
+
+
+def unpack_messages(blob):
+    return [ArchivZeile(user_id, content, datetime.fromisoformat(created))
+            for user_id, content, created in json.loads(zlib.decompress(blob))]
+
+
+def summarize_rows(rows, max_turns=20, max_chars=80):
+    turns = [("assistant" if r.user_id == 0 else "user", r.content) for r in rows[:max_turns]]
+    summary = extractive_summary("", turns, max_chars=max_chars)
+    if len(rows) > max_turns:
+        summary += f"\n… ({len(rows) - max_turns} weitere Nachrichten)"
+    return summary
+
+
+# =========================
+# Einzelne Wartungsschritte (jeweils in kleinen Transaktionen)
+
+def prune_login_history(engine, older_than_days, batch=1000):
+    """LoginHistory älter als N Tage löschen, batchweise"""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    deleted = 0
+    while True:
+        with engine.begin() as conn:
+            n = conn.execute(text(
+                "DELETE FROM login_history WHERE id IN"
+                " (SELECT id FROM login_history WHERE login_time < :cutoff LIMIT :batch)"
+            ), {"cutoff": cutoff, "batch": batch}).rowcount
+        deleted += n
+        if n < batch:
+            return deleted
+
+
+def chats_to_archive(engine, older_than_days, limit):
+    """Chats, deren letzte Nachricht älter als N Tage ist (und die noch Nachrichten haben)
+
+    Pro Chat ein MAX() über ix_chat_message_chat_created (ein Index-Zugriff),
+    statt chat_message komplett zu gruppieren. Leere Chats liefern NULL und fallen raus.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    with engine.connect() as conn:
+        return [row[0] for row in conn.execute(text(
+            "SELECT id FROM chat"
+            " WHERE (SELECT MAX(created_at) FROM chat_message WHERE chat_id = chat.id) < :cutoff"
+            " LIMIT :limit"
+        ), {"cutoff": cutoff, "limit": limit})]
+
+
+def archive_chat(conn, chat_id):
+    """Nachrichten eines Chats in einen Blob verschieben; gibt die Anzahl zurück.
+
+    Läuft in der Transaktion von conn (Commit macht der Aufrufer).
+    """
+    rows = conn.execute(text(
+        "SELECT user_id, content, created_at FROM chat_message WHERE chat_id = :c"
+        " ORDER BY created_at, id"
+    ).columns(created_at=DateTime), {"c": chat_id}).all()
+    if not rows:
+        return 0
+    old = conn.execute(text("SELECT data FROM chat_archiv WHERE chat_id = :c"), {"c": chat_id}).first()
+    if old is not None:
+        # schon (teilweise) archiviert: alte und neue Nachrichten zusammenlegen
+        old_rows = unpack_messages(old[0])
+        unindex_archiv(conn, chat_id, archiv_text(r.content for r in old_rows))
+        rows = old_rows + list(rows)
+        conn.execute(text("DELETE FROM chat_archiv WHERE chat_id = :c"), {"c": chat_id})
+    conn.execute(text(
+        "INSERT INTO chat_archiv (chat_id, summary, message_count, data, archived_at)"
+        " VALUES (:c, :s, :n, :d, :t)"
+    ), {"c": chat_id, "s": summarize_rows(rows), "n": len(rows), "d": pack_messages(rows),
+        "t": datetime.utcnow()})
+    # bleibt über archiv_fts durchsuchbar (die Trigger nehmen die Nachrichten aus nachricht_fts)
+    index_archiv(conn, chat_id, archiv_text(r.content for r in rows))
+    conn.execute(text("DELETE FROM chat_message WHERE chat_id = :c"), {"c": chat_id})
+    return len(rows)
+
+
+def rehydrate_chat(conn, chat_id, batch=1000):
+    """Archivierte Nachrichten zurück in chat_message schreiben (neue ids, alte Zeiten)"""
+    row = conn.execute(text("SELECT data FROM chat_archiv WHERE chat_id = :c"), {"c": chat_id}).first()
+    if row is None:
+        return 0
+    messages = unpack_messages(row[0])
+    insert = text("INSERT INTO chat_message (chat_id, user_id, content, created_at)"
+                  " VALUES (:c, :u, :content, :t)")
+    for i in range(0, len(messages), batch):
+        conn.execute(insert, [{"c": chat_id, "u": m.user_id, "content": m.content, "t": m.created_at}
+                              for m in messages[i:i + batch]])
+    unindex_archiv(conn, chat_id, archiv_text(m.content for m in messages))
+    conn.execute(text("DELETE FROM chat_archiv WHERE chat_id = :c"), {"c": chat_id})
+    return len(messages)
+
+
+def drop_archives(conn, chat_ids):
+    """Archive der Chats samt Suchindex löschen (vor dem Löschen der Chats aufrufen)"""
+    deleted = 0
+    for chat_id, data in conn.execute(text("SELECT chat_id, data FROM chat_archiv WHERE chat_id IN :ids")
+                                      .bindparams(bindparam("ids", expanding=True)),
+                                      {"ids": list(chat_ids)}).all():
+        unindex_archiv(conn, chat_id, archiv_text(m.content for m in unpack_messages(data)))
+        deleted += conn.execute(text("DELETE FROM chat_archiv WHERE chat_id = :c"), {"c": chat_id}).rowcount
+    return deleted
+
+
+def reindex_archives(conn):
+    """archiv_fts komplett neu aus chat_archiv aufbauen; gibt die Anzahl Chats zurück"""
+    if conn.dialect.name != "sqlite":
+        return 0
+    conn.execute(text("INSERT INTO archiv_fts(archiv_fts) VALUES ('delete-all')"))
+    n = 0
+    for chat_id, data in conn.execute(text("SELECT chat_id, data FROM chat_archiv")).all():
+        index_archiv(conn, chat_id, archiv_text(m.content for m in unpack_messages(data)))
+        n += 1
+    return n
+
+
+def sqlite_housekeeping(engine, vacuum_pages=2000, enable_incremental=False):
+    """Freie Seiten zurückgeben, Statistiken auffrischen, WAL kürzen (nur SQLite)"""
+    if engine.dialect.name != "sqlite":
+        return {}
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        mode = conn.exec_driver_sql("PRAGMA auto_vacuum").scalar()
+        if mode != 2 and enable_incremental:
+            # einmalig: auf incremental umstellen, braucht ein volles VACUUM
+            conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.exec_driver_sql("VACUUM")
+            mode = 2
+        freed = 0
+        if mode == 2:
+            before = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+            conn.exec_driver_sql(f"PRAGMA incremental_vacuum({int(vacuum_pages)})")
+            freed = before - conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+        conn.exec_driver_sql("PRAGMA analysis_limit = 1000")
+        conn.exec_driver_sql("PRAGMA optimize")      # ANALYZE nur, wo es sich lohnt
+        conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+        return {"auto_vacuum": mode, "seiten_frei": freed}
+
+
+# =========================
+# Zeitgesteuert im Hintergrund
+
+class Wartung:
+    """Führt run_once() alle interval Sekunden in einem Hintergrund-Thread aus"""
+
+    def __init__(self, run_once, interval=3600, first_delay=300, name="wartung"):
+        self.run_once = run_once
+        self.interval = interval
+        self.first_delay = first_delay
+        self.name = name
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_run = None
+        self.last_result = None
+        self.last_error = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        delay = self.first_delay
+        while not self._stop.wait(delay):
+            self.run()
+            delay = self.interval
+
+    def run(self, **kwargs):
+        start = perf_counter()
+        try:
+            self.last_result = self.run_once(**kwargs)
+            self.last_error = None
+            log.info("wartung_fertig", extra={"felder": {"dauer": round(perf_counter() - start, 1),
+                                                         **(self.last_result or {})}})
+        except Exception as e:
+            self.last_error = str(e)
+            log.exception("wartung_fehler", extra={"felder": {"fehler": str(e)}})
+        self.last_run = datetime.utcnow()
+        return self.last_result
+
+    def stats(self):
+        return {
+            "last_run": self.last_run.isoformat() if self.last_run else None,
+            "last_result": self.last_result,
+            "last_error": self.last_error,
+        }